@@ -0,0 +1,58 @@
+"""
+Copyright @emontj 2024
+
+Compares 64-character SHA-256 hex title hashes with 64-bit blake2b article keys:
+key generation, the run_analysis anti-join, and the size of the lookup index.
+
+Run from the repository root: python -m benchmarks.bench_article_keys
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+
+import pandas as pd
+
+from production.backend.collector import add_hashed_column, article_keys
+
+ROWS = 200_000
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def index_bytes(values, column_type):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'keys.sqlite3')
+        connection = sqlite3.connect(path)
+        connection.execute(f'CREATE TABLE keys (k {column_type})')
+        connection.executemany('INSERT INTO keys VALUES (?)', ((v,) for v in values))
+        connection.commit()
+        before = os.path.getsize(path)
+        connection.execute('CREATE UNIQUE INDEX ux_keys ON keys (k)')
+        connection.commit()
+        after = os.path.getsize(path)
+        connection.close()
+        return after - before
+
+if __name__ == '__main__':
+    df = pd.DataFrame({
+        'title': [f'Headline number {i} about the federal budget' for i in range(ROWS)],
+        'outlet': ['Guardian'] * ROWS,
+        'link': [f'https://news.invalid/{i}' for i in range(ROWS)],
+    })
+
+    _, sha_seconds = timed(lambda: add_hashed_column(df, 'title', 'hashed_title'))
+    keys, key_seconds = timed(lambda: article_keys(df['title'], df['outlet'], df['link']))
+    df['article_key'] = keys
+
+    analyzed = df.sample(frac=0.9, random_state=0)
+    _, sha_isin = timed(lambda: df[~df['hashed_title'].isin(analyzed['hashed_title'])])
+    _, key_isin = timed(lambda: df[~df['article_key'].isin(analyzed['article_key'])])
+
+    print(f'{ROWS} rows')
+    print(f"{'':>12} {'generate s':>11} {'anti-join s':>12} {'index MiB':>10}")
+    print(f"{'sha256 hex':>12} {sha_seconds:>11.3f} {sha_isin:>12.3f} {index_bytes(df['hashed_title'], 'TEXT') / 2**20:>10.1f}")
+    print(f"{'blake2b i64':>12} {key_seconds:>11.3f} {key_isin:>12.3f} {index_bytes(df['article_key'].tolist(), 'INTEGER') / 2**20:>10.1f}")
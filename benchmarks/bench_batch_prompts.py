@@ -0,0 +1,45 @@
+"""
+Copyright @emontj 2024
+
+Tokens per article and articles per second of single-article prompts against batched JSON prompts
+of increasing size, on the local mock chat completions server with a fixed per-request latency.
+
+Run from the repository root: python -m benchmarks.bench_batch_prompts
+"""
+
+import time
+
+import pandas as pd
+
+from production.backend.analyzer import analyze_all_rows
+from tests.local_servers import MockChatCompletionsServer
+
+ARTICLES = 120
+LATENCY = 0.25
+MAX_IN_FLIGHT = 4
+BATCH_SIZES = [1, 5, 10, 20]
+
+def articles(count=ARTICLES):
+    return pd.DataFrame({
+        'title': [f'Senate committee advances bill on subject{i}' for i in range(count)],
+        'summary': ['Lawmakers on the committee voted along party lines after a long debate over spending levels and oversight provisions.'] * count,
+        'hashed_title': [f'hash{i}' for i in range(count)],
+        'article_key': range(count),
+    })
+
+if __name__ == '__main__':
+    df = articles()
+    print(f'{ARTICLES} articles, {LATENCY * 1000:.0f} ms per request, {MAX_IN_FLIGHT} requests in flight')
+    print(f"{'batch':>5} {'requests':>8} {'tokens/article':>14} {'articles/s':>10}")
+
+    for batch_size in BATCH_SIZES:
+        with MockChatCompletionsServer(latency=LATENCY) as server:
+            backend = server.backend()
+            start = time.perf_counter()
+            result = analyze_all_rows(df, max_in_flight=MAX_IN_FLIGHT, backend=backend, batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+            backend.close()
+
+        stats = backend.stats()
+        tokens = (stats['prompt_tokens'] + stats['completion_tokens']) / len(result)
+        print(f'{batch_size:>5} {stats["calls"]:>8} {tokens:>14.0f} {len(result) / elapsed:>10.1f}')
@@ -0,0 +1,60 @@
+"""
+Copyright @emontj 2024
+
+Throughput, checkpoint latency and memory of run_analysis over growing backlogs with the stub backend,
+storing results in checkpoints as they complete instead of keeping every analysis for one final write.
+
+Run from the repository root: python -m benchmarks.bench_checkpointed_writes
+"""
+
+import os
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from production.backend.analyzer import checkpoint_listeners, run_analysis
+from production.backend.collector import add_rows_without_duplicates
+from production.backend.llm_backends import StubBackend
+
+BACKLOGS = [2_500, 5_000, 10_000]
+CHECKPOINT_SIZE = 50
+
+def stored_articles(engine, count):
+    add_rows_without_duplicates(pd.DataFrame({
+        'title': [f'Senate committee advances bill on subject{i}' for i in range(count)],
+        'summary': ['Lawmakers on the committee voted along party lines after a long debate.'] * count,
+        'outlet': ['CNN'] * count,
+        'hashed_title': [f'hash{i}' for i in range(count)],
+        'article_key': range(count),
+    }), engine, 'news_rss', ['article_key'])
+
+if __name__ == '__main__':
+    checkpoints = []
+    checkpoint_listeners.append(lambda rows, seconds: checkpoints.append((seconds, tracemalloc.get_traced_memory()[0])))
+
+    print(f'{CHECKPOINT_SIZE} rows per checkpoint')
+    print(f"{'articles':>8} {'keep':>5} {'articles/s':>10} {'p50 ms':>7} {'max ms':>7} {'first MiB':>9} {'last MiB':>8} {'peak MiB':>8}")
+
+    for count in BACKLOGS:
+        for keep_results in (True, False):
+            with tempfile.TemporaryDirectory() as directory:
+                engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.sqlite3')}")
+                stored_articles(engine, count)
+                checkpoints.clear()
+
+                tracemalloc.start()
+                start = time.perf_counter()
+                run_analysis(engine, backend=StubBackend(), checkpoint_size=CHECKPOINT_SIZE, keep_results=keep_results)
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                engine.dispose()
+
+            latencies = sorted(seconds for seconds, _ in checkpoints)
+            print(
+                f'{count:>8} {str(keep_results):>5} {count / elapsed:>10.0f} {latencies[len(latencies) // 2] * 1000:>7.1f} '
+                f'{latencies[-1] * 1000:>7.1f} {checkpoints[0][1] / 2**20:>9.1f} {checkpoints[-1][1] / 2**20:>8.1f} {peak / 2**20:>8.1f}'
+            )
@@ -0,0 +1,110 @@
+"""
+Copyright @emontj 2024
+
+Latency of /counts as the GROUP BY over analyzed_rss it used to run against top_counts reading
+the rollups, over 100k and 1M analyses, and what the rollup triggers add to storing analyses.
+
+Run from the repository root: python -m benchmarks.bench_counts
+"""
+
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+from production.backend.migrations import MIGRATIONS, migrate
+from production.backend.rollups import create_rollups, top_counts
+
+ROWS = [100_000, 1_000_000]
+REPEATS = 20
+INSERTS = 50_000
+PEOPLE = 20_000
+TOPICS = 2000
+OUTLETS = ['CNN', 'Fox', 'NPR', 'NBC', 'AP']
+SENTIMENTS = ['positive', 'neutral', 'negative']
+# Migrations up to the rollups, and up to and including them
+ROLLUPS_AT = [migration for _, _, migration in MIGRATIONS].index(create_rollups)
+BEFORE_ROLLUPS = MIGRATIONS[:ROLLUPS_AT]
+WITH_ROLLUPS = MIGRATIONS[:ROLLUPS_AT + 1]
+GROUP_BY_QUERIES = [
+    'SELECT individuals, COUNT(*) AS value_count FROM analyzed_rss GROUP BY individuals ORDER BY value_count DESC',
+    'SELECT topic, COUNT(*) AS value_count FROM analyzed_rss GROUP BY topic ORDER BY value_count DESC',
+]
+
+def analyses(count, first_key=0):
+    rng = random.Random(first_key)
+    people = [1 / (rank + 1) for rank in range(PEOPLE)]
+    topics = [1 / (rank + 1) for rank in range(TOPICS)]
+    names = rng.choices(range(PEOPLE), people, k=count)
+    subjects = rng.choices(range(TOPICS), topics, k=count)
+    return [
+        (f'topic {subjects[i]}', f'person {names[i]}', rng.choice(SENTIMENTS), f'hash{key}', key)
+        for i, key in enumerate(range(first_key, first_key + count))
+    ]
+
+def populate(engine, rows):
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            'INSERT INTO news_rss (outlet, hashed_title, article_key) VALUES (?, ?, ?)',
+            [(OUTLETS[key % len(OUTLETS)], hashed_title, key) for _, _, _, hashed_title, key in rows],
+        )
+        connection.exec_driver_sql('INSERT INTO analyzed_rss (topic, individuals, sentiment, hashed_title, article_key) VALUES (?, ?, ?, ?, ?)', rows)
+
+def median_ms(function):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+def group_by(engine):
+    with engine.connect() as connection:
+        for query in GROUP_BY_QUERIES:
+            connection.execute(text(query)).fetchall()
+
+def rollups(engine):
+    with engine.connect() as connection:
+        for dimension in ('individuals', 'topic', 'outlet', 'sentiment'):
+            top_counts(connection, dimension, 10)
+
+def insert_us(path, migrations, count):
+    """
+    Microseconds per analysis to store count analyses in one transaction.
+    """
+    engine = create_engine(f'sqlite:///{path}')
+    migrate(engine, migrations)
+    rows = analyses(count)
+    start = time.perf_counter()
+    populate(engine, rows)
+    elapsed = time.perf_counter() - start
+    engine.dispose()
+    return elapsed / count * 1e6
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        plain_us = insert_us(os.path.join(directory, 'plain.sqlite3'), BEFORE_ROLLUPS, INSERTS)
+        triggers_us = insert_us(os.path.join(directory, 'triggers.sqlite3'), WITH_ROLLUPS, INSERTS)
+    print(f'Storing {INSERTS} analyses: {plain_us:.1f} us each without rollups, {triggers_us:.1f} us with')
+
+    print(f"{'rows':>9} {'GROUP BY ms':>12} {'rollup ms':>10} {'backfill s':>11}")
+
+    for count in ROWS:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.sqlite3')
+            engine = create_engine(f'sqlite:///{path}')
+            migrate(engine, BEFORE_ROLLUPS)
+            populate(engine, analyses(count))
+
+            start = time.perf_counter()
+            migrate(engine, WITH_ROLLUPS)
+            backfill_seconds = time.perf_counter() - start
+
+            group_by_ms = median_ms(lambda: group_by(engine))
+            rollup_ms = median_ms(lambda: rollups(engine))
+            engine.dispose()
+
+            print(f'{count:>9} {group_by_ms:>12.1f} {rollup_ms:>10.2f} {backfill_seconds:>11.1f}')
@@ -0,0 +1,104 @@
+"""
+Copyright @emontj 2024
+
+Compares the streaming news_rss ingestion path with the previous DataFrame path
+(pd.concat per feed, applymap over the whole frame, per-row hashing, to_sql).
+
+Run from the repository root: python -m benchmarks.bench_ingestion
+"""
+
+import hashlib
+import time
+import tracemalloc
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from production.backend.collector import NEWS_RSS_COLUMNS, insert_records_without_duplicates, iter_news_records
+from production.backend.source_configs import PRODUCTION_NEWS_SOURCES
+
+SIZES = [10_000, 100_000]
+FEEDS = 50
+
+def synthetic_feeds(total_entries, feeds=FEEDS):
+    mapping = PRODUCTION_NEWS_SOURCES['Guardian']['mapping']
+    news_sources = {}
+    feeds_by_outlet = {}
+    per_feed = total_entries // feeds
+
+    for f in range(feeds):
+        outlet = f'Outlet {f}'
+        news_sources[outlet] = {'links': {'politics': f'http://feeds.invalid/{f}'}, 'mapping': mapping}
+        feeds_by_outlet[outlet] = {
+            'outlet': outlet,
+            'politics': {'entries': [
+                {
+                    'title': f'Headline {f}-{i} about the federal budget',
+                    'link': f'https://news.invalid/{f}/{i}',
+                    'summary': 'Lawmakers debated the spending bill late into the night. ' * 3,
+                    'published': 'Mon, 09 Dec 2024 17:58:12 GMT',
+                    'updated': 'Mon, 09 Dec 2024 18:10:00 GMT',
+                    'tags': [{'term': 'Politics'}, {'term': 'Budget'}],
+                    'media_content': [{'url': f'https://img.invalid/{f}/{i}.jpg'}],
+                    'authors': [{'name': 'Pat Political'}],
+                    'id': f'https://news.invalid/{f}/{i}',
+                }
+                for i in range(per_feed)
+            ]},
+        }
+
+    return news_sources, feeds_by_outlet
+
+def legacy_rss_to_dataframe(entries, mapping):
+    items = []
+    for entry in entries:
+        items.append({
+            "title": entry.get(mapping.get("title", None), None),
+            "link": entry.get(mapping.get("link", None), None),
+            "summary": entry.get(mapping.get("summary", None), None),
+            "published": entry.get(mapping.get("published", None), None),
+            "updated": entry.get(mapping.get("updated", None), None),
+            "tags": [tag.get("term", None) for tag in entry.get(mapping.get("tags", None), [])] if mapping.get("tags") else None,
+            "media_content": entry.get(mapping.get("media_content", None), None),
+            "content": entry.get(mapping.get("content", None), None),
+            "authors": entry.get(mapping.get("authors", None), None),
+            "id": entry.get(mapping.get("id", None), None),
+        })
+    return pd.DataFrame(items)
+
+def legacy_ingest(news_sources, feeds_by_outlet, engine):
+    running_df = None
+
+    for outlet, feed in feeds_by_outlet.items():
+        new_df = legacy_rss_to_dataframe(feed['politics']['entries'], news_sources[outlet]['mapping'])
+        new_df['outlet'] = outlet
+        running_df = new_df if running_df is None else pd.concat([running_df, new_df], ignore_index=True)
+
+    running_df = running_df.where(pd.notnull(running_df), None)
+    running_df = running_df.map(lambda x: str(x) if x is not None else x)
+    running_df['hashed_title'] = running_df['title'].apply(lambda val: hashlib.sha256(str(val).encode()).hexdigest())
+    running_df.to_sql('news_rss', engine, if_exists='append')
+
+def streaming_ingest(news_sources, feeds_by_outlet, engine):
+    records = iter_news_records(feeds_by_outlet, news_sources)
+    insert_records_without_duplicates(records, engine, 'news_rss', NEWS_RSS_COLUMNS, ['hashed_title'])
+
+def measure(ingest, news_sources, feeds_by_outlet):
+    engine = create_engine('sqlite:///:memory:')
+    tracemalloc.start()
+    start = time.perf_counter()
+    ingest(news_sources, feeds_by_outlet, engine)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    engine.dispose()
+    return elapsed, peak
+
+if __name__ == '__main__':
+    print(f"{'entries':>8} {'path':>10} {'seconds':>8} {'entries/s':>10} {'peak MiB':>9}")
+
+    for size in SIZES:
+        news_sources, feeds_by_outlet = synthetic_feeds(size)
+        for name, ingest in (('legacy', legacy_ingest), ('streaming', streaming_ingest)):
+            elapsed, peak = measure(ingest, news_sources, feeds_by_outlet)
+            print(f'{size:>8} {name:>10} {elapsed:>8.2f} {size / elapsed:>10.0f} {peak / 2**20:>9.1f}')
@@ -0,0 +1,43 @@
+"""
+Copyright @emontj 2024
+
+Per-call cost of building a new OpenAI client for every article, as analyze_dict used to,
+against one pooled backend for the life of the process, on the local mock chat completions server.
+
+Run from the repository root: python -m benchmarks.bench_llm_backends
+"""
+
+import time
+
+from openai import OpenAI
+
+from tests.local_servers import MockChatCompletionsServer
+
+CALLS = 200
+MESSAGES = [{'role': 'user', 'content': 'Article Title: Senate passes the budget\nArticle Summary: Lawmakers voted late.'}]
+
+def client_per_call(server):
+    for _ in range(CALLS):
+        client = OpenAI(api_key='local', base_url=server.base_url, max_retries=0)
+        client.chat.completions.create(model='gpt-4o-mini', messages=MESSAGES, temperature=0.0)
+
+def pooled_backend(server):
+    backend = server.backend()
+    for _ in range(CALLS):
+        backend.complete(MESSAGES)
+    backend.close()
+    return backend.stats()
+
+if __name__ == '__main__':
+    with MockChatCompletionsServer() as server:
+        start = time.perf_counter()
+        client_per_call(server)
+        per_call = (time.perf_counter() - start) / CALLS
+
+        start = time.perf_counter()
+        stats = pooled_backend(server)
+        pooled = (time.perf_counter() - start) / CALLS
+
+    print(f'{CALLS} sequential calls against the mock server')
+    print(f'client per call: {per_call * 1000:.2f} ms/call, {CALLS} connections')
+    print(f'pooled backend:  {pooled * 1000:.2f} ms/call, {stats["connections_opened"]} connection(s), {stats["connections_reused"]} reused')
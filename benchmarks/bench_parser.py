@@ -0,0 +1,46 @@
+"""
+Copyright @emontj 2024
+
+Parse throughput of the streaming RSS/Atom parser against feedparser on the recorded feed fixtures.
+
+Run from the repository root: python -m benchmarks.bench_parser
+"""
+
+import os
+import time
+
+import feedparser
+
+from production.backend.fast_parser import parse_feed
+from production.backend.source_configs import PRODUCTION_NEWS_SOURCES
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'fixtures', 'feeds')
+ROUNDS = 200
+
+def throughput(parse, documents):
+    entries = 0
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for content in documents:
+            entries += len(parse(content)['entries'])
+    elapsed = time.perf_counter() - start
+    return entries / elapsed, len(documents) * ROUNDS / elapsed
+
+if __name__ == '__main__':
+    documents = []
+    for name in sorted(os.listdir(FIXTURE_DIR)):
+        with open(os.path.join(FIXTURE_DIR, name), 'rb') as f:
+            documents.append(f.read())
+
+    mapping = PRODUCTION_NEWS_SOURCES['Guardian']['mapping']
+    paths = [('fast path' if parse_feed(d, mapping)['parser'] == 'fast' else 'fallback') for d in documents]
+    print(f'{len(documents)} fixtures: {paths.count("fast path")} fast path, {paths.count("fallback")} fallback')
+    print(f"{'parser':>22} {'entries/s':>10} {'feeds/s':>8}")
+
+    for name, parse in (
+        ('feedparser', feedparser.parse),
+        ('fast, all fields', parse_feed),
+        ('fast, Guardian mapping', lambda content: parse_feed(content, mapping)),
+    ):
+        entries_per_second, feeds_per_second = throughput(parse, documents)
+        print(f'{name:>22} {entries_per_second:>10.0f} {feeds_per_second:>8.0f}')
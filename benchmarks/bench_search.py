@@ -0,0 +1,99 @@
+"""
+Copyright @emontj 2024
+
+Latency of /person as the LIKE '%name%' scan it used to run against the analysis_search FTS5 match,
+and of ranked /search queries, over 100k and 1M analyses. People are drawn from a long tail of
+generated names, so a common name matches thousands of rows and a rare one a handful.
+
+Run from the repository root: python -m benchmarks.bench_search
+"""
+
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+from production.backend.migrations import MIGRATIONS, migrate
+from production.backend.pagination import BEFORE_FIRST
+from production.backend.schema import API_QUERIES
+from production.backend.search import person_match, search_match
+
+ROWS = [100_000, 1_000_000]
+REPEATS = 20
+PEOPLE = 5000
+SYLLABLES = ['ka', 'ma', 'la', 'har', 'ris', 'don', 'ald', 'tru', 'mp', 'chu', 'ck', 'van', 'ce', 'wal', 'z', 'bi', 'den', 'hal', 'ey', 'new']
+TOPICS = ['tariffs', 'immigration', 'budget', 'elections', 'healthcare', 'climate', 'courts', 'defense']
+WORDS = ['senate', 'vote', 'bill', 'governor', 'campaign', 'court', 'ruling', 'border', 'trade', 'rally', 'debate', 'poll']
+LIKE_QUERY = 'SELECT * FROM analyzed_rss WHERE individuals LIKE :person_name'
+
+def people(rng):
+    names = set()
+    while len(names) < PEOPLE:
+        names.add(' '.join(''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(2)))
+    return sorted(names)
+
+def populate(engine, count, names):
+    rng = random.Random(0)
+    weights = [1 / (rank + 1) for rank in range(len(names))]
+
+    def person():
+        return rng.choices(names, weights)[0]
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            'INSERT INTO news_rss (title, summary, outlet, hashed_title, article_key) VALUES (?, ?, ?, ?, ?)',
+            [(
+                f'{person().title()} {" ".join(rng.sample(WORDS, 4))}',
+                ' '.join(rng.choices(WORDS, k=25)),
+                'CNN',
+                f'hash{i}',
+                i,
+            ) for i in range(count)],
+        )
+        connection.exec_driver_sql(
+            'INSERT INTO analyzed_rss (topic, individuals, sentiment, hashed_title, article_key) VALUES (?, ?, ?, ?, ?)',
+            [(rng.choice(TOPICS), person() if i % 3 else f'{person()}, {person()}', 'neutral', f'hash{i}', i) for i in range(count)],
+        )
+
+def median_ms(engine, query, params_list):
+    times = []
+    with engine.connect() as connection:
+        for _ in range(REPEATS // len(params_list) or 1):
+            for params in params_list:
+                start = time.perf_counter()
+                connection.execute(text(query), params).fetchall()
+                times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+if __name__ == '__main__':
+    names = people(random.Random(1))
+    # The most common name, then names from the tail
+    queries = {'common': [names[0]], 'rare': [names[i] for i in (1000, 2000, 3000, 4000)]}
+    print(f'{PEOPLE} people, Zipf-distributed')
+    print(f"{'rows':>9} {'names':>6} {'matches':>8} {'index s':>8} {'LIKE ms':>8} {'person ms':>10} {'search ms':>10} {'FTS MiB':>8}")
+
+    for count in ROWS:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.sqlite3')
+            engine = create_engine(f'sqlite:///{path}')
+            migrate(engine, MIGRATIONS[:2])
+            populate(engine, count, names)
+            size_before = os.path.getsize(path)
+
+            start = time.perf_counter()
+            migrate(engine)
+            index_seconds = time.perf_counter() - start
+            fts_bytes = os.path.getsize(path) - size_before
+
+            for kind, names_queried in queries.items():
+                with engine.connect() as connection:
+                    matches = statistics.mean(len(connection.execute(text(LIKE_QUERY), {'person_name': f'%{name}%'}).fetchall()) for name in names_queried)
+                like_ms = median_ms(engine, LIKE_QUERY, [{'person_name': f'%{name}%'} for name in names_queried])
+                person_ms = median_ms(engine, API_QUERIES['person'], [{'match': person_match(name), 'after': BEFORE_FIRST, 'limit': -1} for name in names_queried])
+                search_ms = median_ms(engine, API_QUERIES['search'], [{'match': search_match(name), 'limit': 20} for name in names_queried])
+                print(f'{count:>9} {kind:>6} {matches:>8.0f} {index_seconds:>8.1f} {like_ms:>8.1f} {person_ms:>10.1f} {search_ms:>10.1f} {fts_bytes / 2**20:>8.1f}')
+
+            engine.dispose()
@@ -0,0 +1,63 @@
+"""
+Copyright @emontj 2024
+
+Collection throughput of the sharded multi-process collector against a local fixture server
+serving synthetic feeds with a fixed response delay, for increasing worker counts.
+
+Run from the repository root: python -m benchmarks.bench_sharding
+"""
+
+import os
+import tempfile
+import time
+
+from production.backend.sharding import collect_sharded
+from production.backend.source_configs import PRODUCTION_NEWS_SOURCES
+from tests.local_servers import FeedFixtureServer
+
+FEEDS = 400
+ENTRIES_PER_FEED = 30
+DELAY = 0.1
+THREADS_PER_WORKER = 8
+WORKER_COUNTS = [1, 2, 4]
+
+def write_feeds(directory, feeds=FEEDS, entries=ENTRIES_PER_FEED):
+    for f in range(feeds):
+        items = ''.join(
+            f'''<item>
+                <title>Headline {f}-{i} about the federal budget</title>
+                <link>https://news.invalid/{f}/{i}</link>
+                <guid>https://news.invalid/{f}/{i}</guid>
+                <description>Lawmakers debated the spending bill late into the night.</description>
+                <pubDate>Mon, 09 Dec 2024 17:{i % 60:02d}:12 GMT</pubDate>
+            </item>'''
+            for i in range(entries)
+        )
+        with open(os.path.join(directory, f'feed_{f}.xml'), 'w') as out:
+            out.write(f'<?xml version="1.0"?><rss version="2.0"><channel><title>Feed {f}</title>{items}</channel></rss>')
+
+def news_sources(server, feeds=FEEDS):
+    mapping = PRODUCTION_NEWS_SOURCES['CNN']['mapping']
+    return {f'Outlet {f}': {'links': {'politics': server.url(f'feed_{f}.xml')}, 'mapping': mapping} for f in range(feeds)}
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as feed_directory:
+        write_feeds(feed_directory)
+        delays = {f'feed_{f}.xml': DELAY for f in range(FEEDS)}
+
+        with FeedFixtureServer(feed_directory, delays=delays) as server:
+            sources = news_sources(server)
+            print(f'{FEEDS} feeds x {ENTRIES_PER_FEED} entries, {DELAY * 1000:.0f} ms per response, {THREADS_PER_WORKER} threads per worker')
+            print(f"{'workers':>7} {'seconds':>8} {'feeds/s':>8} {'entries/s':>10} {'speedup':>8}")
+            baseline = None
+
+            for workers in WORKER_COUNTS:
+                with tempfile.TemporaryDirectory() as db_directory:
+                    url = f"sqlite:///{os.path.join(db_directory, 'news.sqlite3')}"
+                    start = time.perf_counter()
+                    report = collect_sharded(sources, url, workers, max_workers=THREADS_PER_WORKER)
+                    elapsed = time.perf_counter() - start
+
+                entries = sum(summary['entries_new'] for summary in report.values())
+                baseline = baseline or elapsed
+                print(f'{workers:>7} {elapsed:>8.2f} {FEEDS / elapsed:>8.0f} {entries / elapsed:>10.0f} {baseline / elapsed:>7.2f}x')
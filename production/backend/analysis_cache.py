@@ -0,0 +1,136 @@
+"""
+Copyright @emontj 2024
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+
+from sqlalchemy import text
+
+from production.backend.collector import KEY_SEPARATOR, normalize_key_text
+
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_MAX_AGE = 30 * 86400
+lookup_listeners = []
+
+def normalize_cache_text(val):
+    """
+    Text as compared by the cache: markup removed, then normalized like article keys,
+    so that copies of a wire story differing only in case, spacing or HTML share an entry.
+    """
+    if val is None or val != val:
+        return ''
+    return normalize_key_text(re.sub(r'<[^>]+>', ' ', str(val)))
+
+def cache_key(prompt_version, model, temperature, title, summary):
+    """
+    Hex blake2b over everything that determines an analysis: prompt template version, model,
+    temperature and the normalized title and summary.
+    """
+    key_text = KEY_SEPARATOR.join((str(prompt_version), str(model), repr(float(temperature)), normalize_cache_text(title), normalize_cache_text(summary)))
+    return hashlib.blake2b(key_text.encode(), digest_size=16).hexdigest()
+
+class AnalysisCache:
+    """
+    Analysis results kept in the analysis_cache table, keyed by cache_key.
+
+    Entries older than max_age seconds are dropped by evict, which also keeps only the max_entries
+    most recently used. The functions in lookup_listeners are called with True for every hit and
+    False for every miss, e.g. to export metrics.
+    """
+
+    def __init__(self, engine, max_entries=DEFAULT_MAX_ENTRIES, max_age=DEFAULT_MAX_AGE):
+        self.engine = engine
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.totals = {'hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                CREATE TABLE IF NOT EXISTS analysis_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+            '''))
+            connection.execute(text('CREATE INDEX IF NOT EXISTS ix_analysis_cache_last_used_at ON analysis_cache (last_used_at)'))
+
+    def record(self, hit):
+        with self.lock:
+            self.totals['hits' if hit else 'misses'] += 1
+
+        for listener in lookup_listeners:
+            listener(hit)
+
+    def get(self, key):
+        """
+        Returns:
+            dict: The cached analysis, or None on a miss or if the entry has expired.
+        """
+        now = time.time()
+
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                text('SELECT result FROM analysis_cache WHERE cache_key = :key AND created_at >= :oldest'),
+                {'key': key, 'oldest': now - self.max_age},
+            ).scalar()
+            if result is not None:
+                connection.execute(text('UPDATE analysis_cache SET last_used_at = :now WHERE cache_key = :key'), {'key': key, 'now': now})
+
+        self.record(result is not None)
+
+        return json.loads(result) if result is not None else None
+
+    def put(self, key, result):
+        now = time.time()
+
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                INSERT INTO analysis_cache (cache_key, result, created_at, last_used_at)
+                VALUES (:key, :result, :now, :now)
+                ON CONFLICT(cache_key) DO UPDATE SET result = excluded.result, created_at = excluded.created_at, last_used_at = excluded.last_used_at
+            '''), {'key': key, 'result': json.dumps(result), 'now': now})
+
+        with self.lock:
+            self.totals['stored'] += 1
+
+    def evict(self):
+        """
+        Drops expired entries, then the least recently used ones beyond max_entries.
+
+        Returns:
+            int: Number of entries removed.
+        """
+        with self.engine.begin() as connection:
+            removed = connection.execute(text('DELETE FROM analysis_cache WHERE created_at < :oldest'), {'oldest': time.time() - self.max_age}).rowcount
+            removed += connection.execute(text('''
+                DELETE FROM analysis_cache WHERE cache_key NOT IN (
+                    SELECT cache_key FROM analysis_cache ORDER BY last_used_at DESC LIMIT :max_entries
+                )
+            '''), {'max_entries': self.max_entries}).rowcount
+
+        with self.lock:
+            self.totals['evicted'] += removed
+
+        return removed
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hits (each one a model call saved), misses, hit rate, entries stored and evicted
+                  since the cache was created, and the current number of entries.
+        """
+        with self.engine.connect() as connection:
+            entries = connection.execute(text('SELECT COUNT(*) FROM analysis_cache')).scalar()
+
+        with self.lock:
+            stats = dict(self.totals, entries=entries)
+
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else None
+        return stats
@@ -0,0 +1,237 @@
+"""
+Copyright @emontj 2024
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import random
+import threading
+import time
+import traceback
+
+DEFAULT_MAX_IN_FLIGHT = 8
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 200_000
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30.0
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+CHARS_PER_TOKEN = 4
+COMPLETION_TOKENS = 50
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at rate_per_minute, holding at most capacity tokens.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """
+        Blocks until amount tokens are available and takes them. Amounts above capacity take the whole bucket.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        amount = min(amount, self.capacity)
+        waited = 0.0
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+
+                wait = (amount - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limits of the chat completions API. Either may be None for no limit.
+    """
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, tokens):
+        if self.requests:
+            self.requests.acquire(1)
+        if self.tokens:
+            self.tokens.acquire(tokens)
+
+class AnalysisBudget:
+    """
+    What one analysis run may spend: chat completion calls, prompt and completion tokens, and wall-clock
+    seconds, plus an optional deadline as a time.time() timestamp. Any of them may be None for no limit.
+    Calls and tokens are read from the backend's stats, so cached and locally answered articles cost nothing.
+    """
+
+    def __init__(self, calls=None, tokens=None, seconds=None, deadline=None):
+        self.calls = calls
+        self.tokens = tokens
+        self.seconds = seconds
+        self.deadline = deadline
+        self.backend = None
+        self.started = None
+        self.baseline = None
+
+    def start(self, backend):
+        self.backend = backend
+        self.started = time.time()
+        self.baseline = backend.stats() if backend else None
+
+    def spent(self):
+        """
+        Returns:
+            dict: calls, tokens and seconds spent since start.
+        """
+        stats = self.backend.stats() if self.backend else None
+        calls = stats['calls'] - self.baseline['calls'] if stats else 0
+        tokens = (stats['prompt_tokens'] + stats['completion_tokens']) - (self.baseline['prompt_tokens'] + self.baseline['completion_tokens']) if stats else 0
+        return {'calls': calls, 'tokens': tokens, 'seconds': time.time() - self.started}
+
+    def remaining(self):
+        """
+        Returns:
+            dict: calls, tokens and seconds left, inf for those without a limit.
+        """
+        spent = self.spent()
+        seconds_left = [limit for limit in (
+            self.seconds - spent['seconds'] if self.seconds is not None else None,
+            self.deadline - time.time() if self.deadline is not None else None,
+        ) if limit is not None]
+
+        return {
+            'calls': self.calls - spent['calls'] if self.calls is not None else float('inf'),
+            'tokens': self.tokens - spent['tokens'] if self.tokens is not None else float('inf'),
+            'seconds': min(seconds_left, default=float('inf')),
+        }
+
+    def exhausted(self):
+        return any(left <= 0 for left in self.remaining().values())
+
+    def affordable(self, costs, batch_size=1):
+        """
+        Number of leading articles whose requests fit in what is left of the budget.
+
+        Args:
+            costs (list): Estimated tokens of each article's request, in order.
+            batch_size (int): Articles per request.
+        """
+        remaining = self.remaining()
+        if remaining['seconds'] <= 0:
+            return 0
+
+        count = len(costs)
+        if remaining['calls'] != float('inf'):
+            count = min(count, max(0, int(remaining['calls'])) * batch_size)
+
+        total = 0
+        for i, cost in enumerate(costs[:count]):
+            total += cost
+            if total > remaining['tokens']:
+                return i
+
+        return count
+
+def estimate_tokens(text, articles=1):
+    """
+    Rough token count of a request: its prompt at about four characters per token plus the expected completion
+    for each article it asks about.
+    """
+    return len(text) // CHARS_PER_TOKEN + COMPLETION_TOKENS * articles
+
+def status_code(error):
+    return getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+
+def is_retryable(error):
+    """
+    Rate limits, server errors, timeouts and dropped connections are retried; other errors are not.
+    """
+    if status_code(error) in RETRYABLE_STATUS_CODES:
+        return True
+    return type(error).__name__ in ('APIConnectionError', 'APITimeoutError', 'ConnectError', 'ReadTimeout', 'RemoteProtocolError')
+
+def retry_delay(error, attempt, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+    """
+    Seconds to wait before retry number attempt: the server's Retry-After if it sent one,
+    otherwise full-jitter exponential backoff so that concurrent callers do not retry in lockstep.
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+
+    try:
+        return min(float(headers.get('retry-after')), max_delay)
+    except (TypeError, ValueError):
+        return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+def call_with_retries(function, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+    for attempt in range(max_retries + 1):
+        try:
+            return function()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            delay = retry_delay(e, attempt, base_delay, max_delay)
+            print(f'Retrying in {delay:.2f} s after {type(e).__name__} (status {status_code(e)})')
+            time.sleep(delay)
+
+def run_bounded(items, function, max_in_flight=DEFAULT_MAX_IN_FLIGHT, limiter=None, cost=None, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY, on_result=None):
+    """
+    Calls function on every item with at most max_in_flight calls running at once, each behind the rate
+    limiter and retried with jittered backoff on rate limits and server errors.
+
+    Args:
+        items (list): Inputs, e.g. row dicts.
+        function (callable): Called with one item; its result is kept.
+        max_in_flight (int): Maximum concurrent calls.
+        limiter (RateLimiter, optional): Acquired before every attempt, including retries.
+        cost (callable, optional): Estimated tokens of an item for the limiter. Defaults to one token.
+        max_retries (int): Retries of a call after the first attempt.
+        base_delay (float): First backoff delay in seconds, doubled on every retry.
+        on_result (callable, optional): Called with the index of an item and its result (None on failure) as soon
+            as its call finishes, e.g. to store results as they arrive. It runs on the calling thread, one result
+            at a time; if it raises, calls not yet started are cancelled.
+
+    Returns:
+        list: One result per item in input order, None where the call failed after its retries.
+    """
+    def attempt(item):
+        if limiter:
+            limiter.acquire(cost(item) if cost else 1)
+        return function(item)
+
+    def run(item):
+        try:
+            return call_with_retries(lambda: attempt(item), max_retries, base_delay)
+        except Exception:
+            print(traceback.format_exc())
+            return None
+
+    if not items:
+        return []
+
+    results = [None] * len(items)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_in_flight, len(items)))) as executor:
+        futures = {executor.submit(run, item): i for i, item in enumerate(items)}
+        try:
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if on_result:
+                    on_result(futures[future], results[futures[future]])
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+
+    return results
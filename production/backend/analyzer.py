@@ -2,41 +2,156 @@
 Copyright @emontj 2024
 """
 
-import os
-import traceback
+import itertools
+import json
+import time
 
 import pandas as pd
-from openai import OpenAI
+from sqlalchemy import bindparam, inspect, text
+
+from production.backend.analysis_cache import cache_key
+from production.backend.analysis_engine import DEFAULT_MAX_IN_FLIGHT, call_with_retries, estimate_tokens, run_bounded
+from production.backend.collector import batched, insert_records_without_duplicates, upgrade_article_keys
+from production.backend.llm_backends import get_backend
+
+ANALYSIS_FIELDS = ('topic', 'individuals', 'sentiment')
+SENTIMENTS = {'positive', 'neutral', 'negative'}
+BATCH_MARKER = 'Articles (JSON):'
+DEFAULT_CHUNK_SIZE = 200
+DEFAULT_CHECKPOINT_SIZE = 20
+checkpoint_listeners = []
+PROMPT_VERSION = 1  # Bump whenever build_prompt or build_batch_prompt changes, so cached analyses are not reused
+TEMPERATURE = 0.0
 
 def read_table(engine, table_name) -> pd.DataFrame:
-    return pd.read_sql(f'SELECT * FROM {table_name}', con=engine, index_col='index')
+    return pd.read_sql(f'SELECT * FROM {table_name}', con=engine)
 
-def analyze_all_rows(df, limit = float('inf')):
-    results_df = None
-    count = 0
+def analyze_all_rows(df, limit = float('inf'), max_in_flight = DEFAULT_MAX_IN_FLIGHT, limiter = None, backend = None, batch_size = 1, cache = None, local = None, on_row = None):
+    """
+    Analyzes the first limit rows of df with up to max_in_flight requests at once.
 
-    for _, row in df.iterrows():
-        # Why not just check index here instead of a counter? Reason: iterrows returns pandas index which may not start at zero depending on how data is passed in.
-        if limit > count:
-            row_dict = row.to_dict()
-            analysis_df = analyze_dict(row_dict)
+    Args:
+        df (pd.DataFrame): Articles with title, summary, hashed_title and article_key.
+        limit (int): Maximum number of articles analyzed.
+        max_in_flight (int): Maximum concurrent chat completion requests.
+        limiter (analysis_engine.RateLimiter, optional): Request and token rate limits shared across calls.
+        backend (llm_backends.LLMBackend, optional): Defaults to the process-wide backend.
+        batch_size (int): Articles per request. Above 1, articles are sent batch_size at a time
+            with a JSON prompt, see analyze_batch.
+        cache (analysis_cache.AnalysisCache, optional): Articles whose text was analyzed before with the same
+            prompt version, model and temperature are answered from it without a request.
+        local (local_classifier.LocalAnalyzer, optional): Answers the articles it is confident about without
+            a request. Its answers are tagged analyzed_by='local' and never cached.
+        on_row (callable, optional): Called on the calling thread with every analysis row as soon as
+            it is available, e.g. AnalysisWriter.add.
 
-            if results_df is None:
-                results_df = analysis_df
-            else:
-                results_df = pd.concat([results_df, analysis_df], ignore_index=True)
+    Returns:
+        pd.DataFrame: One analysis row per article, in the order of df, or None if nothing was analyzed.
+                      Articles whose request still fails after retries are left out and picked up by the next run.
+    """
+    if len(df) > limit:
+        print('Analysis limit reached')
+        df = df.head(int(limit))
+
+    row_dicts = df.to_dict(orient='records')
+
+    if cache:
+        backend = backend or get_backend()
+        keys = [article_cache_key(row_dict, backend.model) for row_dict in row_dicts]
+        answers = [cache.get(key) for key in keys]
+    else:
+        # Without a cache every article is its own key
+        keys = list(range(len(row_dicts)))
+        answers = [None] * len(row_dicts)
+
+    if local:
+        unanswered = [i for i, answer in enumerate(answers) if answer is None]
+        for i, answer in zip(unanswered, local.answer([row_dicts[i] for i in unanswered])):
+            answers[i] = answer
 
-            count += 1
+    rows = [None] * len(row_dicts)
+
+    def emit(i, analysis):
+        rows[i] = dict(analysis, hashed_title=row_dicts[i]['hashed_title'], article_key=row_dicts[i].get('article_key'))
+        if on_row:
+            on_row(rows[i])
+
+    # With a cache, copies of the same story within df are also sent only once
+    members = {}
+    for i, (key, answer) in enumerate(zip(keys, answers)):
+        if answer is not None:
+            emit(i, answer)
         else:
-            print('Analysis limit reached')
-            break
+            members.setdefault(key, []).append(i)
+
+    pending_keys = list(members)
+    pending = [row_dicts[members[key][0]] for key in pending_keys]
+
+    def complete(position, analysis):
+        if analysis is None:
+            return
 
-    return results_df
+        key = pending_keys[position]
+        analysis = {k: v for k, v in analysis.items() if k not in ('hashed_title', 'article_key')}
+        if cache and all(field in analysis for field in ANALYSIS_FIELDS):
+            cache.put(key, analysis)
+
+        for i in members[key]:
+            emit(i, analysis)
+
+    if batch_size > 1:
+        analyze_in_batches(pending, batch_size, max_in_flight, limiter, backend, on_result=complete)
+    else:
+        run_bounded(
+            pending,
+            lambda row_dict: analyze_dict(row_dict, backend=backend).to_dict(orient='records')[0],
+            max_in_flight=max_in_flight,
+            limiter=limiter,
+            cost=lambda row_dict: estimate_tokens(build_prompt(row_dict)),
+            on_result=complete,
+        )
 
-def analyze_dict(row_dict) -> pd.DataFrame:
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    rows = [row for row in rows if row is not None]
 
-    prompt = f'''
+    if not rows:
+        return None
+
+    return pd.DataFrame(rows)
+
+def analyze_in_batches(row_dicts, batch_size, max_in_flight, limiter, backend, on_result = None):
+    """
+    Args:
+        on_result (callable, optional): Called with the index of each row and its analysis (None if it was not
+            analyzed) as soon as the row's batch finishes.
+
+    Returns:
+        list: An analysis dict per row, in order, or None for rows that were not analyzed.
+    """
+    def complete(prompt, articles):
+        def attempt():
+            if limiter:
+                limiter.acquire(estimate_tokens(prompt, articles))
+            return (backend or get_backend()).complete(analysis_messages(prompt), temperature=TEMPERATURE)['content']
+
+        return call_with_retries(attempt)
+
+    def finished(position, result):
+        if on_result:
+            start = position * batch_size
+            for i, analysis in enumerate(result or [None] * len(batches[position])):
+                on_result(start + i, analysis)
+
+    batches = [row_dicts[i:i + batch_size] for i in range(0, len(row_dicts), batch_size)]
+    # Retries and rate limiting happen per request inside complete, so that a split batch only repeats its own request
+    results = run_bounded(batches, lambda batch: analyze_batch(batch, complete), max_in_flight=max_in_flight, max_retries=0, on_result=finished)
+
+    return [row for batch, result in zip(batches, results) for row in (result or [None] * len(batch))]
+
+def article_cache_key(row_dict, model):
+    return cache_key(PROMPT_VERSION, model, TEMPERATURE, row_dict['title'], row_dict['summary'])
+
+def build_prompt(row_dict):
+    return f'''
         Assess the title and summary of this article, and extract the topic and the most focused-on individual in the article.  Enter none if no individual is mentioned.
         Use First and Last name for individuals regardless of how they are referenced in the article data.  DO NOT include nicknames or middle initials.
         For acronyms in topics, style as all upper-case with no spaces or periods.  For example, "NFL", "NBA", "DOGE".
@@ -52,45 +167,430 @@ def analyze_dict(row_dict) -> pd.DataFrame:
         Article Summary: {row_dict['summary']}
     '''
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are an intelligent assistant that determines characteristics about data"},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.0
-    )
+def build_batch_prompt(row_dicts):
+    articles = [{'key': str(i), 'title': row_dict['title'], 'summary': row_dict['summary']} for i, row_dict in enumerate(row_dicts)]
+
+    return f'''
+        Assess the title and summary of each article below, and extract the topic and the most focused-on individual in each article.  Enter none if no individual is mentioned.
+        Use First and Last name for individuals regardless of how they are referenced in the article data.  DO NOT include nicknames or middle initials.
+        For acronyms in topics, style as all upper-case with no spaces or periods.  For example, "NFL", "NBA", "DOGE".
+        Topics such as "Politics" are too general, so ensure topics representing what the article is about.  Topics like "Tariffs", "Journalism", "Military" are good.
+
+        Output format:
+        Only a JSON array with one object per article, in any order:
+        [{{"key": "<key of the article>", "topic": "<topic, singular>", "individuals": "<the primary individual, singular, as First Last>", "sentiment": "<Positive, Neutral or Negative>"}}]
+
+        {BATCH_MARKER}
+        {json.dumps(articles, ensure_ascii=False)}
+    '''
+
+def analysis_messages(prompt):
+    return [
+        {"role": "system", "content": "You are an intelligent assistant that determines characteristics about data"},
+        {"role": "user", "content": prompt},
+    ]
+
+def parse_analysis(message):
+    """
+    Reads the "Key: value" lines of an analysis reply into a dict with lower-cased keys and values.
+    Lines without a key, such as blank lines, are ignored.
+    """
+    message_parts = [part.strip().lower() for part in message.split('\n')]
+    return {part.split(': ', 1)[0] : part.split(': ', 1)[1] for part in message_parts if ': ' in part}
+
+def parse_batch_analysis(message, keys):
+    """
+    Reads a batch reply into the analysis of each article, lower-cased like parse_analysis.
+    Items that are not objects, have an unknown or repeated key, miss a field or name an unknown sentiment are dropped.
+
+    Args:
+        message (str): Reply to build_batch_prompt, optionally inside a markdown code fence.
+        keys (iterable): Keys of the articles in the batch.
+
+    Returns:
+        dict: Key to {'topic', 'individuals', 'sentiment'} for every article that parsed.
+    """
+    text = message.strip()
+    if text.startswith('```'):
+        text = text.strip('`').strip()
+        text = text[4:] if text.startswith('json') else text
+
+    try:
+        items = json.loads(text)
+    except ValueError:
+        return {}
+
+    if not isinstance(items, list):
+        return {}
+
+    keys = set(keys)
+    parsed = {}
 
-    message = str(completion.choices[0].message.content)
+    for item in items:
+        if not isinstance(item, dict) or str(item.get('key')) not in keys or str(item.get('key')) in parsed:
+            continue
 
-    message_parts = message.split('\n')
-    message_parts = [part.strip() for part in message_parts]
-    message_parts = [part.lower() for part in message_parts]
-    message_parts = {part.split(': ', 1)[0] : part.split(': ', 1)[1] for part in message_parts}
+        values = {field: item.get(field) for field in ANALYSIS_FIELDS}
+        if not all(isinstance(value, str) and value.strip() for value in values.values()):
+            continue
+
+        values = {field: value.strip().lower() for field, value in values.items()}
+        if values['sentiment'] in SENTIMENTS:
+            parsed[str(item['key'])] = values
+
+    return parsed
+
+def analyze_batch(row_dicts, complete):
+    """
+    Analyzes several articles with one request. Articles missing from the reply, or whose item is invalid,
+    are split in two halves and retried until each is asked about alone.
+
+    Args:
+        row_dicts (list): Articles with title, summary, hashed_title and article_key.
+        complete (callable): Takes a prompt and the number of articles in it and returns the reply text.
+
+    Returns:
+        list: An analysis dict per article, in order, or None for articles that never parsed.
+    """
+    if not row_dicts:
+        return []
+
+    parsed = parse_batch_analysis(complete(build_batch_prompt(row_dicts), len(row_dicts)), map(str, range(len(row_dicts))))
+    results = [
+        dict(parsed[str(i)], hashed_title=row_dict['hashed_title'], article_key=row_dict.get('article_key')) if str(i) in parsed else None
+        for i, row_dict in enumerate(row_dicts)
+    ]
+    failed = [i for i, result in enumerate(results) if result is None]
+
+    if failed and len(row_dicts) > 1:
+        failed_rows = [row_dicts[i] for i in failed]
+        half = (len(failed_rows) + 1) // 2
+        retried = analyze_batch(failed_rows[:half], complete) + analyze_batch(failed_rows[half:], complete)
+        for i, result in zip(failed, retried):
+            results[i] = result
+    elif failed:
+        print(f"Could not parse the analysis of article {row_dicts[0]['hashed_title']}")
+
+    return results
+
+def analyze_dict(row_dict, backend = None, cache = None) -> pd.DataFrame:
+    backend = backend or get_backend()
+    key = article_cache_key(row_dict, backend.model) if cache else None
+    message_parts = cache.get(key) if cache else None
+
+    if message_parts is None:
+        prompt = build_prompt(row_dict)
+        completion = backend.complete(analysis_messages(prompt), temperature=TEMPERATURE)
+        message_parts = parse_analysis(completion['content'])
+
+        if cache and all(field in message_parts for field in ANALYSIS_FIELDS):
+            cache.put(key, message_parts)
+
+    message_parts = dict(message_parts)
     message_parts['hashed_title'] = row_dict['hashed_title']
+    message_parts['article_key'] = row_dict.get('article_key')
 
     return pd.DataFrame([message_parts])
 
-def run_analysis(sql_engine, limit = float('inf')):
-    stored_df = read_table(sql_engine, 'news_rss')
+def cluster_analyses(sql_engine, cluster_ids):
+    """
+    Returns:
+        dict: Analysis fields of an already analyzed member of each of the given story clusters.
+    """
+    if not cluster_ids or not inspect(sql_engine).has_table('analyzed_rss'):
+        return {}
+
+    fields = list(ANALYSIS_FIELDS)
+    if 'analyzed_by' in {col['name'] for col in inspect(sql_engine).get_columns('analyzed_rss')}:
+        fields.append('analyzed_by')
+
+    query = text(f'''
+        SELECT story_clusters.cluster_id, {', '.join(f'analyzed_rss.{field}' for field in fields)}
+        FROM analyzed_rss JOIN story_clusters ON story_clusters.article_key = analyzed_rss.article_key
+        WHERE story_clusters.cluster_id IN :ids
+    ''').bindparams(bindparam('ids', expanding=True))
+    analyses = {}
+
+    with sql_engine.connect() as connection:
+        for chunk in batched([int(cluster_id) for cluster_id in cluster_ids], 500):
+            for cluster_id, *values in connection.execute(query, {'ids': chunk}):
+                analyses.setdefault(cluster_id, {field: value for field, value in zip(fields, values) if value is not None})
+
+    return analyses
+
+def analyze_story_clusters(sql_engine, df, clusters, limit = float('inf'), on_row = None, **kwargs):
+    """
+    Analyzes one representative article per story cluster and copies its analysis to the other members.
+    Members of clusters analyzed in an earlier run get that analysis without a request.
+
+    Args:
+        sql_engine (sqlalchemy.Engine): Database holding analyzed_rss.
+        df (pd.DataFrame): Articles to analyze.
+        clusters (story_clusters.StoryClusterIndex): Assigns articles to story clusters.
+        limit (int): Maximum number of representatives analyzed.
+        on_row (callable, optional): Called with every analysis row as soon as it is available, see analyze_all_rows.
+        **kwargs: Passed on to analyze_all_rows.
+
+    Returns:
+        pd.DataFrame: Analysis rows like analyze_all_rows, with their cluster_id, or None if nothing was analyzed.
+    """
+    cluster_ids = clusters.assign(df)
+    df = df.assign(cluster_id=[cluster_ids[int(key)] for key in df['article_key']])
+    row_dicts = df.to_dict(orient='records')
+    rows = [None] * len(row_dicts)
+
+    members = {}
+    for i, row_dict in enumerate(row_dicts):
+        members.setdefault(row_dict['cluster_id'], []).append(i)
+
+    def emit(cluster_id, analysis):
+        for i in members[cluster_id]:
+            rows[i] = dict(analysis, hashed_title=row_dicts[i]['hashed_title'], article_key=row_dicts[i]['article_key'], cluster_id=cluster_id)
+            if on_row:
+                on_row(rows[i])
+
+    analyses = cluster_analyses(sql_engine, set(members))
+    for cluster_id, analysis in analyses.items():
+        emit(cluster_id, analysis)
+
+    representatives = df[~df['cluster_id'].isin(analyses)].drop_duplicates('cluster_id')
+    representative_clusters = dict(zip(representatives['article_key'], representatives['cluster_id']))
+    print(f'Analyzing {len(representatives)} stories for {len(df)} articles')
+
+    analyze_all_rows(
+        representatives.drop(columns='cluster_id'),
+        limit = limit,
+        on_row = lambda row: emit(representative_clusters[row['article_key']], {k: v for k, v in row.items() if k not in ('hashed_title', 'article_key')}),
+        **kwargs,
+    )
+
+    rows = [row for row in rows if row is not None]
+
+    if not rows:
+        return None
+
+    return pd.DataFrame(rows)
+
+def pending_query(news_columns, has_analyses, by_outlet = False):
+    """
+    Keyset-paginated anti-join of news_rss against analyzed_rss behind pending_articles, newest first,
+    restricted to the articles of :outlet when by_outlet is set.
+    """
+    priority = 'coalesce(news_rss.published_ts, 0)' if 'published_ts' in news_columns else '0.0'
+    outlet = 'news_rss.outlet' if 'outlet' in news_columns else 'NULL AS outlet'
+    conditions = ''
+    if has_analyses:
+        conditions += ' AND NOT EXISTS (SELECT 1 FROM analyzed_rss WHERE analyzed_rss.article_key = news_rss.article_key)'
+    if by_outlet:
+        conditions += ' AND news_rss.outlet IS :outlet'
+
+    return text(f'''
+        SELECT news_rss.rowid AS row_id, {priority} AS priority, news_rss.title, news_rss.summary, {outlet},
+               news_rss.hashed_title, news_rss.article_key
+        FROM news_rss
+        WHERE ({priority}, news_rss.rowid) < (:priority, :row_id){conditions}
+        ORDER BY {priority} DESC, news_rss.rowid DESC
+        LIMIT :chunk_size
+    ''')
+
+def pending_pages(sql_engine, query, chunk_size, **params):
+    """
+    Yields the pages of a pending_query, chunk_size rows at a time, each with its priority column.
+    """
+    position = {'priority': float('inf'), 'row_id': 0}
+
+    while True:
+        with sql_engine.connect() as connection:
+            result = connection.execute(query, dict(params, **position, chunk_size=chunk_size))
+            chunk = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+        if chunk.empty:
+            return
+
+        position = {'priority': chunk['priority'].iloc[-1], 'row_id': int(chunk['row_id'].iloc[-1])}
+        yield chunk.drop(columns=['row_id'])
+
+        if len(chunk) < chunk_size:
+            return
+
+def pending_articles(sql_engine, chunk_size = DEFAULT_CHUNK_SIZE, fair = False, include_analyzed = False):
+    """
+    Yields the articles that have no analysis yet, newest first, chunk_size at a time.
+
+    Each chunk is one keyset-paginated anti-join of news_rss against analyzed_rss, answered from
+    the priority index on news_rss and the unique article_key index on analyzed_rss, so memory is
+    bounded by chunk_size however long the history is. Articles left unanalyzed are not yielded
+    again; the next run picks them up.
+
+    Args:
+        fair (bool): Share the queue evenly between outlets: every outlet's newest pending article,
+            then every outlet's second newest, and so on, newest first within each round. Each outlet
+            is paginated separately, so memory is bounded by chunk_size per outlet.
+        include_analyzed (bool): Yield every article, analyzed or not, e.g. to re-analyze the history
+            after a prompt change.
+
+    Yields:
+        pd.DataFrame: Up to chunk_size articles with title, summary, outlet, hashed_title and article_key.
+    """
+    db_inspector = inspect(sql_engine)
+    if not db_inspector.has_table('news_rss'):
+        return
+
+    news_columns = {col['name'] for col in db_inspector.get_columns('news_rss')}
+    has_analyses = db_inspector.has_table('analyzed_rss') and not include_analyzed
+    fair = fair and 'outlet' in news_columns
+
+    if 'published_ts' in news_columns:
+        with sql_engine.begin() as connection:
+            connection.execute(text('CREATE INDEX IF NOT EXISTS ix_news_rss_priority ON news_rss (coalesce(published_ts, 0))'))
+            if fair:
+                connection.execute(text('CREATE INDEX IF NOT EXISTS ix_news_rss_outlet_priority ON news_rss (outlet, coalesce(published_ts, 0))'))
+
+    query = pending_query(news_columns, has_analyses, by_outlet=fair)
+
+    if not fair:
+        for chunk in pending_pages(sql_engine, query, chunk_size):
+            yield chunk.drop(columns=['priority'])
+        return
+
+    with sql_engine.connect() as connection:
+        outlets = [row[0] for row in connection.execute(text('SELECT DISTINCT outlet FROM news_rss'))]
+
+    streams = [
+        itertools.chain.from_iterable(page.to_dict(orient='records') for page in pending_pages(sql_engine, query, chunk_size, outlet=outlet))
+        for outlet in outlets
+    ]
+    buffer = []
+
+    while streams:
+        next_rows = [(stream, next(stream, None)) for stream in streams]
+        streams = [stream for stream, row in next_rows if row is not None]
+        buffer.extend(sorted((row for _, row in next_rows if row is not None), key=lambda row: -row['priority']))
+
+        while len(buffer) >= chunk_size or (buffer and not streams):
+            yield pd.DataFrame(buffer[:chunk_size]).drop(columns=['priority'])
+            buffer = buffer[chunk_size:]
+
+class AnalysisWriter:
+    """
+    Stores analysis rows in analyzed_rss as they arrive, checkpoint_size rows per transaction, so that
+    a failure part way through a run loses at most the rows not yet flushed. Stored articles are left out
+    of pending_articles, so the next run resumes after the last checkpoint. The functions in
+    checkpoint_listeners are called with the number of rows and the seconds taken by every flush.
+    """
+
+    def __init__(self, sql_engine, checkpoint_size = DEFAULT_CHECKPOINT_SIZE, table_name = 'analyzed_rss'):
+        self.sql_engine = sql_engine
+        self.checkpoint_size = checkpoint_size
+        self.table_name = table_name
+        self.buffer = []
+        self.rows_written = 0
+
+    def add(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.checkpoint_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Returns:
+            int: Number of rows inserted; rows of articles that were already stored are skipped.
+        """
+        if not self.buffer:
+            return 0
+
+        rows, self.buffer = self.buffer, []
+        columns = list(dict.fromkeys(col for row in rows for col in row))
+        records = (tuple(None if pd.isna(row.get(col)) else row.get(col) for col in columns) for row in rows)
+        start = time.perf_counter()
+
+        try:
+            written = insert_records_without_duplicates(records, self.sql_engine, self.table_name, columns, ['article_key'])
+        except Exception:
+            self.buffer = rows + self.buffer
+            raise
+
+        self.rows_written += written
+        for listener in checkpoint_listeners:
+            listener(len(rows), time.perf_counter() - start)
+
+        return written
+
+def run_analysis(sql_engine, limit = float('inf'), max_in_flight = DEFAULT_MAX_IN_FLIGHT, limiter = None, backend = None, batch_size = 1, cache = None, clusters = None, local = None, chunk_size = DEFAULT_CHUNK_SIZE, checkpoint_size = DEFAULT_CHECKPOINT_SIZE, keep_results = True, budget = None, fair = True, before_round = None):
+    """
+    Analyzes up to limit unanalyzed articles, newest first, chunk_size at a time, storing results in
+    analyzed_rss as they complete, checkpoint_size per transaction. See analyze_all_rows for the other arguments.
+
+    Args:
+        keep_results (bool): Return the stored rows. Turn off for long backlogs so memory stays
+            bounded by chunk_size.
+        budget (analysis_engine.AnalysisBudget, optional): Calls, tokens and time the run may spend.
+            Articles are then sent in rounds of max_in_flight requests, each cut to what the budget
+            still affords, and the run stops once it is spent; a round that started overruns it by at most
+            its own requests.
+        fair (bool): Share the queue evenly between outlets, see pending_articles.
+        before_round (callable, optional): Called before each round of articles is sent, after the
+            previous one is stored; the run stops when it returns False, as when the lease it runs
+            under is lost.
+
+    Returns:
+        pd.DataFrame: The analysis rows stored by this run, or None if there were none or keep_results is off.
+    """
+    upgrade_article_keys(sql_engine)
+    writer = AnalysisWriter(sql_engine, checkpoint_size)
+    options = dict(max_in_flight = max_in_flight, limiter = limiter, backend = backend, batch_size = batch_size, cache = cache, local = local, on_row = writer.add)
+    analyzed_dfs = []
+    remaining = limit
+
+    if budget:
+        budget.start(backend or get_backend())
+
+    def rounds():
+        round_size = max_in_flight * batch_size if budget else chunk_size
+        for chunk in pending_articles(sql_engine, chunk_size, fair=fair):
+            for start in range(0, len(chunk), round_size):
+                yield chunk.iloc[start:start + round_size]
 
     try:
-        prev_analyzed_df = read_table(sql_engine, 'analyzed_rss')
-    except Exception:
-        prev_analyzed_df = None
-        print(traceback.format_exc())
+        for articles in rounds():
+            if remaining <= 0:
+                print('Analysis limit reached')
+                break
+            if before_round is not None and not before_round():
+                print('Analysis stopped before its next round')
+                break
 
-    if prev_analyzed_df is not None:
-        to_analyze_df = stored_df[~stored_df['hashed_title'].isin(prev_analyzed_df['hashed_title'])]
-    else:
-        to_analyze_df = stored_df
+            articles = articles.head(int(min(remaining, len(articles))))
+
+            if budget:
+                affordable = budget.affordable([estimate_tokens(build_prompt(row_dict)) for row_dict in articles.to_dict(orient='records')], batch_size)
+                if affordable == 0:
+                    print('Analysis budget spent', budget.spent())
+                    break
+                articles = articles.head(affordable)
+
+            remaining -= len(articles)
+
+            if clusters:
+                analyzed_df = analyze_story_clusters(sql_engine, articles, clusters, **options)
+            else:
+                analyzed_df = analyze_all_rows(articles, **options)
+
+            writer.flush()
+            if keep_results and analyzed_df is not None:
+                analyzed_dfs.append(analyzed_df)
+    finally:
+        # Keeps the analyses that completed before an error, too
+        writer.flush()
+        print(f'Stored {writer.rows_written} analyses')
 
-    analyzed_df = analyze_all_rows(to_analyze_df, limit = limit)
+    if cache:
+        cache.evict()
 
-    if sql_engine:
-        analyzed_df.to_sql('analyzed_rss', sql_engine, if_exists='append')
+    if not analyzed_dfs:
+        return None
 
-    return analyzed_df
+    return pd.concat(analyzed_dfs, ignore_index=True)
 
 if __name__ == '__main__':
     analyze_dict(
@@ -0,0 +1,308 @@
+"""
+Copyright @emontj 2024
+"""
+
+import itertools
+import json
+import os
+import shutil
+import time
+import uuid
+
+from sqlalchemy import bindparam, text
+
+from production.backend.analyzer import ANALYSIS_FIELDS, TEMPERATURE, analysis_messages, build_prompt, parse_analysis, pending_articles
+from production.backend.collector import batched, hex_to_key, insert_records_without_duplicates, key_to_hex, upgrade_article_keys
+from production.backend.llm_backends import DEFAULT_MODEL, completion_content, get_backend
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+COMPLETION_WINDOW = '24h'
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+DEFAULT_POLL_INTERVAL = 60.0
+DEFAULT_MAX_REQUESTS = 50_000  # Requests allowed in one OpenAI batch file
+QUERY_CHUNK = 500
+
+def batch_request(row_dict, model):
+    """
+    One line of a batch input file: the chat completion request analyze_dict would send for the article,
+    identified by its article key in hex.
+    """
+    return {
+        'custom_id': key_to_hex(row_dict['article_key']),
+        'method': 'POST',
+        'url': BATCH_ENDPOINT,
+        'body': {'model': model, 'messages': analysis_messages(build_prompt(row_dict)), 'temperature': TEMPERATURE},
+    }
+
+def write_batch_file(row_dicts, path, model):
+    """
+    Writes a JSONL batch input file, one chat completion request per article.
+
+    Returns:
+        int: Number of requests written.
+    """
+    count = 0
+
+    with open(path, 'w', encoding='utf-8') as batch_file:
+        for row_dict in row_dicts:
+            batch_file.write(json.dumps(batch_request(row_dict, model)) + '\n')
+            count += 1
+
+    return count
+
+def read_batch_results(lines):
+    """
+    Reads the lines of a batch output file.
+
+    Yields:
+        tuple: (article_key, analysis dict) for every request that succeeded with a complete analysis.
+               Failed requests are skipped and picked up by the next job.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+
+        result = json.loads(line)
+        response = result.get('response') or {}
+        if result.get('error') or response.get('status_code') != 200:
+            continue
+
+        analysis = parse_analysis(completion_content(response['body']))
+        if all(field in analysis for field in ANALYSIS_FIELDS):
+            yield hex_to_key(result['custom_id']), {field: analysis[field] for field in ANALYSIS_FIELDS}
+
+class OpenAIBatchService:
+    """
+    The OpenAI Batch API: the input file is uploaded, run within the completion window at a discount,
+    and its output file downloaded once the job completes.
+    """
+
+    name = 'openai'
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, path):
+        with open(path, 'rb') as batch_file:
+            uploaded = self.client.files.create(file=batch_file, purpose='batch')
+        return self.client.batches.create(input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT, completion_window=COMPLETION_WINDOW).id
+
+    def status(self, job_id):
+        return self.client.batches.retrieve(job_id).status
+
+    def results(self, job_id):
+        output_file_id = self.client.batches.retrieve(job_id).output_file_id
+        return self.client.files.content(output_file_id).text.splitlines() if output_file_id else []
+
+class LocalBatchService:
+    """
+    File-based stand-in for the batch service, so the whole flow runs offline. Every job is a directory
+    under root holding its input file, its state and, once done, its output file in the Batch API format.
+    A job is answered with backend the first time it is polled latency seconds or more after submission.
+    """
+
+    name = 'local'
+
+    def __init__(self, root, backend=None, latency=0.0):
+        self.root = root
+        self.backend = backend
+        self.latency = latency
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, job_id, name):
+        return os.path.join(self.root, job_id, name)
+
+    def state(self, job_id):
+        with open(self.path(job_id, 'state.json'), encoding='utf-8') as state_file:
+            return json.load(state_file)
+
+    def save_state(self, job_id, state):
+        with open(self.path(job_id, 'state.json'), 'w', encoding='utf-8') as state_file:
+            json.dump(state, state_file)
+
+    def submit(self, path):
+        job_id = f'batch_{uuid.uuid4().hex}'
+        os.makedirs(os.path.join(self.root, job_id))
+        shutil.copyfile(path, self.path(job_id, 'input.jsonl'))
+        self.save_state(job_id, {'status': 'in_progress', 'submitted_at': time.time()})
+        return job_id
+
+    def status(self, job_id):
+        state = self.state(job_id)
+        if state['status'] == 'in_progress' and time.time() - state['submitted_at'] >= self.latency:
+            self.process(job_id)
+            state = self.state(job_id)
+        return state['status']
+
+    def process(self, job_id):
+        backend = self.backend or get_backend()
+
+        with open(self.path(job_id, 'input.jsonl'), encoding='utf-8') as input_file, \
+                open(self.path(job_id, 'output.jsonl'), 'w', encoding='utf-8') as output_file:
+            for line in input_file:
+                request = json.loads(line)
+                result = {'id': f'batch_req_{uuid.uuid4().hex}', 'custom_id': request['custom_id'], 'response': None, 'error': None}
+
+                try:
+                    completion = backend.complete(request['body']['messages'], temperature=request['body'].get('temperature', 0.0))
+                    result['response'] = {
+                        'status_code': 200,
+                        'body': {
+                            'model': request['body']['model'],
+                            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': completion['content']}}],
+                            'usage': {'prompt_tokens': completion['prompt_tokens'], 'completion_tokens': completion['completion_tokens']},
+                        },
+                    }
+                except Exception as e:
+                    result['error'] = {'code': type(e).__name__, 'message': str(e)}
+
+                output_file.write(json.dumps(result) + '\n')
+
+        self.save_state(job_id, dict(self.state(job_id), status='completed'))
+
+    def results(self, job_id):
+        if not os.path.exists(self.path(job_id, 'output.jsonl')):
+            return []
+        with open(self.path(job_id, 'output.jsonl'), encoding='utf-8') as output_file:
+            return output_file.read().splitlines()
+
+class BatchJobStore:
+    """
+    Submitted batch jobs in the analysis_batch_jobs table, so that a job still running when its
+    poller stops is collected by the next run instead of being submitted again.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                CREATE TABLE IF NOT EXISTS analysis_batch_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    service TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    article_count INTEGER NOT NULL,
+                    reanalyze INTEGER NOT NULL DEFAULT 0,
+                    submitted_at REAL NOT NULL,
+                    finished_at REAL,
+                    stored INTEGER
+                )
+            '''))
+
+    def add(self, job_id, service, article_count, reanalyze):
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                INSERT INTO analysis_batch_jobs (job_id, service, status, article_count, reanalyze, submitted_at)
+                VALUES (:job_id, :service, 'submitted', :article_count, :reanalyze, :now)
+            '''), {'job_id': job_id, 'service': service, 'article_count': article_count, 'reanalyze': int(reanalyze), 'now': time.time()})
+
+    def unfinished(self, service):
+        """
+        Returns:
+            dict: The oldest job of service whose results have not been stored, or None.
+        """
+        with self.engine.connect() as connection:
+            row = connection.execute(text('''
+                SELECT job_id, status, article_count, reanalyze FROM analysis_batch_jobs
+                WHERE service = :service AND finished_at IS NULL
+                ORDER BY submitted_at LIMIT 1
+            '''), {'service': service}).mappings().first()
+        return dict(row) if row else None
+
+    def update(self, job_id, status, stored=None):
+        finished_at = time.time() if status in TERMINAL_STATUSES else None
+        with self.engine.begin() as connection:
+            connection.execute(
+                text('UPDATE analysis_batch_jobs SET status = :status, finished_at = :finished_at, stored = :stored WHERE job_id = :job_id'),
+                {'job_id': job_id, 'status': status, 'finished_at': finished_at, 'stored': stored},
+            )
+
+    def jobs(self):
+        with self.engine.connect() as connection:
+            return [dict(row) for row in connection.execute(text('SELECT * FROM analysis_batch_jobs ORDER BY submitted_at')).mappings()]
+
+def store_batch_results(sql_engine, lines, update=False):
+    """
+    Bulk-loads the analyses of a batch output file into analyzed_rss, QUERY_CHUNK at a time.
+
+    Args:
+        update (bool): Overwrite stored analyses of the same articles, for re-analysis.
+
+    Returns:
+        int: Number of rows inserted or updated.
+    """
+    query = text('SELECT article_key, hashed_title FROM news_rss WHERE article_key IN :keys').bindparams(bindparam('keys', expanding=True))
+    columns = ['topic', 'individuals', 'sentiment', 'hashed_title', 'article_key']
+    stored = 0
+
+    for chunk in batched(read_batch_results(lines), QUERY_CHUNK):
+        with sql_engine.connect() as connection:
+            hashed_titles = dict(connection.execute(query, {'keys': [key for key, _ in chunk]}).fetchall())
+
+        records = [
+            (analysis['topic'], analysis['individuals'], analysis['sentiment'], hashed_titles[key], key)
+            for key, analysis in chunk if key in hashed_titles
+        ]
+        stored += insert_records_without_duplicates(records, sql_engine, 'analyzed_rss', columns, ['article_key'], update=update)
+
+    return stored
+
+def run_batch_job(sql_engine, service, directory, model=DEFAULT_MODEL, limit=DEFAULT_MAX_REQUESTS, reanalyze=False, poll_interval=DEFAULT_POLL_INTERVAL, timeout=None):
+    """
+    Analyzes the backlog as one offline batch job: writes up to limit pending articles, newest first,
+    to a JSONL file of chat completion requests, submits it, polls until the job ends and bulk-loads
+    the results into analyzed_rss. A job left unfinished by an earlier run is collected first instead.
+
+    Args:
+        service (OpenAIBatchService or LocalBatchService): Where the job runs.
+        directory (str): Where batch input files are written.
+        model (str): Model named in every request.
+        limit (int): Maximum articles in the job.
+        reanalyze (bool): Include articles analyzed before and overwrite their analyses,
+            e.g. after a prompt change.
+        poll_interval (float): Seconds between status checks.
+        timeout (float, optional): Seconds to poll before giving up; the job is collected by a later run.
+
+    Returns:
+        int: Number of analyses stored, or None if the job had not ended by the timeout.
+    """
+    upgrade_article_keys(sql_engine)
+    store = BatchJobStore(sql_engine)
+    job = store.unfinished(service.name)
+
+    if job is None:
+        row_dicts = itertools.islice(
+            (row_dict for chunk in pending_articles(sql_engine, include_analyzed=reanalyze) for row_dict in chunk.to_dict(orient='records')),
+            limit,
+        )
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'analysis_batch_{int(time.time())}.jsonl')
+        count = write_batch_file(row_dicts, path, model)
+
+        if count == 0:
+            os.remove(path)
+            print('No articles to analyze')
+            return 0
+
+        job = {'job_id': service.submit(path), 'status': 'submitted', 'article_count': count, 'reanalyze': int(reanalyze)}
+        store.add(job['job_id'], service.name, count, reanalyze)
+        print(f"Submitted batch job {job['job_id']} with {count} articles")
+
+    started = time.monotonic()
+
+    while True:
+        status = service.status(job['job_id'])
+        if status in TERMINAL_STATUSES:
+            break
+
+        store.update(job['job_id'], status)
+        if timeout is not None and time.monotonic() - started + poll_interval > timeout:
+            print(f"Batch job {job['job_id']} is still {status}")
+            return None
+        time.sleep(poll_interval)
+
+    stored = store_batch_results(sql_engine, service.results(job['job_id']), update=bool(job['reanalyze'])) if status == 'completed' else 0
+    store.update(job['job_id'], status, stored)
+    print(f"Batch job {job['job_id']} {status}: stored {stored} of {job['article_count']} analyses")
+
+    return stored
@@ -2,9 +2,20 @@
 Copyright @emontj 2024
 """
 
+from contextlib import contextmanager
 import feedparser
 import hashlib
+from itertools import islice
+import unicodedata
+
+import numpy as np
 import pandas as pd
+from sqlalchemy import Float, Integer, exc, inspect, text
+
+from production.backend.feed_cache import fetched_feeds, summarize_fetches
+from production.backend.fetcher import DEFAULT_CONNECT_TIMEOUT, DEFAULT_MAX_WORKERS, DEFAULT_READ_TIMEOUT, build_client, fetch_all_feeds, fetch_feed
+from production.backend.schema import metadata
+from production.backend.watermarks import filter_new_entries, parse_published
 
 TEST_NEWS_SOURCES = {
     "CNN": {
@@ -94,13 +105,18 @@ TEST_NEWS_SOURCES = {
     },
 }
 
-def fetch_rss_for_outlet(outlet, news_sources, category=None):
+def fetch_rss_for_outlet(outlet, news_sources, category=None, client=None, validator_store=None):
     """
     Fetches RSS feeds for a specific news outlet or category.
 
     Args:
         outlet (str): The name of the news outlet.
         category (str, optional): Specific category to fetch. Defaults to None.
+        client (httpx.Client, optional): When given, feeds are downloaded with this client and its timeouts,
+            and a failed download becomes an empty feed with a 'fetch' error instead of an exception.
+        validator_store (feed_cache.ValidatorStore, optional): Sends conditional requests using the stored
+            ETag/Last-Modified and skips parsing unchanged feeds. Requires client. The new validators are returned
+            with the feeds, to be saved once their entries are stored.
 
     Returns:
         dict: Parsed RSS feeds for the specified outlet/category.
@@ -114,15 +130,46 @@ def fetch_rss_for_outlet(outlet, news_sources, category=None):
     if category:
         if category not in links:
             raise ValueError(f"Category '{category}' not found for outlet '{outlet}'.")
-        feeds[category] = feedparser.parse(links[category])
-    else:
-        for topic, link in links.items():
-            feeds[topic] = feedparser.parse(link)
+        links = {category: links[category]}
+
+    validators = validator_store.load(links.values()) if validator_store else {}
+
+    for topic, link in links.items():
+        feeds[topic] = fetch_feed(client, link, validators.get(link), news_sources[outlet]['mapping']) if client else feedparser.parse(link)
 
     feeds['outlet'] = outlet
 
     return feeds
 
+RSS_FIELDS = ['title', 'link', 'summary', 'published', 'updated', 'tags', 'media_content', 'content', 'authors', 'id']
+NEWS_RSS_COLUMNS = RSS_FIELDS + ['outlet', 'hashed_title', 'article_key', 'category', 'published_ts']
+INTEGER_COLUMNS = {'article_key', 'cluster_id'}
+REAL_COLUMNS = {'published_ts'}
+DEFAULT_BATCH_SIZE = 500
+KEY_SEPARATOR = '\x1f'
+
+def compile_mapping(mapping):
+    """
+    Resolves a source mapping once into a function that standardizes a single feed entry.
+
+    Args:
+        mapping (dict): The mapping dictionary for the RSS fields.
+
+    Returns:
+        function: Takes a feed entry and returns a dict keyed by RSS_FIELDS.
+    """
+    keys = [(field, mapping.get(field)) for field in RSS_FIELDS]
+
+    def to_record(entry):
+        record = {field: entry.get(key) if key else None for field, key in keys}
+        if record['tags'] is not None:
+            record['tags'] = [tag.get("term", None) for tag in record['tags']]
+        elif mapping.get("tags"):
+            record['tags'] = []
+        return record
+
+    return to_record
+
 def rss_to_dataframe(entries, mapping):
     """
     Converts a list of RSS feed entries into a standardized pandas DataFrame using the provided mapping.
@@ -134,42 +181,22 @@ def rss_to_dataframe(entries, mapping):
     Returns:
         pd.DataFrame: A pandas DataFrame with standardized columns.
     """
-    standardized_items = []
-
-    for entry in entries:
-        # Apply mapping to standardize fields
-        standardized_item = {
-            "title": entry.get(mapping.get("title", None), None),
-            "link": entry.get(mapping.get("link", None), None),
-            "summary": entry.get(mapping.get("summary", None), None),
-            "published": entry.get(mapping.get("published", None), None),
-            "updated": entry.get(mapping.get("updated", None), None),
-            "tags": [tag.get("term", None) for tag in entry.get(mapping.get("tags", None), [])] if mapping.get("tags") else None,
-            "media_content": entry.get(mapping.get("media_content", None), None),
-            "content": entry.get(mapping.get("content", None), None),
-            "authors": entry.get(mapping.get("authors", None), None),
-            "id": entry.get(mapping.get("id", None), None),
-        }
-        standardized_items.append(standardized_item)
-
-    # Convert the list of standardized items into a pandas DataFrame
-    df = pd.DataFrame(standardized_items)
-    return df
-
+    to_record = compile_mapping(mapping)
+    return pd.DataFrame([to_record(entry) for entry in entries], columns=RSS_FIELDS)
 
-def extract_all_entries(feed, news_sources):
-    running_df = None
+def iter_feed_records(feed, news_sources):
+    """
+    Yields a standardized record for every entry in every category of an outlet's feeds.
+    """
+    to_record = compile_mapping(news_sources[feed['outlet']]['mapping'])
 
     for k, v in feed.items():
         if k != 'outlet':
-            new_df = rss_to_dataframe(v['entries'], news_sources[feed['outlet']]['mapping'])
+            for entry in v['entries']:
+                yield to_record(entry)
 
-            if running_df is None:
-                running_df = new_df
-            else:
-                running_df = pd.concat([running_df, new_df], ignore_index=True)
-    
-    return running_df
+def extract_all_entries(feed, news_sources):
+    return pd.DataFrame(list(iter_feed_records(feed, news_sources)), columns=RSS_FIELDS)
 
 def print_rss_structure(feed_parsed, outlet = 'Unspecified'):
     print(outlet, ':', list(feed_parsed['entries'][0].keys()))
@@ -187,30 +214,180 @@ def add_hashed_column(df, column_name, hash_column_name):
     Returns:
     - pandas.DataFrame - DataFrame with the new hashed column.
     """
-    def hash_value(val):
-        val = "None" if pd.isna(val) else str(val)
-        return hashlib.sha256(val.encode()).hexdigest()
-
-    df[hash_column_name] = df[column_name].apply(hash_value)
+    df[hash_column_name] = [hash_value(None if pd.isna(val) else val) for val in df[column_name]]
     return df
 
-def update_data(news_sources, sql_engine=None):
-    running_df = None
+def hash_value(val):
+    val = "None" if val is None else str(val)
+    return hashlib.sha256(val.encode()).hexdigest()
 
-    for k, v in news_sources.items():
-        feed = fetch_rss_for_outlet(k, news_sources)
-        new_df = extract_all_entries(feed, news_sources)
-        new_df['outlet'] = k
+def normalize_key_text(val):
+    if val is None or val != val:
+        return ''
+    val = str(val)
+    if not val.isascii():
+        val = unicodedata.normalize('NFKC', val)
+    return ' '.join(val.casefold().split())
+
+def article_key_bytes(title, outlet, link):
+    link = '' if link is None or link != link else str(link).strip()
+    key_text = KEY_SEPARATOR.join((normalize_key_text(title), normalize_key_text(outlet), link))
+    return hashlib.blake2b(key_text.encode(), digest_size=8).digest()
+
+def article_key(title, outlet, link):
+    """
+    Compact 64-bit key of an article: blake2b over its normalized title, outlet and link.
+    Signed so it fits a SQLite INTEGER column.
+    """
+    return int.from_bytes(article_key_bytes(title, outlet, link), 'big', signed=True)
+
+def article_keys(titles, outlets, links):
+    """
+    Batched article_key for whole columns at once.
+
+    Args:
+        titles, outlets, links (iterable): Equal-length sequences, e.g. DataFrame columns.
+
+    Returns:
+        np.ndarray: int64 keys in input order.
+    """
+    digests = b''.join(map(article_key_bytes, titles, outlets, links))
+    return np.frombuffer(digests, dtype='>i8').astype(np.int64)
+
+def key_to_hex(key):
+    """
+    16-character hex form of an article key, used in URLs and JSON where 64-bit integers lose precision.
+    """
+    return (int(key) % 2**64).to_bytes(8, 'big').hex()
+
+def hex_to_key(value):
+    return int.from_bytes(bytes.fromhex(value), 'big', signed=True)
+
+def sql_value(val):
+    """
+    Converts a single value to what prepare_dataframe_for_sql would store: None for missing values, otherwise a string.
+    """
+    if val is None or val != val:
+        return None
+    if isinstance(val, pd.Timestamp):
+        return val.strftime('%Y-%m-%d %H:%M:%S')
+    return str(val)
+
+def iter_news_records(feeds_by_outlet, news_sources):
+    """
+    Yields news_rss rows, as tuples in NEWS_RSS_COLUMNS order, for every entry of every fetched feed.
+    """
+    for outlet, feed in feeds_by_outlet.items():
+        to_record = compile_mapping(news_sources[outlet]['mapping'])
+
+        for category, v in feed.items():
+            if category == 'outlet':
+                continue
+
+            for entry in v['entries']:
+                record = to_record(entry)
+                row = [sql_value(record[field]) for field in RSS_FIELDS]
+                key = article_key(record['title'], outlet, record['link'])
+                yield (*row, outlet, hash_value(row[0]), key, category, parse_published(sql_value(record['published'])))
+
+def batched(iterable, batch_size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+def report_fetch_errors(feed):
+    for k, v in feed.items():
+        if k != 'outlet' and v.get('fetch', {}).get('error'):
+            print(f"Failed to fetch {feed['outlet']} {k}: {v['fetch']['error']}")
+        elif k != 'outlet' and v.get('fetch', {}).get('parser') == 'feedparser':
+            print(f"Parsed {feed['outlet']} {k} with the feedparser fallback")
+
+def apply_watermarks(feeds_by_outlet, news_sources, watermarks):
+    """
+    Replaces each fetched feed's entries with only those newer than its watermark, before any
+    record or hashing work is done on them.
+
+    Returns:
+        tuple: (updated watermarks, per-outlet counts of new and skipped entries).
+    """
+    updated = {}
+    counts = {}
+
+    for outlet, feed in feeds_by_outlet.items():
+        mapping = news_sources[outlet]['mapping']
+        counts[outlet] = {'entries_new': 0, 'entries_skipped': 0}
+
+        for k, v in feed.items():
+            if k == 'outlet' or not v['entries']:
+                continue
+
+            new_entries, updated[(outlet, k)] = filter_new_entries(v['entries'], watermarks.get((outlet, k)), mapping)
+            counts[outlet]['entries_new'] += len(new_entries)
+            counts[outlet]['entries_skipped'] += len(v['entries']) - len(new_entries)
+            v['entries'] = new_entries
+
+    return updated, counts
+
+def update_data(news_sources, sql_engine=None, concurrent=False, max_workers=DEFAULT_MAX_WORKERS, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT, validator_store=None, watermark_store=None, planner=None):
+    """
+    Fetches every feed in news_sources and appends the entries to the news_rss table.
+
+    Args:
+        news_sources (dict): News source configuration, see source_configs.py.
+        sql_engine (sqlalchemy.Engine, optional): Engine to write to. Nothing is written if None.
+        concurrent (bool): Download feeds on a bounded thread pool instead of one at a time.
+        max_workers (int): Maximum number of feeds downloaded at once in concurrent mode.
+        connect_timeout (float): Per-feed connect timeout in seconds in concurrent mode.
+        read_timeout (float): Per-feed read timeout in seconds in concurrent mode.
+        validator_store (feed_cache.ValidatorStore, optional): Makes downloads conditional, see fetch_rss_for_outlet.
+            Validators are only saved once the new entries are written, so a failed refresh downloads the feeds again.
+        watermark_store (watermarks.WatermarkStore, optional): Drops entries at or below each feed's watermark
+            right after parsing. Watermarks only advance once the new entries are written.
+        planner (polling.PollingPlanner, optional): Fetches only the links due for a poll and
+            reschedules them from the outcome. Needs sql_engine, which holds the poll state.
+
+    Returns:
+        dict: Per-outlet fetch report, see feed_cache.summarize_fetches, plus new and skipped entry counts
+              when a watermark store is used. Outlets with no due links are left out when a planner is used.
+    """
+    if planner:
+        news_sources = planner.due_sources(news_sources)
+
+    if concurrent:
+        feeds_by_outlet = fetch_all_feeds(news_sources, max_workers, connect_timeout, read_timeout, validator_store=validator_store)
+    elif validator_store:
+        with build_client(1, connect_timeout, read_timeout) as client:
+            feeds_by_outlet = {k: fetch_rss_for_outlet(k, news_sources, client=client, validator_store=validator_store) for k in news_sources}
+    else:
+        feeds_by_outlet = {k: fetch_rss_for_outlet(k, news_sources) for k in news_sources}
+
+    for feed in feeds_by_outlet.values():
+        report_fetch_errors(feed)
+
+    report = summarize_fetches(feeds_by_outlet)
+
+    if watermark_store:
+        watermarks, counts = apply_watermarks(feeds_by_outlet, news_sources, watermark_store.load())
+        for outlet, outlet_counts in counts.items():
+            report[outlet].update(outlet_counts)
 
-        if running_df is None:
-            running_df = new_df
-        else:
-            running_df = pd.concat([running_df, new_df], ignore_index=True)
-    
     if sql_engine:
-        running_df = prepare_dataframe_for_sql(running_df)
-        add_hashed_column(running_df, 'title', 'hashed_title')
-        running_df.to_sql('news_rss', sql_engine, if_exists='append')
+        upgrade_article_keys(sql_engine)
+        records = iter_news_records(feeds_by_outlet, news_sources)
+        if insert_records_without_duplicates(records, sql_engine, 'news_rss', NEWS_RSS_COLUMNS, ['article_key']):
+            ensure_index(sql_engine, 'news_rss', ['hashed_title'])
+            ensure_index(sql_engine, 'news_rss', ['outlet', 'category', 'published_ts'])
+
+    if validator_store:
+        validator_store.save(fetched_feeds(feeds_by_outlet))
+
+    if watermark_store:
+        watermark_store.save(watermarks)
+
+    if planner:
+        planner.record(feeds_by_outlet, news_sources)
+
+    return report
 
 def prepare_dataframe_for_sql(df):
     """
@@ -227,14 +404,225 @@ def prepare_dataframe_for_sql(df):
     Returns:
     pd.DataFrame: The processed DataFrame ready for SQLite insertion.
     """
-    df = df.where(pd.notnull(df), None)
+    return pd.DataFrame({col: [sql_value(val) for val in df[col]] for col in df.columns}, index=df.index, dtype=object)
 
-    for col in df.select_dtypes(include=['datetime', 'datetimetz']):
-        df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
-    
-    df = df.applymap(lambda x: str(x) if x is not None else x)
-    
-    return df
+class DuplicateKeys(Exception):
+    """
+    Raised when a table holds rows repeating its key columns, so the unique index inserts rely on cannot be built.
+    """
+
+def quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+def unique_index_name(table_name, key_cols):
+    return f"ux_{table_name}_{'_'.join(key_cols)}"
+
+@contextmanager
+def schema_transaction(sql_engine):
+    """
+    sql_engine.begin() for statements that change the schema. pysqlite only opens a transaction before
+    the first INSERT, UPDATE or DELETE, so DDL ahead of it would be committed on its own; starting the
+    transaction here makes every statement commit or roll back together.
+    """
+    with sql_engine.begin() as connection:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+        yield connection
+
+def compact_duplicates(sql_engine, table_name, key_cols):
+    """
+    Deletes rows whose key columns repeat an earlier row, keeping the first one inserted.
+    One-off clean-up for tables written before inserts were deduplicated.
+
+    Returns:
+        int: Number of rows removed.
+    """
+    keys = ', '.join(quote_identifier(col) for col in key_cols)
+    query = text(f'''
+        DELETE FROM {quote_identifier(table_name)}
+        WHERE rowid NOT IN (SELECT MIN(rowid) FROM {quote_identifier(table_name)} GROUP BY {keys})
+    ''')
+
+    with sql_engine.begin() as connection:
+        return connection.execute(query).rowcount
+
+def ensure_index(sql_engine, table_name, cols):
+    names = ', '.join(quote_identifier(col) for col in cols)
+    index_name = quote_identifier(f"ix_{table_name}_{'_'.join(cols)}")
+
+    with sql_engine.begin() as connection:
+        connection.execute(text(f'CREATE INDEX IF NOT EXISTS {index_name} ON {quote_identifier(table_name)} ({names})'))
+
+def ensure_unique_index(sql_engine, table_name, key_cols):
+    """
+    Creates the unique index on key_cols that inserts conflict against.
+
+    Raises:
+        DuplicateKeys: If rows already repeat a key. Nothing is deleted on the write path; the article
+        tables are compacted once by upgrade_article_keys.
+    """
+    keys = ', '.join(quote_identifier(col) for col in key_cols)
+    query = text(f'CREATE UNIQUE INDEX IF NOT EXISTS {quote_identifier(unique_index_name(table_name, key_cols))} ON {quote_identifier(table_name)} ({keys})')
+
+    try:
+        with sql_engine.begin() as connection:
+            connection.execute(query)
+    except exc.IntegrityError as error:
+        raise DuplicateKeys(
+            f'{table_name} has rows repeating {key_cols}, so its unique index cannot be built. '
+            f'Remove them with compact_duplicates before writing to it.'
+        ) from error
+
+def prepare_table(sql_engine, table_name, columns, key_cols):
+    """
+    Creates the table if it does not exist, from its declaration in schema.py if it has one,
+    adds any of columns missing from the table and builds the unique index on key_cols.
+    """
+    if not inspect(sql_engine).has_table(table_name):
+        if table_name in metadata.tables:
+            metadata.tables[table_name].create(sql_engine)
+        else:
+            dtypes = {col: Integer() for col in columns if col in INTEGER_COLUMNS}
+            dtypes.update({col: Float() for col in columns if col in REAL_COLUMNS})
+            pd.DataFrame(columns=columns).to_sql(table_name, sql_engine, dtype=dtypes)
+
+    existing = {col['name'] for col in inspect(sql_engine).get_columns(table_name)}
+    with sql_engine.begin() as connection:
+        for col in columns:
+            if col not in existing:
+                col_type = 'INTEGER' if col in INTEGER_COLUMNS else 'REAL' if col in REAL_COLUMNS else 'TEXT'
+                connection.execute(text(f'ALTER TABLE {quote_identifier(table_name)} ADD COLUMN {quote_identifier(col)} {col_type}'))
+
+    ensure_unique_index(sql_engine, table_name, key_cols)
+
+def insert_records_without_duplicates(records, sql_engine, table_name, columns, key_cols, update=False, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Streams rows into a table in fixed-size executemany batches, skipping rows whose key columns already exist.
+    Only one batch is held in memory at a time, however many rows the iterable produces.
+
+    Parameters:
+    - records: iterable - Row tuples with values in the order of columns.
+    - sql_engine: sqlalchemy.Engine - SQLite engine to write to.
+    - table_name: str - Destination table, created or extended as needed.
+    - columns: list - Column names of the values in each row.
+    - key_cols: list - Columns that identify a row.
+    - update: bool - Overwrite the other columns of existing rows instead of leaving them untouched.
+    - batch_size: int - Rows sent per executemany call.
+
+    Returns:
+    - int - Number of rows inserted or updated.
+    """
+    batches = batched(records, batch_size)
+    first_batch = next(batches, None)
+
+    if first_batch is None:
+        return 0
+
+    prepare_table(sql_engine, table_name, columns, key_cols)
+
+    conflict = ', '.join(quote_identifier(col) for col in key_cols)
+    updates = [f'{quote_identifier(col)} = excluded.{quote_identifier(col)}' for col in columns if col not in key_cols]
+
+    if update and updates:
+        action = 'DO UPDATE SET ' + ', '.join(updates)
+    else:
+        action = 'DO NOTHING'
+
+    query = f'''
+        INSERT INTO {quote_identifier(table_name)} ({', '.join(quote_identifier(col) for col in columns)})
+        VALUES ({', '.join('?' for _ in columns)})
+        ON CONFLICT ({conflict}) {action}
+    '''
+
+    # Each batch's rowcount, unlike total_changes(), leaves out the rows written by triggers on the table
+    with sql_engine.begin() as connection:
+        written = connection.exec_driver_sql(query, first_batch).rowcount
+        for batch in batches:
+            written += connection.exec_driver_sql(query, batch).rowcount
+
+    return written
+
+def add_rows_without_duplicates(df, sql_engine, table_name, key_cols, update=False, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Inserts the rows of a DataFrame, skipping rows whose key columns already exist in the table.
+    DataFrame wrapper around insert_records_without_duplicates.
+
+    Parameters:
+    - df: pandas.DataFrame - Rows to insert.
+    - sql_engine: sqlalchemy.Engine - SQLite engine to write to.
+    - table_name: str - Destination table.
+    - key_cols: list - Columns that identify a row.
+    - update: bool - Overwrite the other columns of existing rows instead of leaving them untouched.
+    - batch_size: int - Rows sent per executemany call.
+
+    Returns:
+    - int - Number of rows inserted or updated.
+    """
+    records = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    return insert_records_without_duplicates(records, sql_engine, table_name, list(df.columns), key_cols, update, batch_size)
+
+def add_article_keys(sql_engine):
+    """
+    Adds and backfills the article_key column of tables written before article keys existed, and drops
+    their unique hashed_title index. Does nothing for tables that already have the column.
+    """
+    db_inspector = inspect(sql_engine)
+
+    if db_inspector.has_table('news_rss'):
+        news_columns = {col['name'] for col in db_inspector.get_columns('news_rss')}
+
+        if 'article_key' not in news_columns:
+            outlet_column = 'outlet' if 'outlet' in news_columns else 'NULL AS outlet'
+            df = pd.read_sql(f'SELECT rowid AS row_id, title, {outlet_column}, link FROM news_rss', sql_engine)
+            outlets = df['outlet']
+            keys = article_keys(df['title'], outlets, df['link'])
+
+            with schema_transaction(sql_engine) as connection:
+                connection.execute(text('ALTER TABLE news_rss ADD COLUMN article_key INTEGER'))
+                connection.execute(text('UPDATE news_rss SET article_key = :key WHERE rowid = :row_id'), [
+                    {'key': int(key), 'row_id': int(row_id)} for key, row_id in zip(keys, df['row_id'])
+                ])
+                connection.execute(text(f'DROP INDEX IF EXISTS {unique_index_name("news_rss", ["hashed_title"])}'))
+
+    if db_inspector.has_table('analyzed_rss') and 'article_key' not in {col['name'] for col in db_inspector.get_columns('analyzed_rss')}:
+        with schema_transaction(sql_engine) as connection:
+            connection.execute(text('ALTER TABLE analyzed_rss ADD COLUMN article_key INTEGER'))
+            connection.execute(text('''
+                UPDATE analyzed_rss SET article_key = (
+                    SELECT MIN(news_rss.article_key) FROM news_rss WHERE news_rss.hashed_title = analyzed_rss.hashed_title
+                )
+            '''))
+            connection.execute(text(f'DROP INDEX IF EXISTS {unique_index_name("analyzed_rss", ["hashed_title"])}'))
+
+def has_index(sql_engine, index_name):
+    with sql_engine.connect() as connection:
+        return connection.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"), {'name': index_name}).first() is not None
+
+def upgrade_article_keys(sql_engine):
+    """
+    Moves tables written before article keys existed onto them: adds and backfills the article_key
+    column, removes the rows repeating an earlier article key that append-only refreshes left, and
+    replaces the unique hashed_title index with a unique article_key index and a plain hashed_title
+    index kept for legacy URLs. Rows are only removed while a table has no unique article_key index,
+    so once per table. Each step checks what is already there, so rerunning it after an interrupted
+    upgrade finishes the job, and does nothing once the tables are upgraded.
+
+    Returns:
+        dict: Number of rows removed from each table compacted.
+    """
+    add_article_keys(sql_engine)
+    db_inspector = inspect(sql_engine)
+    removed = {}
+
+    if db_inspector.has_table('news_rss'):
+        ensure_index(sql_engine, 'news_rss', ['hashed_title'])
+
+    for table_name in ('news_rss', 'analyzed_rss'):
+        if db_inspector.has_table(table_name) and not has_index(sql_engine, unique_index_name(table_name, ['article_key'])):
+            removed[table_name] = compact_duplicates(sql_engine, table_name, ['article_key'])
+            print(f'Removed {removed[table_name]} rows repeating an article key from {table_name} before indexing it')
+            ensure_unique_index(sql_engine, table_name, ['article_key'])
+
+    return removed
 
 if __name__ == "__main__":
     update_data(TEST_NEWS_SOURCES, sql_engine=None)
@@ -0,0 +1,130 @@
+"""
+Copyright @emontj 2024
+"""
+
+import time
+
+from sqlalchemy import bindparam, text
+
+class ValidatorStore:
+    """
+    Persistent per-URL HTTP validators (ETag, Last-Modified, content hash) kept in the feed_validators table.
+
+    Validators are loaded before a refresh and saved after it from a single thread,
+    so the store never has to be shared with the fetch thread pool.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                CREATE TABLE IF NOT EXISTS feed_validators (
+                    link TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_hash TEXT,
+                    content_length INTEGER,
+                    checked_at REAL
+                )
+            '''))
+
+    def load(self, links):
+        """
+        Returns the stored validators for the given links.
+        Every link is present in the result, links never fetched before map to an empty dict.
+        """
+        links = list(links)
+        validators = {link: {} for link in links}
+
+        if not links:
+            return validators
+
+        query = text('''
+            SELECT link, etag, last_modified, content_hash, content_length
+            FROM feed_validators WHERE link IN :links
+        ''').bindparams(bindparam('links', expanding=True))
+
+        with self.engine.connect() as connection:
+            for row in connection.execute(query, {'links': links}).mappings():
+                validators[row['link']] = {k: row[k] for k in ('etag', 'last_modified', 'content_hash', 'content_length')}
+
+        return validators
+
+    def save(self, feeds):
+        """
+        Stores the validators returned with each successfully downloaded feed.
+
+        Args:
+            feeds (iterable): Feed results from fetcher.fetch_feed.
+        """
+        rows = [
+            dict(feed['fetch']['validators'], link=feed['fetch']['link'], checked_at=time.time())
+            for feed in feeds
+            if feed.get('fetch', {}).get('validators')
+        ]
+
+        if not rows:
+            return
+
+        query = text('''
+            INSERT INTO feed_validators (link, etag, last_modified, content_hash, content_length, checked_at)
+            VALUES (:link, :etag, :last_modified, :content_hash, :content_length, :checked_at)
+            ON CONFLICT(link) DO UPDATE SET
+                etag = excluded.etag,
+                last_modified = excluded.last_modified,
+                content_hash = excluded.content_hash,
+                content_length = excluded.content_length,
+                checked_at = excluded.checked_at
+        ''')
+
+        with self.engine.begin() as connection:
+            connection.execute(query, rows)
+
+def fetched_feeds(feeds_by_outlet):
+    """
+    Yields the result of every feed in a refresh, e.g. to save their validators.
+    """
+    for feeds in feeds_by_outlet.values():
+        for k, v in feeds.items():
+            if k != 'outlet':
+                yield v
+
+def summarize_fetches(feeds_by_outlet):
+    """
+    Summarizes the cache behaviour of a refresh for each outlet.
+
+    Args:
+        feeds_by_outlet (dict): Outlet name to feeds, as returned by fetcher.fetch_all_feeds.
+
+    Returns:
+        dict: Outlet name to counts of cache hits, misses and errors, bytes downloaded,
+              bytes saved by conditional requests, the number of feeds whose parsing was skipped
+              and the number parsed by the fast parser and by the feedparser fallback.
+    """
+    report = {}
+
+    for outlet, feeds in feeds_by_outlet.items():
+        summary = {'hits': 0, 'misses': 0, 'errors': 0, 'bytes_downloaded': 0, 'bytes_saved': 0, 'parses_skipped': 0, 'fast_parses': 0, 'fallback_parses': 0}
+
+        for k, v in feeds.items():
+            if k == 'outlet' or 'fetch' not in v:
+                continue
+
+            fetch = v['fetch']
+            summary['bytes_downloaded'] += fetch['bytes']
+            summary['fast_parses'] += fetch.get('parser') == 'fast'
+            summary['fallback_parses'] += fetch.get('parser') == 'feedparser'
+
+            if fetch['error']:
+                summary['errors'] += 1
+            elif fetch.get('cache') == 'hit':
+                summary['hits'] += 1
+                summary['parses_skipped'] += 1
+                summary['bytes_saved'] += fetch['bytes_saved']
+            else:
+                summary['misses'] += 1
+
+        report[outlet] = summary
+
+    return report
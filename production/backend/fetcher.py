@@ -0,0 +1,174 @@
+"""
+Copyright @emontj 2024
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import time
+
+import httpx
+
+from production.backend.fast_parser import parse_feed
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 15.0
+USER_AGENT = 'WheresTheWater/1.0 (+https://github.com/emontj/WheresTheWater)'
+
+def build_client(max_workers=DEFAULT_MAX_WORKERS, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT):
+    """
+    Builds an HTTP client shared by every feed download in a refresh.
+
+    Args:
+        max_workers (int): Upper bound on simultaneous connections, matches the fetch concurrency.
+        connect_timeout (float): Seconds allowed to establish a connection to a feed host.
+        read_timeout (float): Seconds allowed between bytes received from a feed host.
+
+    Returns:
+        httpx.Client: Client with per-feed timeouts and a bounded connection pool.
+    """
+    timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+    limits = httpx.Limits(max_connections=max_workers, max_keepalive_connections=max_workers)
+
+    return httpx.Client(
+        timeout=timeout,
+        limits=limits,
+        follow_redirects=True,
+        headers={'User-Agent': USER_AGENT},
+    )
+
+def feed_error_result(link, error, elapsed):
+    """
+    Builds the result returned for a feed that could not be downloaded.
+    It has the same shape as a parsed feed, with no entries, so callers can treat it like any other feed.
+    """
+    return {
+        'entries': [],
+        'fetch': {
+            'link': link,
+            'status': getattr(getattr(error, 'response', None), 'status_code', None),
+            'bytes': 0,
+            'elapsed': elapsed,
+            'error': f'{type(error).__name__}: {error}',
+            'cache': None,
+            'validators': None,
+            'parser': None,
+        },
+    }
+
+def conditional_headers(validators):
+    headers = {}
+
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    return headers
+
+def fetch_feed(client, link, validators=None, mapping=None):
+    """
+    Downloads and parses a single feed. Failures are returned as an error result instead of raised.
+
+    When validators are given the request is conditional. A 304 response, or a body whose hash
+    matches the stored one, is a cache hit: parsing is skipped and the feed has no entries.
+
+    Args:
+        client (httpx.Client): Client used for the download.
+        link (str): URL of the feed.
+        validators (dict, optional): Stored validators for the link, see feed_cache.ValidatorStore.
+        mapping (dict, optional): Source mapping limiting the fields parsed, see fast_parser.parse_feed.
+
+    Returns:
+        dict: Parsed feed with an extra 'fetch' key describing the download.
+    """
+    start = time.perf_counter()
+    headers = conditional_headers(validators) if validators else {}
+
+    try:
+        response = client.get(link, headers=headers)
+        if response.status_code != 304:
+            response.raise_for_status()
+    except Exception as e:
+        return feed_error_result(link, e, time.perf_counter() - start)
+
+    fetch = {
+        'link': link,
+        'status': response.status_code,
+        'bytes': len(response.content),
+        'elapsed': None,
+        'error': None,
+        'cache': None if validators is None else 'miss',
+        'validators': None,
+        'parser': None,
+    }
+
+    if response.status_code == 304:
+        fetch['validators'] = dict(validators)
+        content_hash = None
+    else:
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        fetch['validators'] = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content_hash': content_hash,
+            'content_length': len(response.content),
+        }
+
+    if validators and (response.status_code == 304 or content_hash == validators.get('content_hash')):
+        fetch['cache'] = 'hit'
+        fetch['bytes_saved'] = (validators.get('content_length') or 0) if response.status_code == 304 else 0
+        parsed = {'entries': []}
+    else:
+        parsed = parse_feed(response.content, mapping)
+        fetch['parser'] = parsed['parser']
+
+    fetch['elapsed'] = time.perf_counter() - start
+    parsed['fetch'] = fetch
+
+    return parsed
+
+def fetch_all_feeds(news_sources, max_workers=DEFAULT_MAX_WORKERS, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT, client=None, validator_store=None):
+    """
+    Fetches every link of every outlet concurrently on a bounded thread pool.
+    Wall-clock time is roughly that of the slowest feed rather than the sum of all of them.
+
+    Args:
+        news_sources (dict): News source configuration, see source_configs.py.
+        max_workers (int): Maximum number of feeds downloaded at once.
+        connect_timeout (float): Per-feed connect timeout in seconds.
+        read_timeout (float): Per-feed read timeout in seconds.
+        client (httpx.Client, optional): Client to reuse. One is built and closed here if not given.
+        validator_store (feed_cache.ValidatorStore, optional): Makes every request conditional on the stored validators.
+            The new validators come back with each feed's results and are not saved here, so that a caller
+            saves them only once the entries are stored.
+
+    Returns:
+        dict: Outlet name to feeds, in the same shape fetch_rss_for_outlet returns.
+    """
+    tasks = [
+        (outlet, category, link)
+        for outlet, source in news_sources.items()
+        for category, link in source['links'].items()
+    ]
+    owns_client = client is None
+    validators = validator_store.load(task[2] for task in tasks) if validator_store else {}
+
+    if owns_client:
+        client = build_client(max_workers, connect_timeout, read_timeout)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(
+                lambda task: fetch_feed(client, task[2], validators.get(task[2]), news_sources[task[0]]['mapping']),
+                tasks,
+            ))
+    finally:
+        if owns_client:
+            client.close()
+
+    feeds_by_outlet = {outlet: {'outlet': outlet} for outlet in news_sources}
+    for (outlet, category, _), result in zip(tasks, results):
+        feeds_by_outlet[outlet][category] = result
+
+    return feeds_by_outlet
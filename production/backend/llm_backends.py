@@ -0,0 +1,250 @@
+"""
+Copyright @emontj 2024
+"""
+
+import json
+import os
+import threading
+import time
+
+import httpx
+from openai import OpenAI
+
+DEFAULT_MODEL = 'gpt-4o-mini'
+DEFAULT_MAX_CONNECTIONS = 16
+DEFAULT_TIMEOUT = 60.0
+call_listeners = []
+
+def field(value, name):
+    """
+    Reads name from an SDK response object or from the equivalent plain dict.
+    """
+    return value.get(name) if isinstance(value, dict) else getattr(value, name, None)
+
+def completion_content(completion):
+    """
+    Message text of a chat completion, whether it is an SDK object or a dict-shaped response.
+    """
+    message = field(field(completion, 'choices')[0], 'message')
+    return str(field(message, 'content'))
+
+def completion_usage(completion):
+    usage = field(completion, 'usage') or {}
+    return field(usage, 'prompt_tokens') or 0, field(usage, 'completion_tokens') or 0
+
+class LLMBackend:
+    """
+    A chat completion service held for the life of the process. Subclasses implement create;
+    complete wraps it and records latency, token usage and, for HTTP backends, connection reuse.
+    The functions in call_listeners are called with the stats of every call, e.g. to export metrics.
+    """
+
+    name = 'base'
+    traces_connections = False
+
+    def __init__(self, model=DEFAULT_MODEL):
+        self.model = model
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.totals = {
+            'calls': 0,
+            'errors': 0,
+            'latency': 0.0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'connections_opened': 0,
+            'connections_reused': 0,
+        }
+
+    def create(self, messages, temperature):
+        raise NotImplementedError
+
+    def complete(self, messages, temperature=0.0):
+        """
+        Args:
+            messages (list): Chat messages, each a dict with role and content.
+            temperature (float): Sampling temperature.
+
+        Returns:
+            dict: content, prompt_tokens, completion_tokens, latency in seconds and whether
+                  the request went over an already open connection (None for backends without connections).
+        """
+        self.local.new_connection = False
+        start = time.perf_counter()
+
+        try:
+            completion = self.create(messages, temperature)
+        except Exception:
+            with self.lock:
+                self.totals['errors'] += 1
+            raise
+
+        prompt_tokens, completion_tokens = completion_usage(completion)
+        call = {
+            'backend': self.name,
+            'content': completion_content(completion),
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'latency': time.perf_counter() - start,
+            'reused_connection': not self.local.new_connection if self.traces_connections else None,
+        }
+
+        with self.lock:
+            self.totals['calls'] += 1
+            self.totals['latency'] += call['latency']
+            self.totals['prompt_tokens'] += prompt_tokens
+            self.totals['completion_tokens'] += completion_tokens
+            self.totals['connections_reused'] += bool(call['reused_connection'])
+
+        for listener in call_listeners:
+            listener(call)
+
+        return call
+
+    def stats(self):
+        """
+        Returns:
+            dict: Totals since the backend was created, plus the mean latency per call.
+        """
+        with self.lock:
+            stats = dict(self.totals, backend=self.name, model=self.model)
+
+        stats['mean_latency'] = stats['latency'] / stats['calls'] if stats['calls'] else None
+        return stats
+
+    def close(self):
+        pass
+
+class OpenAIBackend(LLMBackend):
+    """
+    OpenAI chat completions over one pooled httpx client, so calls reuse open TLS connections.
+    The SDK's own retries are disabled; analysis_engine retries behind its rate limiter.
+    """
+
+    name = 'openai'
+    traces_connections = True
+
+    def __init__(self, model=DEFAULT_MODEL, api_key=None, base_url=None, max_connections=DEFAULT_MAX_CONNECTIONS, timeout=DEFAULT_TIMEOUT):
+        super().__init__(model)
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout,
+            event_hooks={'request': [self.trace_request]},
+        )
+        self.client = OpenAI(
+            api_key=api_key or os.getenv('OPENAI_API_KEY'),
+            base_url=base_url,
+            http_client=self.http_client,
+            max_retries=0,
+        )
+
+    def trace_request(self, request):
+        request.extensions['trace'] = self.trace
+
+    def trace(self, event_name, info):
+        if event_name.endswith('connect_tcp.complete'):
+            self.local.new_connection = True
+            with self.lock:
+                self.totals['connections_opened'] += 1
+
+    def create(self, messages, temperature):
+        return self.client.chat.completions.create(model=self.model, messages=messages, temperature=temperature)
+
+    def close(self):
+        self.http_client.close()
+
+class LocalServerBackend(OpenAIBackend):
+    """
+    Any server speaking the OpenAI chat completions API, such as a local model server or a test mock.
+    """
+
+    name = 'local'
+
+    def __init__(self, base_url, model=DEFAULT_MODEL, api_key='local', **kwargs):
+        super().__init__(model=model, api_key=api_key, base_url=base_url, **kwargs)
+
+class StubBackend(LLMBackend):
+    """
+    Deterministic offline backend for tests and benchmarks. By default it answers the analysis prompt
+    with the last word of the article title as the topic; pass responder to answer with anything else.
+    """
+
+    name = 'stub'
+
+    def __init__(self, model='stub', responder=None, latency=0.0):
+        super().__init__(model)
+        self.responder = responder or self.default_response
+        self.latency = latency
+
+    @staticmethod
+    def default_response(prompt):
+        # Imported here because analyzer imports this module
+        from production.backend.analyzer import BATCH_MARKER
+
+        if BATCH_MARKER in prompt:  # Batch prompt, see analyzer.build_batch_prompt
+            articles = json.loads(prompt.split(BATCH_MARKER, 1)[1])
+            return json.dumps([
+                {'key': article['key'], 'topic': StubBackend.topic(article['title']), 'individuals': 'none', 'sentiment': 'Neutral'}
+                for article in articles
+            ])
+
+        title = prompt.split('Article Title:', 1)[-1].split('\n', 1)[0].strip()
+        return f'Topic: {StubBackend.topic(title)}\nIndividuals: none\nSentiment: Neutral'
+
+    @staticmethod
+    def topic(title):
+        return title.split()[-1] if title and title.split() else 'none'
+
+    def create(self, messages, temperature):
+        prompt = messages[-1]['content']
+        if self.latency:
+            time.sleep(self.latency)
+
+        content = self.responder(prompt)
+        return {
+            'choices': [{'message': {'content': content}}],
+            'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(content) // 4},
+        }
+
+def backend_from_env():
+    """
+    Builds the backend named by LLM_BACKEND: openai (default), local (an OpenAI-compatible server
+    at LLM_BASE_URL) or stub. LLM_MODEL and LLM_MAX_CONNECTIONS apply to the HTTP backends.
+    """
+    kind = os.getenv('LLM_BACKEND', 'openai')
+    model = os.getenv('LLM_MODEL', DEFAULT_MODEL)
+    max_connections = int(os.getenv('LLM_MAX_CONNECTIONS', str(DEFAULT_MAX_CONNECTIONS)))
+
+    if kind == 'openai':
+        return OpenAIBackend(model=model, max_connections=max_connections)
+    if kind == 'local':
+        return LocalServerBackend(os.environ['LLM_BASE_URL'], model=model, max_connections=max_connections)
+    if kind == 'stub':
+        return StubBackend()
+    raise ValueError(f"Unknown LLM_BACKEND '{kind}'.")
+
+current_backend = None
+backend_lock = threading.Lock()
+
+def get_backend():
+    """
+    Returns the process-wide backend, building it from the environment on first use.
+    """
+    global current_backend
+
+    with backend_lock:
+        if current_backend is None:
+            current_backend = backend_from_env()
+        return current_backend
+
+def set_backend(backend):
+    """
+    Replaces the process-wide backend, closing the previous one. Pass None to rebuild from the environment on next use.
+    """
+    global current_backend
+
+    with backend_lock:
+        previous, current_backend = current_backend, backend
+
+    if previous is not None and previous is not backend:
+        previous.close()
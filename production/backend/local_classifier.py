@@ -0,0 +1,477 @@
+"""
+Copyright @emontj 2024
+"""
+
+from collections import Counter
+import io
+import math
+import re
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from production.backend.analysis_cache import normalize_cache_text
+
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_MIN_EXAMPLES = 200
+DEFAULT_MAX_EXAMPLES = 20_000
+MIN_TOPIC_EXAMPLES = 3
+OTHER_TOPIC = '\x00other'  # Topics too rare to learn; predicting it always defers to the LLM
+TITLE_MATCH_CONFIDENCE = 0.95
+TEXT_MATCH_CONFIDENCE = 0.9
+SURNAME_MATCH_CONFIDENCE = 0.8
+MAX_NAME_WORDS = 4
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'have', 'he', 'her', 'his', 'in', 'is',
+    'it', 'its', 'of', 'on', 'or', 'she', 'that', 'the', 'their', 'they', 'this', 'to', 'was', 'were', 'will', 'with',
+}
+
+def words(val):
+    return TOKEN_PATTERN.findall(normalize_cache_text(val))
+
+def tokenize(val):
+    """
+    Unigrams without stopwords, plus all bigrams, of normalized text.
+    """
+    all_words = words(val)
+    return [word for word in all_words if word not in STOPWORDS] + [f'{a} {b}' for a, b in zip(all_words, all_words[1:])]
+
+class SparseRows:
+    """
+    Rows of a sparse matrix in CSR form, with the two products softmax regression needs.
+    """
+
+    def __init__(self, indptr, indices, data, width):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.width = width
+        # Index arrays of the products, computed on first use; training reuses each batch every epoch
+        self.cells = {}
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def slice(self, start, stop):
+        begin, end = self.indptr[start], self.indptr[stop]
+        return SparseRows(self.indptr[start:stop + 1] - begin, self.indices[begin:end], self.data[begin:end], self.width)
+
+    def take(self, rows):
+        rows = np.asarray(rows)
+        lengths = np.diff(self.indptr)[rows]
+        positions = np.concatenate([np.arange(self.indptr[row], self.indptr[row + 1]) for row in rows]) if len(rows) else np.array([], dtype=np.int64)
+        return SparseRows(np.concatenate(([0], np.cumsum(lengths))), self.indices[positions], self.data[positions], self.width)
+
+    def row_ids(self):
+        return np.repeat(np.arange(len(self)), np.diff(self.indptr))
+
+    def product_cells(self, columns):
+        """
+        Flat (target, column) cell of every product summed by dot and transpose_dot, for np.bincount.
+
+        Returns:
+            tuple: Row ids of the stored values, dot cells, the columns present in the rows and transpose_dot cells.
+        """
+        if columns not in self.cells:
+            row_ids = self.row_ids()
+            present, targets = np.unique(self.indices, return_inverse=True)
+            offsets = np.arange(columns)
+            self.cells[columns] = (row_ids, (row_ids[:, None] * columns + offsets).ravel(), present, (targets[:, None] * columns + offsets).ravel())
+        return self.cells[columns]
+
+    def dot(self, weights):
+        """
+        Returns:
+            np.ndarray: self @ weights.
+        """
+        columns = weights.shape[1]
+        _, cells, _, _ = self.product_cells(columns)
+        products = weights[self.indices] * self.data[:, None]
+        return np.bincount(cells, weights=products.ravel(), minlength=len(self) * columns).reshape(len(self), columns).astype(weights.dtype)
+
+    def transpose_dot(self, values):
+        """
+        Returns:
+            np.ndarray: self.T @ values.
+        """
+        # Summed over the columns present in these rows only, then scattered into the full width
+        columns = values.shape[1]
+        row_ids, _, present, cells = self.product_cells(columns)
+        products = values[row_ids] * self.data[:, None]
+        result = np.zeros((self.width, columns), dtype=values.dtype)
+        result[present] = np.bincount(cells, weights=products.ravel(), minlength=len(present) * columns).reshape(len(present), columns)
+        return result
+
+class TfidfVectorizer:
+    """
+    TF-IDF over tokenize, keeping the max_features terms found in the most documents (at least min_df).
+    Rows are l2-normalized.
+    """
+
+    def __init__(self, min_df=2, max_features=20_000):
+        self.min_df = min_df
+        self.max_features = max_features
+        self.vocabulary = {}
+        self.idf = np.zeros(0, dtype=np.float32)
+
+    def fit(self, texts):
+        document_counts = Counter(term for val in texts for term in set(tokenize(val)))
+        terms = [term for term, count in document_counts.most_common(self.max_features) if count >= self.min_df]
+
+        self.vocabulary = {term: i for i, term in enumerate(terms)}
+        self.idf = np.array([math.log((1 + len(texts)) / (1 + document_counts[term])) + 1 for term in terms], dtype=np.float32)
+        return self
+
+    def transform(self, texts):
+        indptr, indices, data = [0], [], []
+
+        for val in texts:
+            counts = Counter(self.vocabulary[term] for term in tokenize(val) if term in self.vocabulary)
+            row_indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            row_data = np.fromiter(counts.values(), dtype=np.float32, count=len(counts)) * self.idf[row_indices]
+            norm = np.linalg.norm(row_data)
+
+            indices.append(row_indices)
+            data.append(row_data / norm if norm else row_data)
+            indptr.append(indptr[-1] + len(counts))
+
+        return SparseRows(
+            np.array(indptr, dtype=np.int64),
+            np.concatenate(indices) if indices else np.array([], dtype=np.int64),
+            np.concatenate(data) if data else np.array([], dtype=np.float32),
+            len(self.vocabulary),
+        )
+
+def softmax(scores):
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+class SoftmaxRegression:
+    """
+    Multinomial logistic regression on SparseRows, trained with mini-batch gradient descent and l2 regularization.
+    """
+
+    def __init__(self, epochs=40, learning_rate=5.0, l2=1e-4, batch_size=64, seed=0):
+        self.epochs = epochs
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.batch_size = batch_size
+        self.seed = seed
+        self.classes = []
+
+    def fit(self, features, labels):
+        self.classes = sorted(set(labels))
+        class_index = {label: i for i, label in enumerate(self.classes)}
+        targets = np.array([class_index[label] for label in labels])
+        rng = np.random.default_rng(self.seed)
+
+        order = rng.permutation(len(features))
+        features, targets = features.take(order), targets[order]
+        self.weights = np.zeros((features.width, len(self.classes)), dtype=np.float32)
+        self.bias = np.zeros(len(self.classes), dtype=np.float32)
+
+        starts = np.arange(0, len(features), self.batch_size)
+        batches = [(features.slice(start, min(start + self.batch_size, len(features))), targets[start:start + self.batch_size]) for start in starts]
+        for _ in range(self.epochs):
+            for i in rng.permutation(len(batches)):
+                batch, batch_targets = batches[i]
+
+                errors = softmax(batch.dot(self.weights) + self.bias)
+                errors[np.arange(len(batch)), batch_targets] -= 1
+                errors /= len(batch)
+
+                self.weights -= self.learning_rate * (batch.transpose_dot(errors) + self.l2 * self.weights)
+                self.bias -= self.learning_rate * errors.sum(axis=0)
+
+        return self
+
+    def predict(self, features):
+        """
+        Returns:
+            list: (label, probability) of the most likely class of every row.
+        """
+        if not len(features):
+            return []
+
+        probabilities = softmax(features.dot(self.weights) + self.bias)
+        best = probabilities.argmax(axis=1)
+        return [(self.classes[i], float(probabilities[row, i])) for row, i in enumerate(best)]
+
+class Gazetteer:
+    """
+    Individuals named in earlier analyses, found in new articles by full name or by a surname
+    that belongs to only one known individual.
+    """
+
+    def __init__(self, individuals):
+        # Matching uses normalized words; matches are reported as the label the LLM used most for that name
+        labels = Counter(name for name in individuals if isinstance(name, str) and name.strip() and name.strip() != 'none')
+        self.labels = {}
+        for label, _ in labels.most_common():
+            self.labels.setdefault(' '.join(words(label)), label)
+        self.labels.pop('', None)
+        self.names = set(self.labels)
+
+        surnames = {}
+        for name in self.names:
+            surnames.setdefault(name.split()[-1], set()).add(name)
+        self.surnames = {surname: next(iter(full)) for surname, full in surnames.items() if len(full) == 1}
+
+    def mentions(self, val):
+        val_words = words(val)
+        ngrams = {' '.join(val_words[i:i + n]) for n in range(1, MAX_NAME_WORDS + 1) for i in range(len(val_words) - n + 1)}
+        full = ngrams & self.names
+        by_surname = {self.surnames[word] for word in set(val_words) & self.surnames.keys()}
+        return full, by_surname
+
+    def match(self, title, summary):
+        """
+        Returns:
+            tuple: The individual an article is most likely about and the confidence of the match,
+                   or (None, 0.0) when no known individual, or more than one, is named.
+        """
+        title_full, title_surnames = self.mentions(title)
+        text_full, text_surnames = self.mentions(f'{title} {summary}')
+
+        if len(title_full) == 1 and title_surnames <= title_full:
+            return self.labels[next(iter(title_full))], TITLE_MATCH_CONFIDENCE
+        if len(text_full) == 1 and text_surnames <= text_full:
+            return self.labels[next(iter(text_full))], TEXT_MATCH_CONFIDENCE
+        if not text_full and len(text_surnames) == 1:
+            return self.labels[next(iter(text_surnames))], SURNAME_MATCH_CONFIDENCE
+        return None, 0.0
+
+def article_text(row_dict):
+    return f"{row_dict.get('title') or ''} {row_dict.get('summary') or ''}"
+
+class LocalAnalyzer:
+    """
+    First pass of the analysis cascade, trained on earlier LLM analyses: TF-IDF softmax regressions
+    for topic and sentiment, and a Gazetteer of known individuals. Articles whose weakest field
+    reaches threshold confidence are answered locally; the rest go to the LLM.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, min_topic_examples=MIN_TOPIC_EXAMPLES, **regression_options):
+        self.threshold = threshold
+        self.min_topic_examples = min_topic_examples
+        self.regression_options = regression_options
+
+    def fit(self, df):
+        """
+        Args:
+            df (pd.DataFrame): LLM-analyzed articles with title, summary, topic, individuals and sentiment.
+        """
+        texts = [article_text(row_dict) for row_dict in df.to_dict(orient='records')]
+        topic_counts = Counter(df['topic'])
+        topics = [topic if topic_counts[topic] >= self.min_topic_examples else OTHER_TOPIC for topic in df['topic']]
+
+        self.vectorizer = TfidfVectorizer().fit(texts)
+        features = self.vectorizer.transform(texts)
+        self.topics = SoftmaxRegression(**self.regression_options).fit(features, topics)
+        self.sentiments = SoftmaxRegression(**self.regression_options).fit(features, list(df['sentiment']))
+        self.gazetteer = Gazetteer(df['individuals'])
+        return self
+
+    def predict(self, row_dicts):
+        """
+        Returns:
+            list: (analysis, confidence) per article, the confidence being that of its least certain field.
+        """
+        features = self.vectorizer.transform([article_text(row_dict) for row_dict in row_dicts])
+        predictions = []
+
+        for row_dict, (topic, topic_p), (sentiment, sentiment_p) in zip(row_dicts, self.topics.predict(features), self.sentiments.predict(features)):
+            individual, individual_p = self.gazetteer.match(row_dict.get('title'), row_dict.get('summary'))
+            confidence = 0.0 if topic == OTHER_TOPIC else min(topic_p, sentiment_p, individual_p)
+            predictions.append(({'topic': topic, 'individuals': individual, 'sentiment': sentiment}, confidence))
+
+        return predictions
+
+    def answer(self, row_dicts):
+        """
+        Returns:
+            list: Per article, its analysis tagged analyzed_by='local' if confident enough, otherwise None.
+        """
+        return [
+            dict(analysis, analyzed_by='local') if confidence >= self.threshold else None
+            for analysis, confidence in self.predict(row_dicts)
+        ]
+
+    def to_bytes(self):
+        """
+        The trained model as a compressed numpy archive of plain arrays, for AnalyzerStore.
+        """
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            terms=np.array(list(self.vectorizer.vocabulary), dtype=str),
+            idf=self.vectorizer.idf,
+            **{f'{name}_{part}': value for name, model in (('topic', self.topics), ('sentiment', self.sentiments)) for part, value in (
+                ('classes', np.array(model.classes, dtype=str)), ('weights', model.weights), ('bias', model.bias),
+            )},
+            individuals=np.array(list(self.gazetteer.labels.values()), dtype=str),
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, model, threshold=DEFAULT_THRESHOLD):
+        arrays = np.load(io.BytesIO(model), allow_pickle=False)
+        analyzer = cls(threshold=threshold)
+
+        analyzer.vectorizer = TfidfVectorizer()
+        analyzer.vectorizer.vocabulary = {term: i for i, term in enumerate(arrays['terms'].tolist())}
+        analyzer.vectorizer.idf = arrays['idf']
+        analyzer.topics, analyzer.sentiments = SoftmaxRegression(), SoftmaxRegression()
+        for name, regression in (('topic', analyzer.topics), ('sentiment', analyzer.sentiments)):
+            regression.classes = arrays[f'{name}_classes'].tolist()
+            regression.weights = arrays[f'{name}_weights']
+            regression.bias = arrays[f'{name}_bias']
+        # Every stored label is the one kept for its name, so the gazetteer rebuilds the same
+        analyzer.gazetteer = Gazetteer(arrays['individuals'].tolist())
+        return analyzer
+
+    @classmethod
+    def from_database(cls, engine, threshold=DEFAULT_THRESHOLD, min_examples=DEFAULT_MIN_EXAMPLES, max_examples=DEFAULT_MAX_EXAMPLES):
+        """
+        Trains on the most recent LLM analyses in the database.
+
+        Returns:
+            LocalAnalyzer: The trained analyzer, or None if there are fewer than min_examples analyses.
+        """
+        df = llm_labels(engine, max_examples)
+        if len(df) < min_examples:
+            print(f'Local analyzer not trained: {len(df)} of {min_examples} labeled articles')
+            return None
+
+        return cls(threshold=threshold).fit(df)
+
+class AnalyzerStore:
+    """
+    The latest trained LocalAnalyzer in the local_analyzer table, so that it is trained once for every
+    worker sharing the database rather than by each of them, and loaded again only after a retrain.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                CREATE TABLE IF NOT EXISTS local_analyzer (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    trained_at REAL NOT NULL,
+                    model BLOB NOT NULL
+                )
+            '''))
+
+    def trained_at(self):
+        """
+        Returns:
+            float: When the stored analyzer was trained, or None if none is stored.
+        """
+        with self.engine.connect() as connection:
+            return connection.execute(text('SELECT trained_at FROM local_analyzer WHERE id = 1')).scalar()
+
+    def save(self, analyzer):
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                INSERT INTO local_analyzer (id, trained_at, model) VALUES (1, :trained_at, :model)
+                ON CONFLICT(id) DO UPDATE SET trained_at = excluded.trained_at, model = excluded.model
+            '''), {'trained_at': time.time(), 'model': analyzer.to_bytes()})
+
+    def load(self, threshold=DEFAULT_THRESHOLD):
+        """
+        Returns:
+            tuple: The stored analyzer and when it was trained, or (None, None) if none is stored.
+        """
+        with self.engine.connect() as connection:
+            row = connection.execute(text('SELECT trained_at, model FROM local_analyzer WHERE id = 1')).first()
+
+        if row is None:
+            return None, None
+        return LocalAnalyzer.from_bytes(row.model, threshold=threshold), row.trained_at
+
+    def retrain(self, max_age, min_examples=DEFAULT_MIN_EXAMPLES, max_examples=DEFAULT_MAX_EXAMPLES):
+        """
+        Trains and stores a new analyzer on the latest LLM analyses if the stored one is older than
+        max_age seconds, or missing.
+
+        Returns:
+            bool: True if a new analyzer was stored.
+        """
+        trained_at = self.trained_at()
+        if trained_at is not None and time.time() - trained_at < max_age:
+            return False
+
+        analyzer = LocalAnalyzer.from_database(self.engine, min_examples=min_examples, max_examples=max_examples)
+        if analyzer is None:
+            return False
+
+        self.save(analyzer)
+        return True
+
+def llm_labels(engine, limit=DEFAULT_MAX_EXAMPLES):
+    """
+    Returns:
+        pd.DataFrame: Title, summary and analysis of the limit most recently analyzed articles, leaving out
+                      analyses that were answered locally so the analyzer never learns from itself.
+    """
+    db_inspector = inspect(engine)
+    if not db_inspector.has_table('analyzed_rss') or not db_inspector.has_table('news_rss'):
+        return pd.DataFrame(columns=['title', 'summary', 'topic', 'individuals', 'sentiment'])
+
+    local_filter = "AND analyzed_rss.analyzed_by IS NOT 'local'" if 'analyzed_by' in {col['name'] for col in db_inspector.get_columns('analyzed_rss')} else ''
+    query = text(f'''
+        SELECT news_rss.title, news_rss.summary, analyzed_rss.topic, analyzed_rss.individuals, analyzed_rss.sentiment
+        FROM analyzed_rss JOIN news_rss ON news_rss.article_key = analyzed_rss.article_key
+        WHERE analyzed_rss.topic IS NOT NULL AND analyzed_rss.sentiment IS NOT NULL {local_filter}
+        ORDER BY analyzed_rss.rowid DESC LIMIT :limit
+    ''')
+
+    with engine.connect() as connection:
+        result = connection.execute(query, {'limit': limit})
+        return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+def evaluate(df, thresholds=(0.5, 0.7, 0.8, 0.9, 0.95), folds=5, seed=0, **options):
+    """
+    Cross-validates the local analyzer against LLM labels: every article is predicted by a model trained
+    on the other folds, then each threshold is scored on the articles it would have answered locally.
+
+    Args:
+        df (pd.DataFrame): LLM-analyzed articles, see llm_labels.
+        thresholds (iterable): Confidence thresholds to report.
+        folds (int): Number of cross-validation folds.
+        **options: Passed on to LocalAnalyzer.
+
+    Returns:
+        list: Per threshold, the fraction of LLM calls avoided and, on those articles, the fraction
+              agreeing with the LLM on every field and on each field separately.
+    """
+    order = np.random.default_rng(seed).permutation(len(df))
+    predictions = [None] * len(df)
+
+    for fold in range(folds):
+        test_rows = order[fold::folds]
+        train_rows = np.setdiff1d(order, test_rows)
+        analyzer = LocalAnalyzer(**options).fit(df.iloc[train_rows])
+        for row, prediction in zip(test_rows, analyzer.predict(df.iloc[test_rows].to_dict(orient='records'))):
+            predictions[row] = prediction
+
+    labels = df.to_dict(orient='records')
+    report = []
+
+    for threshold in thresholds:
+        answered = [(analysis, label) for (analysis, confidence), label in zip(predictions, labels) if confidence >= threshold]
+        agreement = {field: sum(analysis[field] == label[field] for analysis, label in answered) / len(answered) if answered else None for field in ('topic', 'individuals', 'sentiment')}
+
+        report.append({
+            'threshold': threshold,
+            'calls_avoided': len(answered) / len(labels) if labels else 0.0,
+            'agreement': sum(all(analysis[field] == label[field] for field in agreement) for analysis, label in answered) / len(answered) if answered else None,
+            **{f'{field}_agreement': value for field, value in agreement.items()},
+        })
+
+    return report
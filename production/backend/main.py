@@ -2,21 +2,42 @@
 Copyright @emontj 2024
 """
 
+import functools
+import itertools
 import os
 import time
 import traceback
 
-from flask import Flask, request, jsonify, render_template
+import click
+from flask import Flask, request, jsonify, render_template, stream_with_context
 from flask_healthz import healthz
 from flask_sqlalchemy import SQLAlchemy
+from openai import OpenAI
 import pandas as pd
-from prometheus_client import Counter
+from prometheus_client import Counter, Gauge, Histogram
 from prometheus_flask_exporter import PrometheusMetrics
 from sqlalchemy import text
 
-from production.backend.analyzer import run_analysis
-from production.backend.collector import update_data
+from production.backend.analysis_cache import AnalysisCache, lookup_listeners
+from production.backend.analysis_engine import AnalysisBudget, RateLimiter
+from production.backend.analyzer import checkpoint_listeners, run_analysis
+from production.backend.batch_jobs import DEFAULT_MAX_REQUESTS, LocalBatchService, OpenAIBatchService, run_batch_job
+from production.backend.collector import hex_to_key, key_to_hex, update_data, upgrade_article_keys
+from production.backend.feed_cache import ValidatorStore
+from production.backend.llm_backends import call_listeners, get_backend
+from production.backend.local_classifier import AnalyzerStore, evaluate, llm_labels
+from production.backend.migrations import migrate, schema_version
+from production.backend.pagination import BEFORE_FIRST, STREAM_CHUNK_ROWS, next_cursor, parse_page
+from production.backend.polling import PollingPlanner
+from production.backend.response_cache import CACHED_STATUSES, ResponseCache, SharedResponseStore, dataset_generation, response_key, response_listeners
+from production.backend.rollups import parse_top_n, top_counts
+from production.backend.scheduler import FeedScheduler
+from production.backend.search import person_match, search_limit, search_match
+from production.backend.schema import API_QUERIES, metadata
+from production.backend.sharding import collect_sharded
+from production.backend.story_clusters import StoryClusterIndex, cluster_coverage
 from production.backend.source_configs import PRODUCTION_NEWS_SOURCES
+from production.backend.watermarks import WatermarkStore
 from production.monitoring.dashboard import build_dashboard
 from production.monitoring.health import ReadinessChecks
 
@@ -25,19 +46,96 @@ app = Flask(
     static_folder='../frontend/static',
     template_folder='../frontend/templates'
 )
+# Keep dict keys in the order the views build them, e.g. /counts most common first
+app.json.sort_keys = False
 INSTANCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../instance')
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(INSTANCE_PATH, 'Users.sqlite3')}"
-last_feed_update = 0
-db = SQLAlchemy(app)
+FEED_FETCH_WORKERS = int(os.getenv('FEED_FETCH_WORKERS', '8'))
+FEED_CONNECT_TIMEOUT = float(os.getenv('FEED_CONNECT_TIMEOUT', '5'))
+FEED_READ_TIMEOUT = float(os.getenv('FEED_READ_TIMEOUT', '15'))
+COLLECTOR_PROCESSES = int(os.getenv('COLLECTOR_PROCESSES', '1'))
+ANALYSIS_MAX_IN_FLIGHT = int(os.getenv('ANALYSIS_MAX_IN_FLIGHT', '8'))
+ANALYSIS_BATCH_SIZE = int(os.getenv('ANALYSIS_BATCH_SIZE', '1'))
+# Per-run analysis budget; 0 means no limit
+ANALYSIS_BUDGET_CALLS = int(os.getenv('ANALYSIS_BUDGET_CALLS', '50'))
+ANALYSIS_BUDGET_TOKENS = int(os.getenv('ANALYSIS_BUDGET_TOKENS', '0'))
+ANALYSIS_BUDGET_SECONDS = float(os.getenv('ANALYSIS_BUDGET_SECONDS', '0'))
+ANALYSIS_FAIR_OUTLETS = os.getenv('ANALYSIS_FAIR_OUTLETS', '1') == '1'
+BATCH_SERVICE = os.getenv('LLM_BATCH_SERVICE', 'openai')
+BATCH_DIRECTORY = os.getenv('LLM_BATCH_DIR', os.path.join(INSTANCE_PATH, 'batches'))
+BATCH_POLL_INTERVAL = float(os.getenv('LLM_BATCH_POLL_SECONDS', '60'))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', '100000'))
+ANALYSIS_CACHE_MAX_AGE = float(os.getenv('ANALYSIS_CACHE_MAX_AGE_SECONDS', str(30 * 86400)))
+analysis_cache = None
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', '1') == '1'
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1000'))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(64 * 2**20)))
+# SQLite file shared by the workers on a host, e.g. instance/responses.sqlite3; unset keeps the cache per process
+RESPONSE_CACHE_SHARED_PATH = os.getenv('RESPONSE_CACHE_SHARED_PATH', '')
+response_cache = None
+CASCADE_ENABLED = os.getenv('CASCADE_ENABLED', '1') == '1'
+CASCADE_THRESHOLD = float(os.getenv('CASCADE_THRESHOLD', '0.9'))
+CASCADE_MIN_EXAMPLES = int(os.getenv('CASCADE_MIN_EXAMPLES', '200'))
+CASCADE_RETRAIN_INTERVAL = float(os.getenv('CASCADE_RETRAIN_SECONDS', str(6 * 3600)))
+local_analyzer = None
+local_analyzer_trained_at = None
+STORY_CLUSTERING = os.getenv('STORY_CLUSTERING', '1') == '1'
+STORY_CLUSTER_THRESHOLD = float(os.getenv('STORY_CLUSTER_THRESHOLD', '0.5'))
+STORY_CLUSTER_WINDOW = float(os.getenv('STORY_CLUSTER_WINDOW_SECONDS', str(3 * 86400)))
+analysis_limiter = RateLimiter(
+    requests_per_minute=int(os.getenv('ANALYSIS_REQUESTS_PER_MINUTE', '500')),
+    tokens_per_minute=int(os.getenv('ANALYSIS_TOKENS_PER_MINUTE', '200000')),
+)
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', '1') == '1'
+SCHEDULER_INTERVAL = float(os.getenv('SCHEDULER_INTERVAL_SECONDS', '300'))
+POLL_MIN_INTERVAL = float(os.getenv('POLL_MIN_INTERVAL_SECONDS', '300'))
+POLL_MAX_INTERVAL = float(os.getenv('POLL_MAX_INTERVAL_SECONDS', '21600'))
+SCHEDULER_LEASE_TTL = float(os.getenv('SCHEDULER_LEASE_SECONDS', '900'))
+SCHEDULER_TICK = float(os.getenv('SCHEDULER_TICK_SECONDS', '30'))
+# /counts response keys and the rollup dimensions behind them
+COUNT_DIMENSIONS = {'Individuals': 'individuals', 'Topics': 'topic', 'Outlets': 'outlet', 'Sentiments': 'sentiment'}
+scheduler = None
+db = SQLAlchemy(app, metadata=metadata)
+migrated = False
 metrics = PrometheusMetrics(app)
 total_request_counter = Counter('requests_total', 'Total number of requests')
 posting_counter = Counter('requests_posting', 'Total requests for postings')
 topic_counter = Counter('requests_topic', 'Total requests for topic')
+feed_fetch_counter = Counter('feed_fetches', 'Feed downloads by cache result', ['outlet', 'result'])
+feed_bytes_saved_counter = Counter('feed_bytes_saved', 'Feed bytes not downloaded thanks to conditional requests', ['outlet'])
+feed_entries_counter = Counter('feed_entries', 'Parsed feed entries, new or skipped by the watermark', ['outlet', 'result'])
+llm_latency_histogram = Histogram('llm_request_seconds', 'Chat completion latency', ['backend'])
+llm_tokens_counter = Counter('llm_tokens', 'Chat completion tokens used', ['backend', 'kind'])
+analysis_cache_counter = Counter('analysis_cache_lookups', 'Analysis cache lookups; every hit is a model call saved', ['result'])
+llm_connections_counter = Counter('llm_connections', 'Chat completion requests by whether they opened a new connection', ['backend', 'result'])
+analysis_checkpoint_histogram = Histogram('analysis_checkpoint_seconds', 'Time to store a checkpoint of analysis results')
+analysis_rows_counter = Counter('analysis_rows_stored', 'Analysis results stored by checkpoints')
+endpoint_counters = {'get_topic_by_name': topic_counter, 'get_posting_by_id': posting_counter}
+response_cache_counter = Counter('response_cache_lookups', 'Read endpoint responses by where the cache found them', ['result'])
+response_cache_hit_ratio = Gauge('response_cache_hit_ratio', 'Share of read endpoint responses served from the cache since this worker started')
 app.register_blueprint(healthz, url_prefix="/health")
 
 @app.before_request
 def increment_counter():
+    # Counted here rather than in the views so that responses served from the cache count too
     total_request_counter.inc()
+    if request.endpoint in endpoint_counters:
+        endpoint_counters[request.endpoint].inc()
+
+@app.before_request
+def migrate_database():
+    # Once per process before anything touches the tables; run `flask migrate-db` on deploy to avoid doing it on a request
+    global migrated
+
+    if not migrated:
+        migrate(db.engine)
+        migrated = True
+
+@app.before_request
+def start_scheduler():
+    # Started from the first request rather than at import so CLI commands never run refreshes
+    if SCHEDULER_ENABLED:
+        get_scheduler().start()
 
 @app.route("/")
 def main():
@@ -48,112 +146,474 @@ def echo_input():
     input_text = request.form.get("user_input", "")
     return "You entered: " + input_text
 
+def record_fetch_report(report):
+    for outlet, summary in report.items():
+        for result in ('hits', 'misses', 'errors'):
+            feed_fetch_counter.labels(outlet=outlet, result=result).inc(summary[result])
+        feed_bytes_saved_counter.labels(outlet=outlet).inc(summary['bytes_saved'])
+        feed_entries_counter.labels(outlet=outlet, result='new').inc(summary.get('entries_new', 0))
+        feed_entries_counter.labels(outlet=outlet, result='skipped').inc(summary.get('entries_skipped', 0))
+
+def record_llm_call(call):
+    llm_latency_histogram.labels(backend=call['backend']).observe(call['latency'])
+    llm_tokens_counter.labels(backend=call['backend'], kind='prompt').inc(call['prompt_tokens'])
+    llm_tokens_counter.labels(backend=call['backend'], kind='completion').inc(call['completion_tokens'])
+    if call['reused_connection'] is not None:
+        llm_connections_counter.labels(backend=call['backend'], result='reused' if call['reused_connection'] else 'new').inc()
+
+call_listeners.append(record_llm_call)
+lookup_listeners.append(lambda hit: analysis_cache_counter.labels(result='hit' if hit else 'miss').inc())
+
+def record_checkpoint(rows, seconds):
+    analysis_checkpoint_histogram.observe(seconds)
+    analysis_rows_counter.inc(rows)
+
+checkpoint_listeners.append(record_checkpoint)
+response_listeners.append(lambda result: response_cache_counter.labels(result=result).inc())
+response_cache_hit_ratio.set_function(lambda: (response_cache.stats()['hit_ratio'] or 0) if response_cache is not None else 0)
+
+def records_for_json(df):
+    """
+    Converts query results to JSON records, with article keys in their 16-character hex form
+    since browsers cannot represent 64-bit integers exactly. Results are read with dtype=object
+    so that keys in columns holding NULLs are not turned into floats first.
+    """
+    df = df.loc[:, ~df.columns.duplicated()]
+
+    for column in ('article_key', 'cluster_id'):
+        if column in df:
+            df = df.assign(**{column: [None if pd.isna(key) else key_to_hex(key) for key in df[column]]})
+
+    return df.to_dict(orient='records')
+
+def add_coverage(df):
+    """
+    Adds covered_by, the number of outlets that ran each article's story, to analysis rows.
+    Articles analyzed before story clustering count as covered by their own outlet only.
+    """
+    if 'cluster_id' not in df:
+        return df
+
+    coverage = cluster_coverage(db.engine, {int(cluster_id) for cluster_id in df['cluster_id'] if not pd.isna(cluster_id)})
+    return df.assign(covered_by=[1 if pd.isna(cluster_id) else coverage.get(int(cluster_id), 1) for cluster_id in df['cluster_id']])
+
+def posting_filter(posting_id):
+    """
+    Picks the news_rss column a posting id is looked up by, which is either a 16-character article key
+    or, for links created before article keys existed, a 64-character title hash.
+
+    Returns:
+        tuple: The column, see schema.POSTING_CONDITIONS, and the query parameters.
+    """
+    if len(posting_id) == 16:
+        try:
+            return 'article_key', {'posting_id': hex_to_key(posting_id)}
+        except ValueError:
+            pass
+
+    return 'hashed_title', {'posting_id': posting_id}
+
+def collect_feeds(engine):
+    if COLLECTOR_PROCESSES > 1:
+        report = collect_sharded(
+            PRODUCTION_NEWS_SOURCES,
+            engine.url.render_as_string(hide_password=False),
+            COLLECTOR_PROCESSES,
+            max_workers=FEED_FETCH_WORKERS,
+            connect_timeout=FEED_CONNECT_TIMEOUT,
+            read_timeout=FEED_READ_TIMEOUT,
+            poll_intervals=(POLL_MIN_INTERVAL, POLL_MAX_INTERVAL),
+        )
+    else:
+        report = update_data(
+            PRODUCTION_NEWS_SOURCES,
+            engine,
+            concurrent=True,
+            max_workers=FEED_FETCH_WORKERS,
+            connect_timeout=FEED_CONNECT_TIMEOUT,
+            read_timeout=FEED_READ_TIMEOUT,
+            validator_store=ValidatorStore(engine),
+            watermark_store=WatermarkStore(engine),
+            planner=PollingPlanner(engine, min_interval=POLL_MIN_INTERVAL, max_interval=POLL_MAX_INTERVAL),
+        )
+    record_fetch_report(report)
+
+def get_scheduler():
+    """
+    Returns this process's scheduler, creating it on first use. Every gunicorn worker has one,
+    and the database lease makes sure only one of them refreshes at a time. Each run fetches
+    only the feeds the polling planner says are due, so the interval is the shortest poll interval.
+    """
+    global scheduler
+
+    if scheduler is None:
+        engine = db.engine
+        scheduler = FeedScheduler(
+            engine,
+            [
+                ('collect', lambda: collect_feeds(engine)),
+                # Scheduled analysis stops starting requests when the next run is due, so fresh articles never wait behind a backlog
+                ('analyze', lambda: analyze_pending(engine, deadline=time.time() + SCHEDULER_INTERVAL, before_round=scheduler.renew)),
+            ],
+            interval=SCHEDULER_INTERVAL,
+            lease_ttl=SCHEDULER_LEASE_TTL,
+            tick=SCHEDULER_TICK,
+        )
+
+    return scheduler
+
 @app.route('/update_data', methods=['GET'])
 def update_and_save():
-    global last_feed_update
-
-    now = time.time()
-    if now - last_feed_update > 3600:
-        update_data(PRODUCTION_NEWS_SOURCES, db.engine)
-        analyze_data()
-        last_feed_update = now
+    if get_scheduler().run_pending():
         return 'Feed updated'
     else:
         return 'Check feed later, updated too frequently'
 
+@app.route('/scheduler/status', methods=['GET'])
+def scheduler_status():
+    status = get_scheduler().status()
+    status['enabled'] = SCHEDULER_ENABLED
+    status['feeds'] = list(PollingPlanner(db.engine).load().values())
+    return jsonify(status)
+
+@app.route('/llm/status', methods=['GET'])
+def llm_status():
+    status = get_backend().stats()
+    status['cache'] = get_analysis_cache(db.engine).stats()
+    return jsonify(status)
+
+def get_analysis_cache(engine):
+    global analysis_cache
+
+    if analysis_cache is None:
+        analysis_cache = AnalysisCache(engine, max_entries=ANALYSIS_CACHE_MAX_ENTRIES, max_age=ANALYSIS_CACHE_MAX_AGE)
+
+    return analysis_cache
+
+def get_response_cache():
+    global response_cache
+
+    if response_cache is None:
+        shared = SharedResponseStore(RESPONSE_CACHE_SHARED_PATH) if RESPONSE_CACHE_SHARED_PATH else None
+        response_cache = ResponseCache(max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES, shared=shared)
+
+    return response_cache
+
+def cached_response(view):
+    """
+    Serves a read endpoint from the response cache until the next write to the articles or their
+    analyses. Successful responses carry a strong ETag and must be revalidated, so a browser holding
+    the current one gets a 304.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not RESPONSE_CACHE_ENABLED:
+            return view(*args, **kwargs)
+
+        cache = get_response_cache()
+        with db.engine.connect() as connection:
+            generation = dataset_generation(connection)
+        key = response_key(request.path, request.args, generation)
+
+        cached = cache.get(key, generation)
+        if cached is None:
+            response = app.make_response(view(*args, **kwargs))
+            # Streamed responses are written as they are read and never held whole
+            if response.status_code not in CACHED_STATUSES or response.is_streamed:
+                return response
+            cached = cache.put(key, generation, response.status_code, response.get_data(), response.mimetype)
+
+        response = app.response_class(cached.body, status=cached.status, mimetype=cached.mimetype)
+        if cached.status == 200:
+            response.set_etag(cached.etag)
+            response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
+    return wrapper
+
+def get_local_analyzer(engine):
+    """
+    Returns the local analyzer stored in the database, first retraining it on the latest LLM analyses
+    if it is older than CASCADE_RETRAIN_SECONDS, or None while there are too few of them. Callers hold
+    the analysis lease, so one process trains and the others load the stored model once per retrain.
+    """
+    global local_analyzer, local_analyzer_trained_at
+
+    store = AnalyzerStore(engine)
+    store.retrain(CASCADE_RETRAIN_INTERVAL, min_examples=CASCADE_MIN_EXAMPLES)
+
+    if store.trained_at() != local_analyzer_trained_at:
+        local_analyzer, local_analyzer_trained_at = store.load(threshold=CASCADE_THRESHOLD)
+
+    return local_analyzer
+
+def analyze_pending(engine, deadline=None, before_round=None):
+    """
+    Analyzes pending articles, newest first and shared fairly between outlets, until the per-run
+    budget of calls, tokens and seconds or the deadline (a time.time() timestamp) is spent, or
+    before_round returns False, see run_analysis.
+
+    Returns:
+        int: Number of articles analyzed.
+    """
+    budget = AnalysisBudget(
+        calls = ANALYSIS_BUDGET_CALLS or None,
+        tokens = ANALYSIS_BUDGET_TOKENS or None,
+        seconds = ANALYSIS_BUDGET_SECONDS or None,
+        deadline = deadline,
+    )
+
+    analysis_df = run_analysis(
+        engine,
+        budget = budget,
+        fair = ANALYSIS_FAIR_OUTLETS,
+        max_in_flight = ANALYSIS_MAX_IN_FLIGHT,
+        limiter = analysis_limiter,
+        batch_size = ANALYSIS_BATCH_SIZE,
+        cache = get_analysis_cache(engine),
+        clusters = StoryClusterIndex(engine, threshold=STORY_CLUSTER_THRESHOLD, window=STORY_CLUSTER_WINDOW) if STORY_CLUSTERING else None,
+        local = get_local_analyzer(engine) if CASCADE_ENABLED else None,
+        before_round = before_round,
+    )
+    count = 0 if analysis_df is None else len(analysis_df)
+    app.logger.info('Analyzed %d articles', count)
+
+    return count
+
 @app.route('/analyze', methods=['GET'])
 def analyze_data():
     try:
-        analysis_df = run_analysis(db.engine, limit = 50)
-        print(analysis_df)
+        # Under the scheduler's lease, so no other worker or scheduled run pays for the same backlog at once
+        feed_scheduler = get_scheduler()
+        ran, _ = feed_scheduler.run_exclusive('analyze', lambda: analyze_pending(db.engine, deadline=time.time() + SCHEDULER_LEASE_TTL, before_round=feed_scheduler.renew))
+        if not ran:
+            return 'Analysis already running, try again later', 409
 
         return 'analyzed'
     except Exception as e:
         # return str(traceback.format_exc()) # NOTE: this is helpful for debugging, but exposes server structure so do not enable when in production.
         return 'An error occured when analyzing the data'
 
-@app.route('/topic/<string:topic_name>', methods=['GET'])
-def get_topic_by_name(topic_name):
-    topic_counter.inc()
-    query = text('SELECT * FROM analyzed_rss WHERE topic = :topic_name')
+def analysis_chunks(connection, query, params, page):
+    """
+    Reads a list endpoint's page from the database cursor, STREAM_CHUNK_ROWS rows at a time when
+    streaming and in one chunk otherwise.
 
-    with db.engine.connect() as connection:
-        result = connection.execute(query, {'topic_name': topic_name})
-        df = pd.DataFrame(result.fetchall(), columns=result.keys())
+    Yields:
+        tuple: JSON records of a chunk, and the rowid of its last row.
+    """
+    result = connection.execute(text(query), {**params, 'after': page.after, 'limit': page.limit or -1})
+    columns = list(result.keys())
 
-    if df.empty:
+    while rows := (result.fetchmany(STREAM_CHUNK_ROWS) if page.stream else result.fetchall()):
+        df = pd.DataFrame(rows, columns=columns, dtype=object)
+        yield records_for_json(add_coverage(df.drop(columns='row_cursor'))), df['row_cursor'].iloc[-1]
+
+def stream_analyses(chunks, page):
+    """
+    Writes the chunks' records to the response as they are read, in the format analysis_list returns.
+    """
+    count = 0
+    last_row_id = None
+
+    yield '{"items": [' if page.limit else '['
+    for records, last_row_id in chunks:
+        for record in records:
+            yield (',' if count else '') + app.json.dumps(record, separators=(',', ':'))
+            count += 1
+    yield f'], "next": {app.json.dumps(next_cursor(page, count, last_row_id))}}}' if page.limit else ']'
+
+def analysis_list(query, params):
+    """
+    Responds with the analyses a list endpoint's query finds, in rowid order. Without limit the
+    response is every analysis after the after cursor, as before pagination; with it, a page of
+    {"items": [...], "next": cursor}, next being null on the last page. With stream=1 rows are
+    written as they are read, so memory is bounded by STREAM_CHUNK_ROWS rather than the result.
+    """
+    try:
+        page = parse_page(request.args)
+    except ValueError:
+        return jsonify({'error': 'Invalid page arguments'}), 400
+
+    connection = db.engine.connect()
+    chunks = analysis_chunks(connection, query, params, page)
+
+    try:
+        first = next(chunks, None)
+    except Exception:
+        connection.close()
+        raise
+
+    if first is None and page.after == BEFORE_FIRST:
+        connection.close()
         return jsonify({'error': 'No records with search term'}), 404
-    else:
-        output_dict = df.to_dict(orient='records')
-        return jsonify(output_dict)
+
+    chunks = itertools.chain([first] if first is not None else [], chunks)
+
+    if page.stream:
+        response = app.response_class(stream_with_context(stream_analyses(chunks, page)), mimetype='application/json')
+        response.call_on_close(connection.close)
+        return response
+
+    with connection:
+        chunks = list(chunks)
+
+    records = [record for chunk, _ in chunks for record in chunk]
+    if page.limit is None:
+        return jsonify(records)
+    return jsonify({'items': records, 'next': next_cursor(page, len(records), chunks[-1][1] if chunks else None)})
+
+@app.route('/topic/<string:topic_name>', methods=['GET'])
+@cached_response
+def get_topic_by_name(topic_name):
+    return analysis_list(API_QUERIES['topic'], {'topic_name': topic_name})
 
 @app.route('/person/<string:person_name>', methods=['GET'])
+@cached_response
 def get_person_by_name(person_name):
-    query = text('SELECT * FROM analyzed_rss WHERE individuals LIKE :person_name')
+    match = person_match(person_name)
+    if match is None:
+        return jsonify({'error': 'No records with search term'}), 404
+
+    return analysis_list(API_QUERIES['person'], {'match': match})
+
+@app.route('/search', methods=['GET'])
+@cached_response
+def search_analyses():
+    """
+    Analyses whose individuals, topic, article title or summary contain every word of q, each word
+    matched as a prefix, best bm25 match first. limit caps the results (default 20, at most 100).
+    """
+    match = search_match(request.args.get('q', ''))
+    if match is None:
+        return jsonify({'error': 'Missing search term'}), 400
+
+    query = text(API_QUERIES['search'])
 
     with db.engine.connect() as connection:
-        result = connection.execute(query, {'person_name': f'%{person_name}%'})
-        df = pd.DataFrame(result.fetchall(), columns=result.keys())
+        result = connection.execute(query, {'match': match, 'limit': search_limit(request.args.get('limit'))})
+        df = pd.DataFrame(result.fetchall(), columns=result.keys(), dtype=object)
 
     if df.empty:
         return jsonify({'error': 'No records with search term'}), 404
     else:
-        output_dict = df.to_dict(orient='records')
+        output_dict = records_for_json(add_coverage(df))
         return jsonify(output_dict)
 
 @app.route('/posting/<string:hashed_title>', methods=['GET'])
+@cached_response
 def get_posting_by_id(hashed_title):
-    posting_counter.inc()
-    query = text('''
-        SELECT * FROM news_rss
-        JOIN analyzed_rss ON news_rss.hashed_title = analyzed_rss.hashed_title
-        WHERE news_rss.hashed_title = :hashed_title
-    ''')
+    column, params = posting_filter(hashed_title)
+    query = text(API_QUERIES[f'posting_by_{column}'])
 
     with db.engine.connect() as connection:
-        result = connection.execute(query, {'hashed_title': hashed_title})
-        df = pd.DataFrame(result.fetchall(), columns=result.keys())
+        result = connection.execute(query, params)
+        df = pd.DataFrame(result.fetchall(), columns=result.keys(), dtype=object)
 
     if df.empty:
         return jsonify({'error': 'No records with search term'}), 404
     else:
-        output_dict = df.to_dict(orient='records')
+        output_dict = records_for_json(add_coverage(df))
         return jsonify(output_dict)
 
 @app.route('/raw_posting/<string:hashed_title>', methods=['GET'])
+@cached_response
 def get_raw_posting_by_id(hashed_title):
-    query = text('SELECT * FROM news_rss WHERE hashed_title = :hashed_title')
+    column, params = posting_filter(hashed_title)
+    query = text(API_QUERIES[f'raw_posting_by_{column}'])
 
     with db.engine.connect() as connection:
-        result = connection.execute(query, {'hashed_title': hashed_title})
-        df = pd.DataFrame(result.fetchall(), columns=result.keys())
+        result = connection.execute(query, params)
+        df = pd.DataFrame(result.fetchall(), columns=result.keys(), dtype=object)
 
     if df.empty:
         return jsonify({'error': 'No records with search term'}), 404
     else:
-        output_dict = df.to_dict(orient='records')
+        output_dict = records_for_json(df)
         return jsonify(output_dict)
 
 @app.route('/counts', methods=['GET'])
+@cached_response
 def counts():
-    query1 = text('SELECT Individuals, COUNT(*) AS value_count FROM analyzed_rss GROUP BY Individuals ORDER BY value_count DESC;')
-    query2 = text('SELECT Topic, COUNT(*) AS value_count FROM analyzed_rss GROUP BY Topic ORDER BY value_count DESC;')
+    """
+    Number of analyses per individual, topic, outlet and sentiment, read from the rollups kept by
+    rollups.py. Each lists its top_n most common values (default 10, at most 100) and the rest
+    under 'Other'.
+    """
+    top_n = parse_top_n(request.args.get('top_n'))
 
     with db.engine.connect() as connection:
-        result = connection.execute(query1)
-        df1 = pd.DataFrame(result.fetchall(), columns=result.keys())
-
-        result = connection.execute(query2)
-        df2 = pd.DataFrame(result.fetchall(), columns=result.keys())
+        output_dict = {key: top_counts(connection, dimension, top_n) for key, dimension in COUNT_DIMENSIONS.items()}
 
-    if df1.empty or df2.empty:
+    if not output_dict['Individuals'] or not output_dict['Topics']:
         return jsonify({'error': 'No records with search term'}), 404
     else:
-        output_dict = {}
-        output_dict['Individuals'] = df1.set_index('individuals')['value_count'].to_dict()
-        output_dict['Topics'] = df2.set_index('topic')['value_count'].to_dict()
         return jsonify(output_dict)
 
+@app.cli.command('compact-tables')
+def compact_tables():
+    """
+    Removes duplicate articles left by earlier append-only refreshes and builds the unique indexes.
+    Migrations and writes do the same on their own; run it to do it ahead of time with:
+    flask --app production.backend.main compact-tables
+    """
+    for table_name, removed in upgrade_article_keys(db.engine).items():
+        print(f'{table_name}: removed {removed} duplicate rows')
+
+@app.cli.command('migrate-db')
+def migrate_db():
+    """
+    Moves the database onto the current schema, see migrations.py.
+    Run on every deploy with: flask --app production.backend.main migrate-db
+    """
+    applied = migrate(db.engine)
+    print(f'Schema version {schema_version(db.engine)}, applied {applied or "nothing"}')
+
+@app.cli.command('evaluate-cascade')
+def evaluate_cascade():
+    """
+    Reports how often the local analyzer would answer instead of the LLM at several confidence
+    thresholds, and how often it would agree with the LLM's labels.
+    Run with: flask --app production.backend.main evaluate-cascade
+    """
+    df = llm_labels(db.engine)
+    print(f'{len(df)} LLM-analyzed articles')
+
+    for row in evaluate(df):
+        print(', '.join(f'{k}: {v:.3f}' if isinstance(v, float) else f'{k}: {v}' for k, v in row.items()))
+
+def batch_service():
+    """
+    The batch service named by LLM_BATCH_SERVICE: openai, or local for the file-based stand-in
+    that answers jobs with the configured backend.
+    """
+    if BATCH_SERVICE == 'openai':
+        return OpenAIBatchService(OpenAI())
+    if BATCH_SERVICE == 'local':
+        return LocalBatchService(os.path.join(BATCH_DIRECTORY, 'local_service'))
+    raise ValueError(f"Unknown LLM_BATCH_SERVICE '{BATCH_SERVICE}'.")
+
+@app.cli.command('analyze-batch')
+@click.option('--limit', default=DEFAULT_MAX_REQUESTS, help='Maximum articles in the job.')
+@click.option('--reanalyze', is_flag=True, help='Re-analyze every article, e.g. after a prompt change.')
+@click.option('--timeout', type=float, default=None, help='Seconds to wait for the job; a later run collects it.')
+def analyze_batch_job(limit, reanalyze, timeout):
+    """
+    Analyzes the backlog as one offline batch job and bulk-loads the results, or collects the job
+    an earlier run left unfinished.
+    Run with: flask --app production.backend.main analyze-batch [--reanalyze]
+    """
+    run_batch_job(
+        db.engine,
+        batch_service(),
+        BATCH_DIRECTORY,
+        model = get_backend().model,
+        limit = limit,
+        reanalyze = reanalyze,
+        poll_interval = BATCH_POLL_INTERVAL,
+        timeout = timeout,
+    )
+
 @app.route('/dashboard')
 def dashboard():
     return build_dashboard()
@@ -198,4 +658,6 @@ app.config.update(
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        migrate(db.engine)
+        migrated = True
     app.run()
@@ -0,0 +1,190 @@
+"""
+Copyright @emontj 2024
+
+Versioned, in-place migrations of the database. The versions applied are recorded in the
+schema_version table, and migrate applies the rest in order. Workers starting together take turns
+on the schema_migration lease, so each migration runs once; every migration also checks what is
+already there, so one interrupted part way is finished by the next run.
+"""
+
+import time
+import uuid
+
+from sqlalchemy import exc, inspect, text
+from sqlalchemy.schema import CreateTable
+
+from production.backend.collector import batched, quote_identifier, schema_transaction, upgrade_article_keys
+from production.backend.response_cache import create_generation_counter
+from production.backend.rollups import create_rollups
+from production.backend.scheduler import LeaseLock, process_identity
+from production.backend.schema import metadata
+from production.backend.search import create_search_index
+from production.backend.watermarks import parse_published
+
+DECLARED_TABLES = ('news_rss', 'analyzed_rss')
+BACKFILL_BATCH = 1000
+# Longest a single migration may run before a waiting process takes the lease over
+MIGRATION_LEASE_TTL = 600
+MIGRATION_POLL_INTERVAL = 0.1
+
+def column_types(connection, table_name):
+    """
+    Returns:
+        dict: Declared type of every column of the table, upper-cased, in column order.
+    """
+    return {row[1]: (row[2] or '').upper() for row in connection.exec_driver_sql(f'PRAGMA table_info({quote_identifier(table_name)})')}
+
+def declared_types(table):
+    return {column.name: column.type.compile(dialect=None).upper() for column in table.columns}
+
+def rebuild_table(connection, table):
+    """
+    Moves a table onto its declaration: creates it if missing, otherwise copies it into a table
+    with the declared columns, types and indexes unless it already has them. The pandas index column
+    is dropped and columns missing from the declaration are kept as they are. Every row is copied:
+    one breaking the declared constraints raises IntegrityError and rolls the rebuild back, as
+    repeated article keys were already removed, and counted, by upgrade_article_keys.
+    """
+    existing = column_types(connection, table.name)
+
+    if existing and all(existing.get(name) == declared for name, declared in declared_types(table).items()) and 'index' not in existing:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+        return
+
+    if not existing:
+        table.create(connection)
+        return
+
+    old_name = f'{table.name}__old'
+    connection.exec_driver_sql(f'ALTER TABLE {quote_identifier(table.name)} RENAME TO {quote_identifier(old_name)}')
+    for (index_name,) in connection.exec_driver_sql(f"SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = '{old_name}' AND sql IS NOT NULL").fetchall():
+        connection.exec_driver_sql(f'DROP INDEX {quote_identifier(index_name)}')
+
+    connection.execute(CreateTable(table))
+    for name, column_type in existing.items():
+        if name not in table.columns and name != 'index':
+            connection.exec_driver_sql(f'ALTER TABLE {quote_identifier(table.name)} ADD COLUMN {quote_identifier(name)} {column_type}')
+
+    columns = ', '.join(quote_identifier(name) for name in existing if name != 'index')
+    connection.exec_driver_sql(f'INSERT INTO {quote_identifier(table.name)} ({columns}) SELECT {columns} FROM {quote_identifier(old_name)} ORDER BY rowid')
+    connection.exec_driver_sql(f'DROP TABLE {quote_identifier(old_name)}')
+
+    for index in table.indexes:
+        index.create(connection)
+
+def backfill_published_ts(connection):
+    """
+    Parses published into published_ts for rows collected before it was stored.
+
+    Returns:
+        int: Number of rows given a timestamp.
+    """
+    rows = connection.execute(text('SELECT rowid, published FROM news_rss WHERE published_ts IS NULL AND published IS NOT NULL')).fetchall()
+    updates = [{'row_id': row_id, 'published_ts': parse_published(published)} for row_id, published in rows]
+    updates = [update for update in updates if update['published_ts'] is not None]
+
+    for batch in batched(updates, BACKFILL_BATCH):
+        connection.execute(text('UPDATE news_rss SET published_ts = :published_ts WHERE rowid = :row_id'), batch)
+
+    return len(updates)
+
+def declare_tables(engine):
+    with schema_transaction(engine) as connection:
+        for table_name in DECLARED_TABLES:
+            rebuild_table(connection, metadata.tables[table_name])
+        backfill_published_ts(connection)
+
+MIGRATIONS = [
+    (1, 'article keys', upgrade_article_keys),
+    (2, 'declared news_rss and analyzed_rss tables', declare_tables),
+    (3, 'full-text search of analyses', create_search_index),
+    (4, 'analysis count rollups', create_rollups),
+    (5, 'dataset generation counter', create_generation_counter),
+]
+
+def schema_version(engine):
+    """
+    Returns:
+        int: The highest migration version applied, 0 for a database never migrated.
+    """
+    if not inspect(engine).has_table('schema_version'):
+        return 0
+    with engine.connect() as connection:
+        return connection.execute(text('SELECT coalesce(max(version), 0) FROM schema_version')).scalar()
+
+def acquire_migration_lease(engine, ttl):
+    """
+    Waits for the schema_migration lease. A worker busy migrating can hold the database's write lock
+    for longer than SQLite's busy timeout, so a locked database is waited out like a held lease.
+
+    Returns:
+        LeaseLock: The lease, held by this process.
+
+    Raises:
+        TimeoutError: If the lease is not free within ttl seconds.
+    """
+    deadline = time.time() + ttl
+
+    while True:
+        try:
+            lease = LeaseLock(engine, 'schema_migration', holder=f'{process_identity()}:{uuid.uuid4().hex}', ttl=ttl)
+            if lease.acquire():
+                return lease
+        except exc.OperationalError as error:
+            if 'locked' not in str(error):
+                raise
+
+        if time.time() > deadline:
+            raise TimeoutError(f'Timed out waiting for the schema_migration lease after {ttl} s')
+        time.sleep(MIGRATION_POLL_INTERVAL)
+
+def migrate(engine, migrations=MIGRATIONS, lease_ttl=MIGRATION_LEASE_TTL):
+    """
+    Applies the migrations newer than the database's schema version, in order. Only the process
+    holding the schema_migration lease migrates; the others wait for it, then read the version again
+    and find nothing left to apply.
+
+    Returns:
+        list: Versions applied.
+    """
+    migrations = sorted(migrations, key=lambda item: item[0])
+    if not migrations or migrations[-1][0] <= schema_version(engine):
+        return []
+
+    lease = acquire_migration_lease(engine, lease_ttl)
+    applied = []
+
+    try:
+        with engine.begin() as connection:
+            connection.execute(text('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at REAL NOT NULL
+                )
+            '''))
+
+        current = schema_version(engine)
+
+        for version, name, migration in migrations:
+            if version <= current:
+                continue
+
+            # Renewed before each migration, so only one that outlives the TTL lets a waiting process in
+            if not lease.acquire():
+                raise RuntimeError(f'Lost the schema_migration lease before migration {version}')
+
+            start = time.perf_counter()
+            migration(engine)
+            with engine.begin() as connection:
+                connection.execute(
+                    text('INSERT OR IGNORE INTO schema_version (version, name, applied_at) VALUES (:version, :name, :now)'),
+                    {'version': version, 'name': name, 'now': time.time()},
+                )
+            print(f'Applied migration {version} ({name}) in {time.perf_counter() - start:.2f} s')
+            applied.append(version)
+    finally:
+        lease.release()
+
+    return applied
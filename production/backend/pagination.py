@@ -0,0 +1,59 @@
+"""
+Copyright @emontj 2024
+
+Keyset pagination of the list endpoints. Rows are returned in analyzed_rss rowid order, and a page's
+cursor is the rowid of its last row, so the next page is a range scan from it rather than an OFFSET
+that rereads every earlier page.
+"""
+
+from collections import namedtuple
+
+from production.backend.collector import hex_to_key, key_to_hex
+
+MAX_PAGE_SIZE = 1000
+# Rows read from the database cursor and converted at a time when streaming
+STREAM_CHUNK_ROWS = 1000
+# Cursor of a first page, before every rowid
+BEFORE_FIRST = -2**63
+
+Page = namedtuple('Page', ['after', 'limit', 'stream'])
+
+def encode_cursor(row_id):
+    """
+    Opaque cursor of a row, its rowid in the 16-character hex form used for article keys.
+    """
+    return key_to_hex(row_id)
+
+def decode_cursor(cursor):
+    if len(cursor) != 16:
+        raise ValueError(f'Invalid cursor: {cursor}')
+    return hex_to_key(cursor)
+
+def parse_page(args):
+    """
+    Page requested by a list endpoint's arguments: after, the cursor of the last row already seen;
+    limit, the page size, at most MAX_PAGE_SIZE; and stream=1 to stream rows as they are read.
+    Without limit every row after the cursor is returned.
+
+    Returns:
+        Page: after as a rowid, BEFORE_FIRST for the first page; limit, None if not paginated; stream.
+
+    Raises:
+        ValueError: If after is not a cursor or limit not a number.
+    """
+    after = args.get('after')
+    limit = args.get('limit')
+
+    return Page(
+        after=decode_cursor(after) if after else BEFORE_FIRST,
+        limit=max(1, min(int(limit), MAX_PAGE_SIZE)) if limit else None,
+        stream=args.get('stream') == '1',
+    )
+
+def next_cursor(page, rows, last_row_id):
+    """
+    Cursor of the page after one of rows rows ending at last_row_id, None if it was the last page.
+    """
+    if page.limit is None or rows < page.limit:
+        return None
+    return encode_cursor(last_row_id)
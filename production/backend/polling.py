@@ -0,0 +1,186 @@
+"""
+Copyright @emontj 2024
+"""
+
+import time
+
+from sqlalchemy import inspect, text
+
+MIN_INTERVAL = 300
+MAX_INTERVAL = 6 * 3600
+DEFAULT_INTERVAL = 3600
+RATE_WINDOW = 7 * 86400
+EXPECTED_NEW_ENTRIES = 1
+UNCHANGED_BACKOFF = 1.5
+ERROR_BACKOFF = 2
+
+def publish_rates(engine, window=RATE_WINDOW, now=None):
+    """
+    Estimates how often each feed publishes from the published_ts of its stored articles.
+
+    Args:
+        engine (sqlalchemy.Engine): Engine holding the news_rss table.
+        window (float): Only articles published in the last window seconds are counted.
+
+    Returns:
+        dict: (outlet, category) to entries per second. Feeds with fewer than two dated
+              articles in the window are left out.
+    """
+    now = time.time() if now is None else now
+    columns = {col['name'] for col in inspect(engine).get_columns('news_rss')} if inspect(engine).has_table('news_rss') else set()
+
+    if not {'category', 'published_ts'} <= columns:
+        return {}
+
+    query = text('''
+        SELECT outlet, category, COUNT(*) AS entries, MIN(published_ts) AS first, MAX(published_ts) AS last
+        FROM news_rss
+        WHERE category IS NOT NULL AND published_ts >= :since AND published_ts <= :now
+        GROUP BY outlet, category
+    ''')
+
+    with engine.connect() as connection:
+        rows = connection.execute(query, {'since': now - window, 'now': now}).mappings().all()
+
+    return {
+        (row['outlet'], row['category']): (row['entries'] - 1) / (row['last'] - row['first'])
+        for row in rows
+        if row['entries'] > 1 and row['last'] > row['first']
+    }
+
+def feed_outcome(feed):
+    """
+    Classifies a fetched feed as 'error', 'unchanged' (not modified, or nothing past its watermark) or 'new'.
+    """
+    fetch = feed.get('fetch', {})
+
+    if fetch.get('error'):
+        return 'error'
+    if fetch.get('cache') == 'hit' or not feed['entries']:
+        return 'unchanged'
+    return 'new'
+
+class PollingPlanner:
+    """
+    Schedules every (outlet, category) link on its own interval, kept in the feed_poll_state table.
+
+    A feed's base interval is the time it takes to publish EXPECTED_NEW_ENTRIES at its observed rate,
+    bounded by min_interval and max_interval. Consecutive unchanged responses stretch it by
+    UNCHANGED_BACKOFF and consecutive errors by ERROR_BACKOFF, up to max_interval; new entries reset it.
+    """
+
+    def __init__(self, engine, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, default_interval=DEFAULT_INTERVAL):
+        self.engine = engine
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                CREATE TABLE IF NOT EXISTS feed_poll_state (
+                    link TEXT PRIMARY KEY,
+                    outlet TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    interval REAL NOT NULL,
+                    next_poll_at REAL NOT NULL,
+                    last_polled_at REAL,
+                    failures INTEGER NOT NULL DEFAULT 0,
+                    unchanged INTEGER NOT NULL DEFAULT 0,
+                    last_result TEXT
+                )
+            '''))
+
+    def load(self):
+        """
+        Returns:
+            dict: link to its stored poll state.
+        """
+        with self.engine.connect() as connection:
+            return {row['link']: dict(row) for row in connection.execute(text('SELECT * FROM feed_poll_state')).mappings()}
+
+    def due_sources(self, news_sources, now=None):
+        """
+        Narrows news_sources to the links due for a poll. Links never polled are always due.
+
+        Returns:
+            dict: news_sources with only the due links, and without outlets that have none.
+        """
+        now = time.time() if now is None else now
+        state = self.load()
+        due = {}
+
+        for outlet, source in news_sources.items():
+            links = {
+                category: link
+                for category, link in source['links'].items()
+                if link not in state or state[link]['next_poll_at'] <= now
+            }
+            if links:
+                due[outlet] = dict(source, links=links)
+
+        return due
+
+    def base_interval(self, rate):
+        if not rate:
+            return self.default_interval
+        return min(max(EXPECTED_NEW_ENTRIES / rate, self.min_interval), self.max_interval)
+
+    def record(self, feeds_by_outlet, news_sources, now=None):
+        """
+        Updates the poll state of every fetched link. Call once the new entries are stored, so the
+        publish rates include them, and after watermarks have dropped the entries seen before.
+
+        Args:
+            feeds_by_outlet (dict): Outlet name to feeds, as returned by fetcher.fetch_all_feeds.
+            news_sources (dict): The sources that were fetched.
+
+        Returns:
+            dict: link to its new interval in seconds.
+        """
+        now = time.time() if now is None else now
+        state = self.load()
+        rates = publish_rates(self.engine, now=now)
+        rows = []
+
+        for outlet, feed in feeds_by_outlet.items():
+            for category, v in feed.items():
+                if category == 'outlet':
+                    continue
+
+                link = news_sources[outlet]['links'][category]
+                previous = state.get(link, {'failures': 0, 'unchanged': 0})
+                outcome = feed_outcome(v)
+                failures = previous['failures'] + 1 if outcome == 'error' else 0
+                unchanged = previous['unchanged'] + 1 if outcome == 'unchanged' else 0
+                interval = self.base_interval(rates.get((outlet, category)))
+                interval = min(interval * ERROR_BACKOFF ** failures * UNCHANGED_BACKOFF ** unchanged, self.max_interval)
+
+                rows.append({
+                    'link': link,
+                    'outlet': outlet,
+                    'category': category,
+                    'interval': interval,
+                    'next_poll_at': now + interval,
+                    'last_polled_at': now,
+                    'failures': failures,
+                    'unchanged': unchanged,
+                    'last_result': outcome,
+                })
+
+        if rows:
+            with self.engine.begin() as connection:
+                connection.execute(text('''
+                    INSERT INTO feed_poll_state (link, outlet, category, interval, next_poll_at, last_polled_at, failures, unchanged, last_result)
+                    VALUES (:link, :outlet, :category, :interval, :next_poll_at, :last_polled_at, :failures, :unchanged, :last_result)
+                    ON CONFLICT(link) DO UPDATE SET
+                        outlet = excluded.outlet,
+                        category = excluded.category,
+                        interval = excluded.interval,
+                        next_poll_at = excluded.next_poll_at,
+                        last_polled_at = excluded.last_polled_at,
+                        failures = excluded.failures,
+                        unchanged = excluded.unchanged,
+                        last_result = excluded.last_result
+                '''), rows)
+
+        return {row['link']: row['interval'] for row in rows}
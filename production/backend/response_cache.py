@@ -0,0 +1,229 @@
+"""
+Copyright @emontj 2024
+
+Cache of read endpoint responses. Entries are keyed by route, arguments and the dataset generation,
+a counter that triggers bump on every write to news_rss or analyzed_rss, so a response is reused
+until a collection or analysis run commits and is never served stale after. Responses are kept in an
+in-process LRU and, optionally, in a SQLite file shared by every worker on the host.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import create_engine, text
+
+from production.backend.collector import KEY_SEPARATOR
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 64 * 2**20
+DEFAULT_SHARED_MAX_ENTRIES = 10_000
+# Shared entries beyond max_entries are trimmed after this many stores
+SHARED_TRIM_INTERVAL = 100
+CACHED_STATUSES = (200, 404)
+response_listeners = []
+
+CachedResponse = namedtuple('CachedResponse', ['status', 'body', 'mimetype', 'etag'])
+
+GENERATION_DDL = [
+    '''
+    CREATE TABLE IF NOT EXISTS dataset_generation (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        generation INTEGER NOT NULL
+    )
+    ''',
+    'INSERT OR IGNORE INTO dataset_generation (id, generation) VALUES (1, 0)',
+    *[
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_generation_{event.lower()} AFTER {event} ON {table} BEGIN
+            UPDATE dataset_generation SET generation = generation + 1 WHERE id = 1;
+        END
+        '''
+        for table in ('news_rss', 'analyzed_rss')
+        for event in ('INSERT', 'UPDATE', 'DELETE')
+    ],
+]
+
+def create_generation_counter(engine):
+    """
+    Creates the dataset_generation counter and the triggers bumping it.
+    """
+    with engine.begin() as connection:
+        for statement in GENERATION_DDL:
+            connection.execute(text(statement))
+
+def dataset_generation(connection):
+    """
+    Returns:
+        int: The current dataset generation.
+    """
+    return connection.execute(text('SELECT generation FROM dataset_generation WHERE id = 1')).scalar()
+
+def response_key(path, args, generation):
+    """
+    Hex blake2b over a request's path, its query arguments in sorted order and the dataset generation.
+    """
+    key_text = KEY_SEPARATOR.join([path, str(generation), *(f'{name}={value}' for name, value in sorted(args.items(multi=True)))])
+    return hashlib.blake2b(key_text.encode(), digest_size=16).hexdigest()
+
+def strong_etag(body):
+    """
+    ETag value of a response body: identical bodies, and only identical bodies, share it.
+    """
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+class SharedResponseStore:
+    """
+    Responses kept in the response_cache table of a SQLite file that every worker opens. Entries
+    of older generations are dropped as soon as one of a newer generation is stored, and the oldest
+    beyond max_entries every SHARED_TRIM_INTERVAL stores.
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_SHARED_MAX_ENTRIES):
+        self.engine = create_engine(f'sqlite:///{path}', connect_args={'timeout': 5})
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.generation = None
+        self.stores = 0
+
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql('PRAGMA journal_mode=WAL')
+            connection.execute(text('''
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    generation INTEGER NOT NULL,
+                    status INTEGER NOT NULL,
+                    body BLOB NOT NULL,
+                    mimetype TEXT NOT NULL,
+                    etag TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            '''))
+            connection.execute(text('CREATE INDEX IF NOT EXISTS ix_response_cache_generation ON response_cache (generation)'))
+            connection.execute(text('CREATE INDEX IF NOT EXISTS ix_response_cache_created_at ON response_cache (created_at)'))
+
+    def get(self, key):
+        with self.engine.connect() as connection:
+            row = connection.execute(text('SELECT status, body, mimetype, etag FROM response_cache WHERE cache_key = :key'), {'key': key}).fetchone()
+        return CachedResponse(row[0], bytes(row[1]), row[2], row[3]) if row is not None else None
+
+    def put(self, key, generation, response):
+        with self.lock:
+            new_generation = self.generation is None or generation > self.generation
+            self.generation = generation if new_generation else self.generation
+            self.stores += 1
+            trim = self.stores % SHARED_TRIM_INTERVAL == 0
+
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                INSERT INTO response_cache (cache_key, generation, status, body, mimetype, etag, created_at)
+                VALUES (:key, :generation, :status, :body, :mimetype, :etag, :now)
+                ON CONFLICT(cache_key) DO NOTHING
+            '''), {'key': key, 'generation': generation, 'now': time.time(), **response._asdict()})
+
+            if new_generation:
+                connection.execute(text('DELETE FROM response_cache WHERE generation < :generation'), {'generation': generation})
+            if trim:
+                connection.execute(text('''
+                    DELETE FROM response_cache WHERE cache_key NOT IN (
+                        SELECT cache_key FROM response_cache ORDER BY created_at DESC LIMIT :max_entries
+                    )
+                '''), {'max_entries': self.max_entries})
+
+class ResponseCache:
+    """
+    In-process LRU of responses, holding at most max_entries and max_bytes of bodies, in front of
+    an optional SharedResponseStore. Entries of older generations are dropped once a newer one is
+    seen. The functions in response_listeners are called with 'memory', 'shared' or 'miss' for
+    every lookup, e.g. to export metrics.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, shared=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generation = None
+        self.lock = threading.Lock()
+        self.totals = {'memory': 0, 'shared': 0, 'miss': 0}
+
+    def record(self, result):
+        with self.lock:
+            self.totals[result] += 1
+
+        for listener in response_listeners:
+            listener(result)
+
+    def advance(self, generation):
+        # Called with the lock held
+        if self.generation is None or generation > self.generation:
+            self.entries.clear()
+            self.size = 0
+            self.generation = generation
+
+    def remember(self, key, generation, response):
+        with self.lock:
+            self.advance(generation)
+            if generation < self.generation or len(response.body) > self.max_bytes:
+                return
+
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key).body)
+            self.entries[key] = response
+            self.size += len(response.body)
+
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted.body)
+
+    def get(self, key, generation):
+        """
+        Returns:
+            CachedResponse: The response stored under key, or None on a miss.
+        """
+        with self.lock:
+            self.advance(generation)
+            response = self.entries.get(key)
+            if response is not None:
+                self.entries.move_to_end(key)
+
+        if response is not None:
+            self.record('memory')
+            return response
+
+        response = self.shared.get(key) if self.shared is not None else None
+        if response is not None:
+            self.remember(key, generation, response)
+            self.record('shared')
+            return response
+
+        self.record('miss')
+        return None
+
+    def put(self, key, generation, status, body, mimetype):
+        """
+        Stores a response body under key.
+
+        Returns:
+            CachedResponse: The stored response, with its ETag.
+        """
+        response = CachedResponse(status, body, mimetype, strong_etag(body))
+        self.remember(key, generation, response)
+        if self.shared is not None:
+            self.shared.put(key, generation, response)
+        return response
+
+    def stats(self):
+        """
+        Returns:
+            dict: Lookups answered from memory, from the shared store and missed, the hit ratio,
+                  and the entries and bytes held in memory.
+        """
+        with self.lock:
+            stats = dict(self.totals, entries=len(self.entries), bytes=self.size, generation=self.generation)
+
+        lookups = stats['memory'] + stats['shared'] + stats['miss']
+        stats['hit_ratio'] = (stats['memory'] + stats['shared']) / lookups if lookups else None
+        return stats
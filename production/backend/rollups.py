@@ -0,0 +1,130 @@
+"""
+Copyright @emontj 2024
+
+Rollups of analyzed_rss: the number of analyses per individual, topic, sentiment and outlet in
+analysis_counts, and per dimension in analysis_count_totals. Triggers on analyzed_rss keep them up
+to date in the transaction that changes the analyses, so /counts reads top_n rows instead of
+grouping the whole table.
+"""
+
+from sqlalchemy import text
+
+from production.backend.schema import API_QUERIES
+
+DEFAULT_TOP_N = 10
+MAX_TOP_N = 100
+OTHER_LABEL = 'Other'
+
+# Dimension name to the value an analyzed_rss row (new or old in a trigger) counts under
+ROLLUP_DIMENSIONS = {
+    'individuals': '{row}.individuals',
+    'topic': '{row}.topic',
+    'sentiment': '{row}.sentiment',
+    'outlet': '(SELECT news_rss.outlet FROM news_rss WHERE news_rss.article_key = {row}.article_key)',
+}
+
+ROLLUP_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS analysis_counts (
+        dimension TEXT NOT NULL,
+        value TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (dimension, value)
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS ix_analysis_counts_rank ON analysis_counts (dimension, count DESC, value)',
+    '''
+    CREATE TABLE IF NOT EXISTS analysis_count_totals (
+        dimension TEXT PRIMARY KEY,
+        count INTEGER NOT NULL
+    )
+    ''',
+]
+
+def count_statements(row, change):
+    """
+    Trigger statements adding change to the counts of a new or old analyzed_rss row. Rows with
+    no value for a dimension are not counted in it.
+    """
+    statements = []
+
+    for dimension, value in ROLLUP_DIMENSIONS.items():
+        value = value.format(row=row)
+        statements.append(f'''
+            INSERT INTO analysis_counts (dimension, value, count) SELECT '{dimension}', value, {change}
+            FROM (SELECT {value} AS value) WHERE value IS NOT NULL
+            ON CONFLICT (dimension, value) DO UPDATE SET count = count + excluded.count;
+            INSERT INTO analysis_count_totals (dimension, count) SELECT '{dimension}', {change}
+            WHERE {value} IS NOT NULL
+            ON CONFLICT (dimension) DO UPDATE SET count = count + excluded.count;
+        ''')
+        if change < 0:
+            statements.append(f"DELETE FROM analysis_counts WHERE dimension = '{dimension}' AND value = {value} AND count <= 0;")
+
+    return '\n'.join(statements)
+
+def rollup_triggers():
+    """
+    Triggers keeping the rollups in step with analyzed_rss. An analysis counts under the outlet its
+    article had when the analysis was stored.
+    """
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS analysis_counts_insert AFTER INSERT ON analyzed_rss BEGIN {count_statements("new", 1)} END',
+        f'CREATE TRIGGER IF NOT EXISTS analysis_counts_delete AFTER DELETE ON analyzed_rss BEGIN {count_statements("old", -1)} END',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS analysis_counts_update AFTER UPDATE OF individuals, topic, sentiment, article_key ON analyzed_rss BEGIN
+            {count_statements("old", -1)}
+            {count_statements("new", 1)}
+        END
+        ''',
+    ]
+
+def create_rollups(engine):
+    """
+    Creates the rollup tables and their triggers, and counts the analyses stored before them.
+    """
+    with engine.begin() as connection:
+        for statement in ROLLUP_TABLES + rollup_triggers():
+            connection.execute(text(statement))
+
+        connection.execute(text('DELETE FROM analysis_counts'))
+        connection.execute(text('DELETE FROM analysis_count_totals'))
+
+        for dimension, value in ROLLUP_DIMENSIONS.items():
+            value = value.format(row='analyzed_rss')
+            connection.execute(text(f'''
+                INSERT INTO analysis_counts (dimension, value, count)
+                SELECT '{dimension}', value, COUNT(*) FROM (SELECT {value} AS value FROM analyzed_rss)
+                WHERE value IS NOT NULL GROUP BY value
+            '''))
+            connection.execute(text(f'''
+                INSERT INTO analysis_count_totals (dimension, count)
+                SELECT '{dimension}', coalesce(SUM(count), 0) FROM analysis_counts WHERE dimension = '{dimension}'
+            '''))
+
+def top_counts(connection, dimension, top_n=DEFAULT_TOP_N):
+    """
+    Reads the top_n values of a dimension from the rollups, the rest summed under OTHER_LABEL.
+
+    Returns:
+        dict: Count per value, most common first, OTHER_LABEL last if any analyses are left over.
+    """
+    rows = connection.execute(text(API_QUERIES['counts_top']), {'dimension': dimension, 'top_n': top_n}).fetchall()
+    total = connection.execute(text(API_QUERIES['counts_total']), {'dimension': dimension}).scalar() or 0
+
+    counts = dict(rows)
+    other = total - sum(counts.values())
+    if other > 0:
+        counts[OTHER_LABEL] = other
+
+    return counts
+
+def parse_top_n(value):
+    """
+    top_n from a request argument, DEFAULT_TOP_N if missing or invalid, at most MAX_TOP_N.
+    """
+    try:
+        top_n = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_TOP_N
+    return max(1, min(top_n, MAX_TOP_N))
@@ -0,0 +1,262 @@
+"""
+Copyright @emontj 2024
+"""
+
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+from sqlalchemy import text
+
+DEFAULT_INTERVAL = 3600
+DEFAULT_LEASE_TTL = 900
+DEFAULT_TICK = 30
+
+def process_identity():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+class LeaseLock:
+    """
+    Database-backed lease held by at most one process at a time across every worker sharing the database.
+    A lease expires ttl seconds after it was last acquired or renewed, so a crashed holder is replaced.
+    """
+
+    def __init__(self, engine, name, holder=None, ttl=DEFAULT_LEASE_TTL):
+        self.engine = engine
+        self.name = name
+        self.holder = holder or process_identity()
+        self.ttl = ttl
+
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                CREATE TABLE IF NOT EXISTS scheduler_leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    acquired_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            '''))
+
+    def acquire(self):
+        """
+        Takes the lease if it is free or expired, or renews it if this holder already has it.
+
+        Returns:
+            bool: True if this holder has the lease.
+        """
+        now = time.time()
+
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                INSERT INTO scheduler_leases (name, holder, acquired_at, expires_at)
+                VALUES (:name, :holder, :now, :expires_at)
+                ON CONFLICT(name) DO UPDATE SET
+                    holder = excluded.holder,
+                    acquired_at = CASE WHEN scheduler_leases.holder = excluded.holder THEN scheduler_leases.acquired_at ELSE excluded.acquired_at END,
+                    expires_at = excluded.expires_at
+                WHERE scheduler_leases.holder = excluded.holder OR scheduler_leases.expires_at < :now
+            '''), {'name': self.name, 'holder': self.holder, 'now': now, 'expires_at': now + self.ttl})
+            holder = connection.execute(text('SELECT holder FROM scheduler_leases WHERE name = :name'), {'name': self.name}).scalar()
+
+        return holder == self.holder
+
+    def release(self):
+        with self.engine.begin() as connection:
+            connection.execute(
+                text('UPDATE scheduler_leases SET expires_at = 0 WHERE name = :name AND holder = :holder'),
+                {'name': self.name, 'holder': self.holder},
+            )
+
+    def current(self):
+        """
+        Returns:
+            dict: holder, acquired_at and expires_at of the lease, or None if it was never taken.
+        """
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                text('SELECT holder, acquired_at, expires_at FROM scheduler_leases WHERE name = :name'),
+                {'name': self.name},
+            ).mappings().first()
+
+        return dict(row) if row else None
+
+class FeedScheduler:
+    """
+    Runs collection and analysis every interval seconds from a background thread in each worker.
+    Only the process holding the lease does the work, and run times live in the scheduler_runs table,
+    so every worker agrees on when the next run is due and can report status.
+
+    Args:
+        engine (sqlalchemy.Engine): Database shared by every worker.
+        steps (list): (name, function) pairs run in order; the lease is renewed before each one.
+        interval (float): Seconds between the start of one run and the next.
+        lease_ttl (float): Seconds a lease lasts without renewal. Must exceed the longest step.
+        tick (float): Seconds between checks of whether a run is due.
+        name (str): Lease and status row name.
+    """
+
+    def __init__(self, engine, steps, interval=DEFAULT_INTERVAL, lease_ttl=DEFAULT_LEASE_TTL, tick=DEFAULT_TICK, name='feed_refresh', holder=None):
+        self.engine = engine
+        self.steps = steps
+        self.interval = interval
+        self.tick = tick
+        self.name = name
+        self.lease = LeaseLock(engine, name, holder=holder, ttl=lease_ttl)
+        # The background thread and request threads of this process share the scheduler
+        self.running = threading.Lock()
+        self.held = threading.local()
+        self.stopped = threading.Event()
+        self.thread = None
+
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                CREATE TABLE IF NOT EXISTS scheduler_runs (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT,
+                    last_started_at REAL,
+                    last_finished_at REAL,
+                    last_duration REAL,
+                    last_error TEXT,
+                    next_run_at REAL
+                )
+            '''))
+            connection.execute(
+                text('INSERT INTO scheduler_runs (name, next_run_at) VALUES (:name, 0) ON CONFLICT(name) DO NOTHING'),
+                {'name': self.name},
+            )
+
+    def next_run_at(self):
+        with self.engine.connect() as connection:
+            return connection.execute(text('SELECT next_run_at FROM scheduler_runs WHERE name = :name'), {'name': self.name}).scalar() or 0
+
+    def acquisition(self, task_name):
+        """
+        Lease on this scheduler's name with a holder of its own, so that two threads of one process
+        never renew or release each other's lease.
+        """
+        return LeaseLock(self.engine, self.name, holder=f'{self.lease.holder}:{task_name}:{uuid.uuid4().hex}', ttl=self.lease.ttl)
+
+    def renew(self):
+        """
+        Renews the lease held by the calling thread's run or exclusive task. Long steps call it between
+        units of work so that the lease cannot expire under them.
+
+        Returns:
+            bool: False if the lease was lost, or the thread holds none, and the work should stop.
+        """
+        lease = getattr(self.held, 'lease', None)
+        return lease is not None and lease.acquire()
+
+    def run_pending(self, force=False):
+        """
+        Runs every step if a run is due (or force is set) and this process can take the lease.
+
+        Returns:
+            bool: True if this call ran the steps.
+        """
+        if not self.running.acquire(blocking=False):
+            return False
+
+        try:
+            return self.run_steps(force)
+        finally:
+            self.running.release()
+
+    def run_steps(self, force):
+        if not force and time.time() < self.next_run_at():
+            return False
+        lease = self.acquisition('run')
+        if not lease.acquire():
+            return False
+        if not force and time.time() < self.next_run_at():
+            lease.release()
+            return False  # Another holder finished a run between the check and taking the lease
+
+        started = time.time()
+        error = None
+        self.held.lease = lease
+        self.record(holder=self.lease.holder, last_started_at=started, next_run_at=started + self.interval)
+
+        try:
+            for step_name, step in self.steps:
+                if not lease.acquire():
+                    raise RuntimeError(f'Lost the {self.name} lease before step {step_name}')
+                step()
+        except Exception:
+            error = traceback.format_exc()
+            print(error)
+        finally:
+            finished = time.time()
+            self.record(last_finished_at=finished, last_duration=finished - started, last_error=error)
+            self.held.lease = None
+            lease.release()
+
+        return True
+
+    def run_exclusive(self, task_name, function):
+        """
+        Runs function now, outside the schedule, under this scheduler's lease with a holder of its own,
+        so that it never overlaps a scheduled run or another exclusive task in any worker, this one included.
+        function can call renew to keep the lease while it runs.
+
+        Returns:
+            tuple: (True, what function returned), or (False, None) if the lease is held elsewhere.
+        """
+        lease = self.acquisition(task_name)
+        if not lease.acquire():
+            return False, None
+
+        outer, self.held.lease = getattr(self.held, 'lease', None), lease
+        try:
+            return True, function()
+        finally:
+            self.held.lease = outer
+            lease.release()
+
+    def record(self, **values):
+        assignments = ', '.join(f'{key} = :{key}' for key in values)
+        with self.engine.begin() as connection:
+            connection.execute(text(f'UPDATE scheduler_runs SET {assignments} WHERE name = :name'), dict(values, name=self.name))
+
+    def status(self):
+        """
+        Returns:
+            dict: Last run start, finish, duration and error, next run time, current lease holder
+                  and this process's identity. Times are POSIX timestamps.
+        """
+        with self.engine.connect() as connection:
+            row = connection.execute(text('SELECT * FROM scheduler_runs WHERE name = :name'), {'name': self.name}).mappings().first()
+
+        lease = self.lease.current()
+        status = dict(row)
+        status.update({
+            'interval': self.interval,
+            'running': self.thread is not None and self.thread.is_alive(),
+            'lease_holder': lease['holder'] if lease and lease['expires_at'] > time.time() else None,
+            'lease_expires_at': lease['expires_at'] if lease else None,
+            'this_process': self.lease.holder,
+        })
+
+        return status
+
+    def loop(self):
+        while not self.stopped.is_set():
+            try:
+                self.run_pending()
+            except Exception:
+                print(traceback.format_exc())
+            self.stopped.wait(self.tick)
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.loop, name=f'{self.name}-scheduler', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,91 @@
+"""
+Copyright @emontj 2024
+
+Declared tables of the collected articles and their analyses, with an index behind every lookup
+in API_QUERIES. migrations.py moves databases written before these declarations onto them.
+"""
+
+from sqlalchemy import Column, Index, Integer, MetaData, REAL, Table, Text, func
+
+from production.backend.search import SEARCH_WEIGHTS
+
+metadata = MetaData()
+
+news_rss = Table(
+    'news_rss',
+    metadata,
+    Column('title', Text),
+    Column('link', Text),
+    Column('summary', Text),
+    Column('published', Text),  # As written in the feed
+    Column('updated', Text),
+    Column('tags', Text),
+    Column('media_content', Text),
+    Column('content', Text),
+    Column('authors', Text),
+    Column('id', Text),
+    Column('outlet', Text),
+    Column('hashed_title', Text),
+    Column('article_key', Integer, nullable=False),
+    Column('category', Text),
+    Column('published_ts', REAL),  # published as a POSIX timestamp, see watermarks.parse_published
+    Index('ux_news_rss_article_key', 'article_key', unique=True),
+    Index('ix_news_rss_hashed_title', 'hashed_title'),
+    Index('ix_news_rss_outlet_category_published_ts', 'outlet', 'category', 'published_ts'),
+)
+Index('ix_news_rss_priority', func.coalesce(news_rss.c.published_ts, 0))
+Index('ix_news_rss_outlet_priority', news_rss.c.outlet, func.coalesce(news_rss.c.published_ts, 0))
+
+analyzed_rss = Table(
+    'analyzed_rss',
+    metadata,
+    Column('topic', Text),
+    Column('individuals', Text),
+    Column('sentiment', Text),
+    Column('hashed_title', Text),
+    Column('article_key', Integer),  # NULL for analyses whose article was removed before article keys existed
+    Column('cluster_id', Integer),
+    Column('analyzed_by', Text),
+    Index('ux_analyzed_rss_article_key', 'article_key', unique=True),
+    Index('ix_analyzed_rss_topic', 'topic'),
+    Index('ix_analyzed_rss_individuals', 'individuals'),
+)
+
+POSTING_CONDITIONS = {
+    'article_key': 'news_rss.article_key = :posting_id',
+    'hashed_title': 'news_rss.hashed_title = :posting_id',
+}
+
+# /person and /search match through the analysis_search FTS5 table, see search.py
+API_QUERIES = {
+    # Keyset pages in rowid order, see pagination.py; row_cursor is the rowid a page's cursor is made from
+    'topic': '''
+        SELECT analyzed_rss.rowid AS row_cursor, analyzed_rss.* FROM analyzed_rss
+        WHERE topic = :topic_name AND analyzed_rss.rowid > :after
+        ORDER BY analyzed_rss.rowid LIMIT :limit
+    ''',
+    'person': '''
+        SELECT analyzed_rss.rowid AS row_cursor, analyzed_rss.* FROM analysis_search
+        JOIN analyzed_rss ON analyzed_rss.rowid = analysis_search.rowid
+        WHERE analysis_search MATCH :match AND analysis_search.rowid > :after
+        ORDER BY analysis_search.rowid LIMIT :limit
+    ''',
+    'search': '''
+        SELECT analyzed_rss.*, news_rss.title, news_rss.link, news_rss.outlet, news_rss.published_ts,
+               bm25(analysis_search, {weights}) AS score
+        FROM analysis_search
+        JOIN analyzed_rss ON analyzed_rss.rowid = analysis_search.rowid
+        LEFT JOIN news_rss ON news_rss.article_key = analyzed_rss.article_key
+        WHERE analysis_search MATCH :match
+        ORDER BY score
+        LIMIT :limit
+    '''.format(weights=', '.join(str(weight) for weight in SEARCH_WEIGHTS)),
+    # /counts reads the rollups kept by the triggers in rollups.py
+    'counts_top': 'SELECT value, count FROM analysis_counts WHERE dimension = :dimension ORDER BY count DESC, value LIMIT :top_n',
+    'counts_total': 'SELECT count FROM analysis_count_totals WHERE dimension = :dimension',
+    **{
+        f'posting_by_{name}': f'SELECT * FROM news_rss JOIN analyzed_rss ON news_rss.article_key = analyzed_rss.article_key WHERE {condition}'
+        for name, condition in POSTING_CONDITIONS.items()
+    },
+    **{f'raw_posting_by_{name}': f'SELECT * FROM news_rss WHERE {condition}' for name, condition in POSTING_CONDITIONS.items()},
+}
@@ -0,0 +1,89 @@
+"""
+Copyright @emontj 2024
+
+Full-text search over analyses: an FTS5 table of every analysis row's individuals and topic with
+its article's title and summary, kept in sync with analyzed_rss by triggers. Its rowids are
+analyzed_rss rowids, so matches join straight back to the analyses.
+"""
+
+import re
+
+from sqlalchemy import text
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+# bm25 weights of individuals, topic, title and summary
+SEARCH_WEIGHTS = (4.0, 3.0, 2.0, 1.0)
+
+SEARCH_DDL = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS analysis_search USING fts5(
+        individuals, topic, title, summary,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS analysis_search_insert AFTER INSERT ON analyzed_rss BEGIN
+        INSERT INTO analysis_search (rowid, individuals, topic, title, summary)
+        SELECT new.rowid, new.individuals, new.topic, news_rss.title, news_rss.summary
+        FROM (SELECT 1) LEFT JOIN news_rss ON news_rss.article_key = new.article_key;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS analysis_search_update AFTER UPDATE OF individuals, topic ON analyzed_rss BEGIN
+        UPDATE analysis_search SET individuals = new.individuals, topic = new.topic WHERE rowid = new.rowid;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS analysis_search_delete AFTER DELETE ON analyzed_rss BEGIN
+        DELETE FROM analysis_search WHERE rowid = old.rowid;
+    END
+    ''',
+]
+
+def create_search_index(engine):
+    """
+    Creates the search table and its triggers, and indexes the analyses stored before them.
+    """
+    with engine.begin() as connection:
+        for statement in SEARCH_DDL:
+            connection.execute(text(statement))
+
+        connection.execute(text('DELETE FROM analysis_search'))
+        connection.execute(text('''
+            INSERT INTO analysis_search (rowid, individuals, topic, title, summary)
+            SELECT analyzed_rss.rowid, analyzed_rss.individuals, analyzed_rss.topic, news_rss.title, news_rss.summary
+            FROM analyzed_rss LEFT JOIN news_rss ON news_rss.article_key = analyzed_rss.article_key
+        '''))
+
+def search_terms(query):
+    """
+    Words of a user's query, lower-cased, without FTS5 syntax.
+    """
+    return re.findall(r'\w+', query.lower())
+
+def person_match(name):
+    """
+    FTS5 query for /person: the words of name in order in individuals, the last one as a prefix,
+    so 'kamala har' finds 'kamala harris'. None if name has no words.
+    """
+    terms = search_terms(name)
+    return f'individuals : "{" ".join(terms)}"*' if terms else None
+
+def search_match(query):
+    """
+    FTS5 query for /search: every word of query, each as a prefix, in any column. None if query has no words.
+    """
+    terms = search_terms(query)
+    return ' '.join(f'"{term}"*' for term in terms) if terms else None
+
+def search_limit(value):
+    """
+    Result limit from a request argument, DEFAULT_SEARCH_LIMIT if missing or invalid, at most MAX_SEARCH_LIMIT.
+    """
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_SEARCH_LIMIT
+    return max(1, min(limit, MAX_SEARCH_LIMIT))
@@ -0,0 +1,154 @@
+"""
+Copyright @emontj 2024
+"""
+
+from bisect import bisect
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import multiprocessing
+import time
+
+from sqlalchemy import create_engine
+
+from production.backend.collector import NEWS_RSS_COLUMNS, prepare_table, update_data, upgrade_article_keys
+from production.backend.feed_cache import ValidatorStore
+from production.backend.fetcher import DEFAULT_CONNECT_TIMEOUT, DEFAULT_MAX_WORKERS, DEFAULT_READ_TIMEOUT
+from production.backend.polling import MAX_INTERVAL, MIN_INTERVAL, PollingPlanner
+from production.backend.watermarks import WatermarkStore
+
+DEFAULT_REPLICAS = 100
+SQLITE_BUSY_TIMEOUT = 30
+
+def ring_position(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+class HashRing:
+    """
+    Consistent hash ring. Each node owns replicas points on the ring and a key belongs to the node
+    owning the next point after the key's hash, so adding or removing a node only moves about 1/N of the keys.
+    """
+
+    def __init__(self, nodes, replicas=DEFAULT_REPLICAS):
+        points = sorted((ring_position(f'{node}#{i}'), node) for node in nodes for i in range(replicas))
+        self.positions = [position for position, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        return self.nodes[bisect(self.positions, ring_position(key)) % len(self.nodes)]
+
+def shard_sources(news_sources, workers, replicas=DEFAULT_REPLICAS):
+    """
+    Splits news_sources by feed url across workers with consistent hashing.
+
+    Returns:
+        list: One news source configuration per worker, in the same shape as news_sources.
+              A worker may get an empty configuration when there are few links.
+    """
+    ring = HashRing(range(workers), replicas)
+    shards = [{} for _ in range(workers)]
+
+    for outlet, source in news_sources.items():
+        for category, link in source['links'].items():
+            shard = shards[ring.node_for(link)]
+            shard.setdefault(outlet, {'links': {}, 'mapping': source['mapping']})['links'][category] = link
+
+    return shards
+
+def worker_engine(database_url):
+    if database_url.startswith('sqlite'):
+        return create_engine(database_url, connect_args={'timeout': SQLITE_BUSY_TIMEOUT})
+    return create_engine(database_url)
+
+def prepare_database(engine):
+    """
+    Creates every table the collector writes to, so that workers never race to create them.
+    """
+    upgrade_article_keys(engine)
+    prepare_table(engine, 'news_rss', NEWS_RSS_COLUMNS, ['article_key'])
+    ValidatorStore(engine)
+    WatermarkStore(engine)
+    PollingPlanner(engine)
+
+def collect_shard(database_url, news_sources, options):
+    """
+    Worker process entry point: collects one shard with its own engine and writes it independently.
+
+    Returns:
+        tuple: (per-outlet fetch report, seconds taken).
+    """
+    start = time.perf_counter()
+    engine = worker_engine(database_url)
+
+    try:
+        report = update_data(
+            news_sources,
+            engine,
+            concurrent=True,
+            max_workers=options['max_workers'],
+            connect_timeout=options['connect_timeout'],
+            read_timeout=options['read_timeout'],
+            validator_store=ValidatorStore(engine) if options['validators'] else None,
+            watermark_store=WatermarkStore(engine) if options['watermarks'] else None,
+            planner=PollingPlanner(engine, *options['poll_intervals']) if options['poll_intervals'] else None,
+        )
+    finally:
+        engine.dispose()
+
+    return report, time.perf_counter() - start
+
+def merge_reports(reports):
+    merged = {}
+
+    for report in reports:
+        for outlet, summary in report.items():
+            totals = merged.setdefault(outlet, {})
+            for k, v in summary.items():
+                totals[k] = totals.get(k, 0) + v
+
+    return merged
+
+def collect_sharded(news_sources, database_url, workers, max_workers=DEFAULT_MAX_WORKERS, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT, validators=True, watermarks=True, poll_intervals=(MIN_INTERVAL, MAX_INTERVAL)):
+    """
+    Collects news_sources on workers processes, each fetching its consistent-hash shard of the links on its
+    own thread pool of max_workers and writing its own batches through its own engine.
+
+    Args:
+        news_sources (dict): News source configuration, see source_configs.py.
+        database_url (str): SQLAlchemy url every worker connects to.
+        workers (int): Number of worker processes.
+        max_workers (int): Feeds downloaded at once by each worker.
+        connect_timeout (float): Per-feed connect timeout in seconds.
+        read_timeout (float): Per-feed read timeout in seconds.
+        validators (bool): Use conditional requests, see feed_cache.ValidatorStore.
+        watermarks (bool): Drop entries seen before, see watermarks.WatermarkStore.
+        poll_intervals (tuple, optional): (min, max) poll interval in seconds. Fetch only due links,
+            see polling.PollingPlanner, unless None.
+
+    Returns:
+        dict: Per-outlet fetch report summed over the workers, see collector.update_data.
+    """
+    engine = worker_engine(database_url)
+    try:
+        prepare_database(engine)
+    finally:
+        engine.dispose()
+
+    options = {
+        'max_workers': max_workers,
+        'connect_timeout': connect_timeout,
+        'read_timeout': read_timeout,
+        'validators': validators,
+        'watermarks': watermarks,
+        'poll_intervals': poll_intervals,
+    }
+    shards = [shard for shard in shard_sources(news_sources, workers) if shard]
+
+    # Spawned rather than forked so workers never inherit the web server's threads or open connections
+    with ProcessPoolExecutor(max_workers=len(shards) or 1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(collect_shard, database_url, shard, options) for shard in shards]
+        results = [future.result() for future in futures]
+
+    for shard, (_, elapsed) in zip(shards, results):
+        print(f'Collected {sum(len(source["links"]) for source in shard.values())} feeds in {elapsed:.2f} s')
+
+    return merge_reports(report for report, _ in results)
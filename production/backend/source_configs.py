@@ -1,91 +1,88 @@
 """
 Copyright @emontj 2024
+
+News source registry. Sources are read from a JSON file (news_sources.json next to this module,
+or the file named by the NEWS_SOURCES_PATH environment variable) shaped like:
+
+    {
+        "<outlet>": {
+            "links": {"<category>": "<feed url>", ...},
+            "mapping": {"<field>": "<feed entry key>" or null, ...}
+        }
+    }
+
+The mapping must name every field of the news_rss record, with null where the feed lacks it:
+    title           Title of the article
+    link            Article link
+    summary         Short description or summary
+    published       Publication date
+    updated         Last update time
+    tags            Tags/categories
+    media_content   Media content URL
+    content         Full content
+    authors         List of authors
+    id              Unique ID or GUID
 """
 
-PRODUCTION_NEWS_SOURCES = {
-    "CNN": {
-        "links": {
-            "politics": "http://rss.cnn.com/rss/cnn_allpolitics.rss",
-        },
-        "mapping": {
-            "title": "title",                        # Title of the article
-            "link": "link",                         # Article link
-            "summary": "summary",                   # Short description or summary
-            "published": "published",               # Publication date
-            "updated": None,                        # Last update time (not available)
-            "tags": None,                           # Tags/categories (not available)
-            "media_content": "media_content",       # Media content URL, if available
-            "content": None,                        # Full content (not available)
-            "authors": None,                        # List of authors (not available)
-            "id": "id",                             # Unique ID or GUID
-        },
-    },
-    "Fox News": {
-        "links": {
-            "politics": "https://feeds.foxnews.com/foxnews/politics",
-        },
-        "mapping": {
-            "title": "title",                        # Title of the article
-            "link": "link",                         # Article link
-            "summary": "summary",                   # Short description or summary
-            "published": "published",               # Publication date
-            "updated": None,                        # Last update time (not available)
-            "tags": "tags",                         # Tags/categories
-            "media_content": "media_content",       # Media content URL
-            "content": "content",                   # Full content
-            "authors": None,                        # List of authors (not available)
-            "id": "id",                             # Unique ID or GUID
-        },
-    },
-    "Washington Post": {
-        "links": {
-            "politics": "http://feeds.washingtonpost.com/rss/politics",
-        },
-        "mapping": {
-            "title": "title",                        # Title of the article
-            "link": "link",                         # Article link
-            "summary": "summary",                   # Short description or summary
-            "published": "published",               # Publication date
-            "updated": None,                        # Last update time (not available)
-            "tags": None,                           # Tags/categories (not available)
-            "media_content": None,                  # Media content URL (not available)
-            "content": None,                        # Full content (not available)
-            "authors": "authors",                   # List of authors
-            "id": "id",                             # Unique ID or GUID
-        },
-    },
-    "NYT": {
-        "links": {
-            "politics": "https://rss.nytimes.com/services/xml/rss/nyt/Politics.xml",
-        },
-        "mapping": {
-            "title": "title",                        # Title of the article
-            "link": "link",                         # Article link
-            "summary": "summary",                   # Short description or summary
-            "published": "published",               # Publication date
-            "updated": None,                        # Last update time (not available)
-            "tags": "tags",                         # Tags/categories
-            "media_content": "media_content",       # Media content URL
-            "content": "content",                   # Full content
-            "authors": None,                        # List of authors (not available)
-            "id": "id",                             # Unique ID or GUID
-        },
-    },
-    "Guardian": {
-        "links": {
-            "politics": "https://www.theguardian.com/politics/rss",
-        },
-        "mapping": {
-            "title": "title",                        # Title of the article
-            "link": "link",                         # Article link
-            "summary": "summary",                   # Short description or summary
-            "published": "published",               # Publication date
-            "updated": "updated",                   # Last update time
-            "tags": "tags",                         # Tags/categories
-            "media_content": "media_content",       # Media content URL
-            "content": None,                        # Full content (not available)
-            "authors": "authors",                   # List of authors
-            "id": "id",                             # Unique ID or GUID
-        },
-    },
-}
+import json
+import os
+from urllib.parse import urlparse
+
+MAPPING_FIELDS = ['title', 'link', 'summary', 'published', 'updated', 'tags', 'media_content', 'content', 'authors', 'id']
+DEFAULT_SOURCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'news_sources.json')
+
+def validate_news_sources(news_sources):
+    """
+    Checks a news source configuration against the registry schema.
+
+    Raises:
+        ValueError: Naming the first outlet and field that do not conform, or a feed url used twice.
+    """
+    if not isinstance(news_sources, dict) or not news_sources:
+        raise ValueError('News sources must be a non-empty object of outlets.')
+
+    seen_links = {}
+
+    for outlet, source in news_sources.items():
+        if not isinstance(source, dict) or set(source) != {'links', 'mapping'}:
+            raise ValueError(f"Outlet '{outlet}' must have exactly 'links' and 'mapping'.")
+
+        links, mapping = source['links'], source['mapping']
+
+        if not isinstance(links, dict) or not links:
+            raise ValueError(f"Outlet '{outlet}' must have at least one link.")
+        for category, link in links.items():
+            if not isinstance(link, str) or urlparse(link).scheme not in ('http', 'https'):
+                raise ValueError(f"Link '{category}' of outlet '{outlet}' is not an http(s) url.")
+            if link in seen_links:
+                raise ValueError(f"Link '{link}' of outlet '{outlet}' is already used by '{seen_links[link]}'.")
+            seen_links[link] = outlet
+
+        if not isinstance(mapping, dict) or set(mapping) != set(MAPPING_FIELDS):
+            missing = sorted(set(MAPPING_FIELDS) - set(mapping or {}))
+            unknown = sorted(set(mapping or {}) - set(MAPPING_FIELDS))
+            raise ValueError(f"Mapping of outlet '{outlet}' is missing {missing} or has unknown fields {unknown}.")
+        for field, key in mapping.items():
+            if key is not None and not isinstance(key, str):
+                raise ValueError(f"Mapping field '{field}' of outlet '{outlet}' must be a string or null.")
+
+def load_news_sources(path=None):
+    """
+    Loads and validates the news source registry.
+
+    Args:
+        path (str, optional): JSON file to read. Defaults to NEWS_SOURCES_PATH or news_sources.json.
+
+    Returns:
+        dict: Outlet name to its links and mapping.
+    """
+    path = path or os.getenv('NEWS_SOURCES_PATH') or DEFAULT_SOURCES_PATH
+
+    with open(path) as f:
+        news_sources = json.load(f)
+
+    validate_news_sources(news_sources)
+
+    return news_sources
+
+PRODUCTION_NEWS_SOURCES = load_news_sources()
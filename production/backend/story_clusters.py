@@ -0,0 +1,223 @@
+"""
+Copyright @emontj 2024
+"""
+
+from collections import deque
+import time
+import zlib
+
+import numpy as np
+from sqlalchemy import bindparam, inspect, text
+
+from production.backend.analysis_cache import normalize_cache_text
+from production.backend.collector import batched
+
+DEFAULT_NUM_PERM = 128
+DEFAULT_BANDS = 32
+DEFAULT_THRESHOLD = 0.5
+DEFAULT_WINDOW = 3 * 86400
+SHINGLE_SIZE = 5
+HASH_PRIME = 4294967291  # Largest prime below 2**32
+QUERY_CHUNK = 500
+
+def story_text(title, summary):
+    """
+    Text compared between articles: title and summary, normalized like analysis cache keys.
+    """
+    return f'{normalize_cache_text(title)} {normalize_cache_text(summary)}'.strip()
+
+def shingles(text, size=SHINGLE_SIZE):
+    """
+    crc32 hashes of the distinct character size-grams of text.
+    """
+    if len(text) <= size:
+        return np.array([zlib.crc32(text.encode())], dtype=np.uint64)
+    grams = {text[i:i + size] for i in range(len(text) - size + 1)}
+    return np.fromiter((zlib.crc32(gram.encode()) for gram in grams), dtype=np.uint64, count=len(grams))
+
+class MinHasher:
+    """
+    num_perm universal hash functions (a * x + b) mod a prime just below 2**32 over the shingle hashes.
+    The fraction of equal positions in two signatures estimates the Jaccard similarity of their shingle sets.
+    """
+
+    def __init__(self, num_perm=DEFAULT_NUM_PERM, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, HASH_PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, HASH_PRIME, num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        # Everything is below the prime, so a * x + b stays below 2**64
+        return ((np.outer(shingles(text) % HASH_PRIME, self.a) + self.b) % HASH_PRIME).min(axis=0)
+
+def similarity(signature, other):
+    return float(np.mean(signature == other))
+
+class StoryClusterIndex:
+    """
+    Story cluster of every clustered article in the story_clusters table, with the MinHash signatures
+    of recent articles for finding near-duplicates.
+
+    Signatures are split into bands; articles sharing any band are candidates, and a candidate joins
+    the cluster of its most similar match if their estimated Jaccard similarity reaches threshold.
+    With the defaults, 32 bands of 4 rows find pairs above about 0.45 similarity with high probability.
+    A cluster's id is the article key of its first member.
+
+    The signatures in the window are read from the table by the first assign and then kept in memory,
+    with every article assigned since added and those falling out of the window dropped, so later
+    assigns of a run only hash and match their own articles. Use one index per run: articles clustered
+    by other processes after the first assign are not seen by it.
+    """
+
+    def __init__(self, engine, num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS, threshold=DEFAULT_THRESHOLD, window=DEFAULT_WINDOW):
+        if num_perm % bands:
+            raise ValueError(f'num_perm ({num_perm}) must be a multiple of bands ({bands}).')
+
+        self.engine = engine
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.window = window
+        # Articles in the window: their cluster, signature and LSH buckets, and (clustered_at, key) in order
+        self.loaded_from = None
+        self.recent_clusters = {}
+        self.signatures = {}
+        self.buckets = [{} for _ in range(bands)]
+        self.recent = deque()
+
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                CREATE TABLE IF NOT EXISTS story_clusters (
+                    article_key INTEGER PRIMARY KEY,
+                    cluster_id INTEGER NOT NULL,
+                    outlet TEXT,
+                    signature BLOB NOT NULL,
+                    clustered_at REAL NOT NULL
+                )
+            '''))
+            connection.execute(text('CREATE INDEX IF NOT EXISTS ix_story_clusters_cluster_id ON story_clusters (cluster_id)'))
+            connection.execute(text('CREATE INDEX IF NOT EXISTS ix_story_clusters_clustered_at ON story_clusters (clustered_at)'))
+
+    def band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def clusters(self, article_keys):
+        """
+        Returns:
+            dict: cluster_id per article_key, for the given articles that have been clustered.
+        """
+        query = text('SELECT article_key, cluster_id FROM story_clusters WHERE article_key IN :keys').bindparams(bindparam('keys', expanding=True))
+        found = {}
+
+        with self.engine.connect() as connection:
+            for chunk in batched(article_keys, QUERY_CHUNK):
+                found.update(connection.execute(query, {'keys': chunk}).fetchall())
+
+        return found
+
+    def remember(self, key, cluster_id, signature, clustered_at):
+        self.recent_clusters[key] = cluster_id
+        self.signatures[key] = signature
+        self.recent.append((clustered_at, key))
+        for bucket, band_key in zip(self.buckets, self.band_keys(signature)):
+            bucket.setdefault(band_key, set()).add(key)
+
+    def forget_before(self, oldest):
+        while self.recent and self.recent[0][0] < oldest:
+            _, key = self.recent.popleft()
+            del self.recent_clusters[key]
+            for bucket, band_key in zip(self.buckets, self.band_keys(self.signatures.pop(key))):
+                members = bucket[band_key]
+                members.discard(key)
+                if not members:
+                    del bucket[band_key]
+
+    def load_recent(self, oldest):
+        """
+        Reads the signatures of the articles clustered since oldest into the LSH buckets.
+        """
+        self.loaded_from = oldest
+        self.recent_clusters, self.signatures, self.recent = {}, {}, deque()
+        self.buckets = [{} for _ in range(self.bands)]
+
+        with self.engine.connect() as connection:
+            recent = connection.execute(
+                text('SELECT article_key, cluster_id, signature, clustered_at FROM story_clusters WHERE clustered_at >= :oldest ORDER BY clustered_at, rowid'),
+                {'oldest': oldest},
+            ).fetchall()
+
+        for key, cluster_id, signature, clustered_at in recent:
+            self.remember(key, cluster_id, np.frombuffer(signature, dtype=np.uint64), clustered_at)
+
+    def assign(self, df, now=None):
+        """
+        Puts every article of df in a story cluster. Articles clustered before keep their cluster.
+
+        Args:
+            df (pd.DataFrame): Articles with title, summary, outlet and article_key columns.
+            now (float, optional): Timestamp of the assignment. Only articles clustered
+                within window seconds before it are matched against.
+
+        Returns:
+            dict: cluster_id per article_key of df.
+        """
+        now = time.time() if now is None else now
+        oldest = now - self.window
+        if self.loaded_from is None or oldest < self.loaded_from:
+            self.load_recent(oldest)
+        else:
+            self.forget_before(oldest)
+
+        keys = [int(key) for key in df['article_key']]
+        assigned = self.clusters(keys)
+
+        new_rows = []
+        for key, title, summary, outlet in zip(keys, df['title'], df['summary'], df['outlet'] if 'outlet' in df else [None] * len(df)):
+            if key in assigned:
+                continue
+
+            signature = self.hasher.signature(story_text(title, summary))
+            candidates = {match for bucket, band_key in zip(self.buckets, self.band_keys(signature)) for match in bucket.get(band_key, ())}
+
+            best, best_similarity = None, 0.0
+            for candidate in candidates:
+                candidate_similarity = similarity(signature, self.signatures[candidate])
+                if candidate_similarity >= self.threshold and candidate_similarity > best_similarity:
+                    best, best_similarity = candidate, candidate_similarity
+
+            cluster_id = key if best is None else self.recent_clusters[best]
+            assigned[key] = cluster_id
+            self.remember(key, cluster_id, signature, now)
+            new_rows.append({'key': key, 'cluster_id': cluster_id, 'outlet': outlet, 'signature': signature.tobytes(), 'now': now})
+
+        if new_rows:
+            with self.engine.begin() as connection:
+                connection.execute(text('''
+                    INSERT INTO story_clusters (article_key, cluster_id, outlet, signature, clustered_at)
+                    VALUES (:key, :cluster_id, :outlet, :signature, :now)
+                    ON CONFLICT(article_key) DO NOTHING
+                '''), new_rows)
+
+        return {key: assigned[key] for key in keys}
+
+def cluster_coverage(engine, cluster_ids):
+    """
+    Returns:
+        dict: Number of distinct outlets that ran each story, per cluster_id. Clusters
+              that are not in story_clusters are left out.
+    """
+    query = text('''
+        SELECT cluster_id, COUNT(DISTINCT outlet) FROM story_clusters
+        WHERE cluster_id IN :ids GROUP BY cluster_id
+    ''').bindparams(bindparam('ids', expanding=True))
+    coverage = {}
+
+    if not inspect(engine).has_table('story_clusters'):
+        return coverage
+
+    with engine.connect() as connection:
+        for chunk in batched([int(cluster_id) for cluster_id in cluster_ids], QUERY_CHUNK):
+            coverage.update(connection.execute(query, {'ids': chunk}).fetchall())
+
+    return coverage
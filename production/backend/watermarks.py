@@ -0,0 +1,136 @@
+"""
+Copyright @emontj 2024
+"""
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import json
+import time
+
+from sqlalchemy import text
+
+MAX_RECENT_IDS = 500
+
+def parse_published(value):
+    """
+    Parses an RSS (RFC 822) or Atom (ISO 8601) date into a POSIX timestamp.
+    Dates without a timezone are taken as UTC. Returns None for missing or unparseable values.
+    """
+    if not value:
+        return None
+
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            parsed = datetime.fromisoformat(value.strip())
+        except ValueError:
+            return None
+
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+
+    return parsed.timestamp()
+
+class WatermarkStore:
+    """
+    Per-(outlet, category) high-watermarks kept in the feed_watermarks table: the newest
+    published timestamp seen and the ids of the entries in the most recent fetches.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                CREATE TABLE IF NOT EXISTS feed_watermarks (
+                    outlet TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    published_max REAL,
+                    recent_ids TEXT,
+                    updated_at REAL,
+                    PRIMARY KEY (outlet, category)
+                )
+            '''))
+
+    def load(self):
+        """
+        Returns:
+            dict: (outlet, category) to {'published_max': float or None, 'recent_ids': list}.
+        """
+        with self.engine.connect() as connection:
+            rows = connection.execute(text('SELECT outlet, category, published_max, recent_ids FROM feed_watermarks')).mappings()
+            return {
+                (row['outlet'], row['category']): {'published_max': row['published_max'], 'recent_ids': json.loads(row['recent_ids'] or '[]')}
+                for row in rows
+            }
+
+    def save(self, watermarks):
+        rows = [
+            {
+                'outlet': outlet,
+                'category': category,
+                'published_max': watermark['published_max'],
+                'recent_ids': json.dumps(watermark['recent_ids'][-MAX_RECENT_IDS:]),
+                'updated_at': time.time(),
+            }
+            for (outlet, category), watermark in watermarks.items()
+        ]
+
+        if not rows:
+            return
+
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                INSERT INTO feed_watermarks (outlet, category, published_max, recent_ids, updated_at)
+                VALUES (:outlet, :category, :published_max, :recent_ids, :updated_at)
+                ON CONFLICT(outlet, category) DO UPDATE SET
+                    published_max = excluded.published_max,
+                    recent_ids = excluded.recent_ids,
+                    updated_at = excluded.updated_at
+            '''), rows)
+
+def entry_identity(entry, mapping):
+    return entry.get(mapping.get('id') or 'id') or entry.get(mapping.get('link') or 'link')
+
+def filter_new_entries(entries, watermark, mapping):
+    """
+    Drops entries already covered by a watermark: those whose id was seen before and those published
+    before the newest timestamp seen. An entry published exactly at the watermark is kept only if its id is new.
+
+    Args:
+        entries (list): Parsed feed entries.
+        watermark (dict, optional): Stored watermark for the feed, see WatermarkStore.load.
+        mapping (dict): Source mapping, used to find each entry's id and published date.
+
+    Returns:
+        tuple: (new entries, updated watermark).
+    """
+    watermark = watermark or {'published_max': None, 'recent_ids': []}
+    seen = set(watermark['recent_ids'])
+    published_max = watermark['published_max']
+    published_key = mapping.get('published')
+    new_entries = []
+    feed_ids = []
+    newest = published_max
+
+    for entry in entries:
+        identity = entry_identity(entry, mapping)
+        published = parse_published(entry.get(published_key)) if published_key else None
+
+        if identity is not None:
+            feed_ids.append(identity)
+        if published is not None and (newest is None or published > newest):
+            newest = published
+
+        if identity in seen:
+            continue
+        if published is not None and published_max is not None and published < published_max:
+            continue
+
+        new_entries.append(entry)
+
+    current = set(feed_ids)
+    recent_ids = [i for i in watermark['recent_ids'] if i not in current] + feed_ids
+
+    return new_entries, {'published_max': newest, 'recent_ids': recent_ids[-MAX_RECENT_IDS:]}
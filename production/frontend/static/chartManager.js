@@ -66,7 +66,7 @@ function updateMainCharts() {
     const individualsChart = new ChartManager('individualsChart', 'pie');
     const topicsChart = new ChartManager('topicsChart', 'pie');
 
-    fetch('/counts')
+    fetch('/counts?top_n=10')
         .then(response => response.json())
         .then(data => {
             for (const [key, value] of Object.entries(data)) {
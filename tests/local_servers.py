@@ -0,0 +1,204 @@
+"""
+Copyright @emontj 2024
+"""
+
+from email.utils import formatdate
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import random
+import threading
+import time
+
+from production.backend.llm_backends import LocalServerBackend, StubBackend
+from production.backend.source_configs import PRODUCTION_NEWS_SOURCES
+
+FEED_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'feeds')
+FIXTURES = {
+    'CNN': 'cnn_politics.xml',
+    'Fox News': 'foxnews_politics.xml',
+    'Washington Post': 'washingtonpost_politics.xml',
+    'NYT': 'nyt_politics.xml',
+    'Guardian': 'guardian_politics.xml',
+}
+
+class FeedFixtureServer:
+    """
+    Local stand-in for the news outlets' RSS hosts, serving the canned feeds in tests/fixtures/feeds.
+
+    delays maps a fixture file name to seconds slept before responding, and
+    /status/<code> answers with that HTTP status so error handling can be exercised.
+    With validators enabled, feeds carry ETag/Last-Modified headers and conditional requests get 304s.
+    """
+
+    def __init__(self, directory=FEED_FIXTURE_DIR, delays=None, validators=True):
+        self.directory = directory
+        self.delays = delays or {}
+        self.validators = validators
+        self.requests = []
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                name = self.path.lstrip('/')
+                server.requests.append(name)
+                time.sleep(server.delays.get(name, 0))
+
+                if name.startswith('status/'):
+                    self.send_response(int(name.split('/', 1)[1]))
+                    self.end_headers()
+                    return
+
+                path = os.path.join(server.directory, name)
+                if not os.path.isfile(path):
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+
+                with open(path, 'rb') as f:
+                    body = f.read()
+
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                last_modified = formatdate(os.path.getmtime(path), usegmt=True)
+
+                if server.validators and (
+                    self.headers.get('If-None-Match') == etag
+                    or self.headers.get('If-Modified-Since') == last_modified
+                ):
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/rss+xml')
+                if server.validators:
+                    self.send_header('ETag', etag)
+                    self.send_header('Last-Modified', last_modified)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def url(self, name):
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}/{name}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def fixture_sources(server, fixtures=FIXTURES):
+    """
+    Builds a news source configuration pointing each outlet's politics link at the fixture server.
+    """
+    return {
+        outlet: {
+            'links': {'politics': server.url(name)},
+            'mapping': PRODUCTION_NEWS_SOURCES[outlet]['mapping'],
+        }
+        for outlet, name in fixtures.items()
+    }
+
+class MockChatCompletionsServer:
+    """
+    Local stand-in for the OpenAI chat completions endpoint, for use with llm_backends.LocalServerBackend.
+
+    Every request sleeps latency seconds (or a random time in a (low, high) range) before answering
+    like llm_backends.StubBackend. failures is a list of HTTP status codes returned, in order, instead of
+    a completion for the first requests; 429s carry a Retry-After of retry_after seconds. The peak number of requests being handled at once is recorded.
+    """
+
+    def __init__(self, latency=0.0, failures=None, retry_after=None):
+        self.latency = latency
+        self.failures = list(failures or [])
+        self.retry_after = retry_after
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+                with server.lock:
+                    server.requests.append({'time': time.monotonic(), 'body': body})
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                    failure = server.failures.pop(0) if server.failures else None
+
+                try:
+                    latency = server.latency
+                    time.sleep(random.uniform(*latency) if isinstance(latency, tuple) else latency)
+
+                    if failure:
+                        payload = json.dumps({'error': {'message': f'Injected {failure}', 'type': 'server_error'}}).encode()
+                        self.send_response(failure)
+                        if failure == 429 and server.retry_after is not None:
+                            self.send_header('Retry-After', str(server.retry_after))
+                    else:
+                        prompt = body['messages'][-1]['content']
+                        content = StubBackend.default_response(prompt)
+                        payload = json.dumps({
+                            'id': f'chatcmpl-{len(server.requests)}',
+                            'object': 'chat.completion',
+                            'created': int(time.time()),
+                            'model': body.get('model'),
+                            'choices': [{
+                                'index': 0,
+                                'message': {'role': 'assistant', 'content': content},
+                                'finish_reason': 'stop',
+                            }],
+                            'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(content) // 4, 'total_tokens': (len(prompt) + len(content)) // 4},
+                        }).encode()
+                        self.send_response(200)
+
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                finally:
+                    with server.lock:
+                        server.in_flight -= 1
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}/v1'
+
+    def backend(self, **kwargs):
+        return LocalServerBackend(self.base_url, **kwargs)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,97 @@
+"""
+Copyright @emontj 2024
+"""
+
+import time
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from production.backend.analysis_cache import AnalysisCache, cache_key
+from production.backend.analyzer import analyze_all_rows, analyze_dict
+from production.backend.llm_backends import StubBackend
+
+RESULT = {'topic': 'budget', 'individuals': 'none', 'sentiment': 'neutral'}
+
+def syndicated_articles():
+    # The same wire story from three outlets, plus one unrelated article
+    return pd.DataFrame({
+        'title': ['Senate passes the budget', 'SENATE passes  the budget', 'Senate passes the budget', 'Storm hits the coast'],
+        'summary': ['<p>Lawmakers voted late.</p>', 'Lawmakers voted late.', 'lawmakers voted late.', 'Thousands lost power.'],
+        'hashed_title': ['hash0', 'hash1', 'hash2', 'hash3'],
+        'article_key': [10, 11, 12, 13],
+    })
+
+class TestAnalysisCache(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_cache_key(self):
+        key = cache_key(1, 'gpt-4o-mini', 0.0, 'Senate passes the budget', '<p>Lawmakers voted late.</p>')
+
+        self.assertEqual(key, cache_key(1, 'gpt-4o-mini', 0, ' senate  PASSES the budget', 'Lawmakers voted late.'))
+        self.assertNotEqual(key, cache_key(2, 'gpt-4o-mini', 0.0, 'Senate passes the budget', 'Lawmakers voted late.'))
+        self.assertNotEqual(key, cache_key(1, 'gpt-4o', 0.0, 'Senate passes the budget', 'Lawmakers voted late.'))
+        self.assertNotEqual(key, cache_key(1, 'gpt-4o-mini', 0.7, 'Senate passes the budget', 'Lawmakers voted late.'))
+        self.assertNotEqual(key, cache_key(1, 'gpt-4o-mini', 0.0, 'Senate passes the budget', 'Lawmakers voted early.'))
+
+    def test_get_put_and_stats(self):
+        cache = AnalysisCache(self.engine)
+
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', RESULT)
+        self.assertEqual(cache.get('a'), RESULT)
+
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_eviction(self):
+        cache = AnalysisCache(self.engine, max_entries=2)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, RESULT)
+            time.sleep(0.01)
+        cache.get('a')
+
+        self.assertEqual(cache.evict(), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), RESULT)
+
+        expiring = AnalysisCache(self.engine, max_age=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(expiring.get('a'))
+        self.assertEqual(expiring.evict(), 2)
+
+    def test_syndicated_copies_are_analyzed_once(self):
+        for batch_size in (1, 3):
+            cache = AnalysisCache(create_engine('sqlite:///:memory:'))
+            backend = StubBackend()
+
+            first = analyze_all_rows(syndicated_articles(), backend=backend, batch_size=batch_size, cache=cache)
+            second = analyze_all_rows(syndicated_articles(), backend=backend, batch_size=batch_size, cache=cache)
+
+            self.assertEqual(first['topic'].tolist(), ['budget', 'budget', 'budget', 'coast'])
+            self.assertEqual(first['article_key'].tolist(), [10, 11, 12, 13])
+            pd.testing.assert_frame_equal(first, second)
+            self.assertEqual((cache.stats()['misses'], cache.stats()['hits']), (4, 4))
+            self.assertEqual(backend.stats()['calls'], 2 if batch_size == 1 else 1)
+
+    def test_analyze_dict_uses_cache(self):
+        cache = AnalysisCache(self.engine)
+        backend = StubBackend()
+        row = syndicated_articles().iloc[0].to_dict()
+
+        analyze_dict(row, backend=backend, cache=cache)
+        result = analyze_dict(dict(row, hashed_title='other'), backend=backend, cache=cache)
+
+        self.assertEqual(backend.stats()['calls'], 1)
+        self.assertEqual(result.iloc[0]['hashed_title'], 'other')
+        self.assertEqual(result.iloc[0]['topic'], 'budget')
+
+if __name__ == '__main__':
+    unittest.main()
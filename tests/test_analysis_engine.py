@@ -0,0 +1,120 @@
+"""
+Copyright @emontj 2024
+"""
+
+import time
+import unittest
+
+import pandas as pd
+
+from production.backend.analysis_engine import AnalysisBudget, RateLimiter, TokenBucket, is_retryable, run_bounded
+from production.backend.analyzer import analyze_all_rows
+from production.backend.llm_backends import StubBackend
+from tests.local_servers import MockChatCompletionsServer
+
+def articles(count):
+    return pd.DataFrame({
+        'title': [f'Article about subject{i}' for i in range(count)],
+        'summary': [f'Summary {i}' for i in range(count)],
+        'hashed_title': [f'hash{i}' for i in range(count)],
+        'article_key': list(range(count)),
+    })
+
+class TestAnalysisEngine(unittest.TestCase):
+
+    def test_token_bucket_limits_rate(self):
+        bucket = TokenBucket(rate_per_minute=1200, capacity=1)  # 20 per second
+
+        start = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        elapsed = time.monotonic() - start
+
+        self.assertGreaterEqual(elapsed, 0.24)
+        self.assertLess(elapsed, 1)
+
+    def test_concurrent_analysis_preserves_order(self):
+        with MockChatCompletionsServer(latency=(0.05, 0.3)) as server:
+            start = time.perf_counter()
+            result = analyze_all_rows(articles(20), max_in_flight=10, backend=server.backend())
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(result['topic'].tolist(), [f'subject{i}' for i in range(20)])
+        self.assertEqual(result['article_key'].tolist(), list(range(20)))
+        self.assertLessEqual(server.max_in_flight, 10)
+        self.assertGreater(server.max_in_flight, 1)
+        self.assertLess(elapsed, 2)  # Serially this averages 3.5 seconds
+
+    def test_limit_is_preserved(self):
+        with MockChatCompletionsServer() as server:
+            result = analyze_all_rows(articles(5), limit=3, backend=server.backend())
+
+        self.assertEqual(len(result), 3)
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(result['hashed_title'].tolist(), ['hash0', 'hash1', 'hash2'])
+
+    def test_retries_rate_limits_and_server_errors(self):
+        with MockChatCompletionsServer(failures=[429, 503, 500], retry_after=0) as server:
+            result = analyze_all_rows(articles(4), max_in_flight=2, backend=server.backend())
+
+        self.assertEqual(len(result), 4)
+        self.assertEqual(len(server.requests), 7)
+
+    def test_failed_rows_are_left_out(self):
+        with MockChatCompletionsServer(failures=[400]) as server:
+            result = analyze_all_rows(articles(3), max_in_flight=1, backend=server.backend())
+
+        self.assertEqual(result['hashed_title'].tolist(), ['hash1', 'hash2'])
+        self.assertEqual(len(server.requests), 3)
+
+    def test_rate_limiter_spaces_requests(self):
+        limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=None)
+
+        with MockChatCompletionsServer() as server:
+            # Start nearly empty so the steady rate of 10 per second applies
+            start = limiter.requests.updated = time.monotonic()
+            limiter.requests.tokens = 1
+            analyze_all_rows(articles(5), max_in_flight=5, limiter=limiter, backend=server.backend())
+
+        # Measured from the start since the first request is delayed by client setup
+        self.assertGreaterEqual(max(request['time'] for request in server.requests) - start, 0.35)
+
+    def test_is_retryable(self):
+        class StatusError(Exception):
+            def __init__(self, status_code):
+                self.status_code = status_code
+
+        self.assertTrue(is_retryable(StatusError(429)))
+        self.assertTrue(is_retryable(StatusError(502)))
+        self.assertFalse(is_retryable(StatusError(401)))
+        self.assertFalse(is_retryable(ValueError('bad output')))
+
+    def test_run_bounded_empty(self):
+        self.assertEqual(run_bounded([], lambda item: item), [])
+
+    def test_analysis_budget(self):
+        backend = StubBackend(responder=lambda prompt: 'ok')
+        backend.complete([{'role': 'user', 'content': 'before the run'}])
+
+        budget = AnalysisBudget(calls=3, tokens=1000)
+        budget.start(backend)
+        self.assertEqual(budget.affordable([100] * 10, batch_size=2), 6)
+        self.assertEqual(budget.affordable([400] * 10), 2)
+
+        backend.complete([{'role': 'user', 'content': 'x' * 2400}])
+        self.assertEqual({k: v for k, v in budget.spent().items() if k != 'seconds'}, {'calls': 1, 'tokens': 600})
+        self.assertEqual(budget.affordable([100] * 10), 2)
+        self.assertEqual(budget.affordable([300] * 10), 1)
+        self.assertFalse(budget.exhausted())
+
+        backend.complete([{'role': 'user', 'content': 'x' * 2400}])
+        self.assertTrue(budget.exhausted())
+        self.assertEqual(budget.affordable([1]), 0)
+
+        expired = AnalysisBudget(deadline=time.time() - 1)
+        expired.start(backend)
+        self.assertTrue(expired.exhausted())
+        self.assertEqual(expired.affordable([1]), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,10 +2,15 @@
 Copyright @emontj 2024
 """
 
+import json
 import unittest
 from unittest.mock import patch, MagicMock
 import pandas as pd
+from sqlalchemy import create_engine
+from production.backend.analysis_engine import AnalysisBudget
 from production.backend.analyzer import *
+from production.backend.collector import add_rows_without_duplicates
+from production.backend.llm_backends import StubBackend, set_backend
 
 class TestAnalyzer(unittest.TestCase):
 
@@ -16,8 +21,12 @@ class TestAnalyzer(unittest.TestCase):
             'summary': ['Summary 1', 'Summary 2'],
             'hashed_title': ['hash1', 'hash2']
         })
+        set_backend(None)
 
-    @patch('production.backend.analyzer.OpenAI')
+    def tearDown(self):
+        set_backend(None)
+
+    @patch('production.backend.llm_backends.OpenAI')
     def test_analyze_dict(self, mock_openai):
         # Mock OpenAI client and response
         mock_client = MagicMock()
@@ -28,7 +37,7 @@ class TestAnalyzer(unittest.TestCase):
                     "message": {
                         "content": """
                         Topic: Politics
-                        Individuals: John Doe
+                        Individuals: John Doe, Jane Smith
                         Sentiment: Neutral
                         """
                     }
@@ -78,5 +87,183 @@ class TestAnalyzer(unittest.TestCase):
         self.assertEqual(len(df), 2)
         self.assertEqual(df.columns.tolist(), ['title', 'summary', 'hashed_title'])
 
+    def test_parse_batch_analysis(self):
+        message = '''```json
+        [
+            {"key": "0", "topic": "Tariffs", "individuals": "John Doe", "sentiment": "Negative"},
+            {"key": "1", "topic": "Budget", "individuals": "none", "sentiment": "Angry"},
+            {"key": "2", "topic": "", "individuals": "none", "sentiment": "Neutral"},
+            {"key": "7", "topic": "Unknown", "individuals": "none", "sentiment": "Neutral"},
+            {"key": "0", "topic": "Repeated", "individuals": "none", "sentiment": "Neutral"},
+            "not an object"
+        ]
+        ```'''
+
+        parsed = parse_batch_analysis(message, ['0', '1', '2'])
+
+        self.assertEqual(parsed, {'0': {'topic': 'tariffs', 'individuals': 'john doe', 'sentiment': 'negative'}})
+        self.assertEqual(parse_batch_analysis('Topic: Tariffs', ['0']), {})
+
+    def test_analyze_batch_splits_failed_articles(self):
+        prompts = []
+
+        def responder(prompt):
+            # Garbles any batch containing the third article until it is asked about alone
+            prompts.append(prompt)
+            articles = json.loads(prompt.split(BATCH_MARKER, 1)[1])
+            if len(articles) > 1 and any(article['title'] == 'Title 2' for article in articles):
+                return json.dumps([{'key': a['key'], 'topic': 'x', 'individuals': 'none', 'sentiment': 'Neutral'} for a in articles if a['title'] != 'Title 2'])
+            return StubBackend.default_response(prompt)
+
+        df = pd.DataFrame({
+            'title': [f'Title {i}' for i in range(5)],
+            'summary': ['Summary'] * 5,
+            'hashed_title': [f'hash{i}' for i in range(5)],
+            'article_key': range(5),
+        })
+        result = analyze_all_rows(df, backend=StubBackend(responder=responder), batch_size=5)
+
+        self.assertEqual(result['hashed_title'].tolist(), [f'hash{i}' for i in range(5)])
+        self.assertEqual(result['topic'].tolist(), ['x', 'x', '2', 'x', 'x'])
+        self.assertEqual(len(prompts), 2)
+
+    def test_batch_mode_matches_single_mode(self):
+        df = pd.DataFrame({
+            'title': [f'Story about subject{i}' for i in range(7)],
+            'summary': ['Summary'] * 7,
+            'hashed_title': [f'hash{i}' for i in range(7)],
+            'article_key': range(7),
+        })
+        backend = StubBackend()
+
+        single = analyze_all_rows(df, backend=backend)
+        batched = analyze_all_rows(df, backend=backend, batch_size=3)
+
+        pd.testing.assert_frame_equal(single, batched)
+        self.assertEqual(backend.stats()['calls'], 7 + 3)
+
+    def stored_articles(self, count):
+        engine = create_engine('sqlite:///:memory:')
+        add_rows_without_duplicates(pd.DataFrame({
+            'title': [f'Story about subject{i}' for i in range(count)],
+            'summary': ['Summary'] * count,
+            'outlet': ['CNN'] * count,
+            'hashed_title': [f'hash{i}' for i in range(count)],
+            'article_key': range(count),
+            'published_ts': [float(i % 4) for i in range(count)],
+        }), engine, 'news_rss', ['article_key'])
+        return engine
+
+    def test_pending_articles_in_chunks(self):
+        engine = self.stored_articles(10)
+        add_rows_without_duplicates(pd.DataFrame({'topic': ['x'], 'article_key': [3]}), engine, 'analyzed_rss', ['article_key'])
+
+        chunks = list(pending_articles(engine, chunk_size=3))
+
+        self.assertEqual([chunk['article_key'].tolist() for chunk in chunks], [[7, 6, 2], [9, 5, 1], [8, 4, 0]])
+        self.assertEqual(list(chunks[0].columns), ['title', 'summary', 'outlet', 'hashed_title', 'article_key'])
+
+    def test_run_analysis_newest_first_within_limit(self):
+        engine = self.stored_articles(5)
+        backend = StubBackend()
+
+        first = run_analysis(engine, limit=3, backend=backend, chunk_size=2)
+        second = run_analysis(engine, backend=backend, chunk_size=2)
+
+        self.assertEqual(first['article_key'].tolist(), [3, 2, 1])
+        self.assertEqual(second['article_key'].tolist(), [4, 0])
+        self.assertEqual(backend.stats()['calls'], 5)
+        self.assertIsNone(run_analysis(engine, backend=backend))
+
+    def outlet_burst(self):
+        # CNN publishes a burst of six stories after NYT's two and Fox News's one
+        engine = create_engine('sqlite:///:memory:')
+        outlets = ['CNN'] * 6 + ['NYT'] * 2 + ['Fox News']
+        add_rows_without_duplicates(pd.DataFrame({
+            'title': [f'Story about subject{i}' for i in range(9)],
+            'summary': ['Summary'] * 9,
+            'outlet': outlets,
+            'hashed_title': [f'hash{i}' for i in range(9)],
+            'article_key': range(9),
+            'published_ts': [100.0, 101.0, 102.0, 103.0, 104.0, 105.0, 50.0, 60.0, 10.0],
+        }), engine, 'news_rss', ['article_key'])
+        return engine
+
+    def test_fair_pending_articles(self):
+        engine = self.outlet_burst()
+
+        chunks = list(pending_articles(engine, chunk_size=4, fair=True))
+
+        self.assertEqual([chunk['article_key'].tolist() for chunk in chunks], [[5, 7, 8, 4], [6, 3, 2, 1], [0]])
+        self.assertEqual(list(chunks[0].columns), ['title', 'summary', 'outlet', 'hashed_title', 'article_key'])
+        self.assertEqual(list(pending_articles(engine, chunk_size=4))[0]['article_key'].tolist(), [5, 4, 3, 2])
+
+    def test_run_analysis_within_budget(self):
+        engine = self.outlet_burst()
+        backend = StubBackend()
+
+        analyzed_df = run_analysis(engine, backend=backend, max_in_flight=2, budget=AnalysisBudget(calls=3))
+
+        self.assertEqual(analyzed_df['article_key'].tolist(), [5, 7, 8])
+        self.assertEqual(backend.stats()['calls'], 3)
+        self.assertIsNone(run_analysis(engine, backend=backend, budget=AnalysisBudget(deadline=0)))
+
+    def test_run_analysis_stops_when_told_before_a_round(self):
+        engine = self.stored_articles(5)
+        backend = StubBackend()
+        rounds = iter([True, True, False])
+
+        # A lease lost during the third round's check stops the run with two rounds stored
+        analyzed_df = run_analysis(engine, backend=backend, chunk_size=2, before_round=lambda: next(rounds))
+
+        self.assertEqual(len(analyzed_df), 4)
+        self.assertEqual(backend.stats()['calls'], 4)
+        self.assertEqual(len(run_analysis(engine, backend=backend)), 1)
+
+    def test_crash_keeps_completed_analyses(self):
+        class Crash(BaseException):
+            pass
+
+        def responder(prompt):
+            if len(prompts) == 3:
+                raise Crash()
+            prompts.append(prompt)
+            return StubBackend.default_response(prompt)
+
+        prompts = []
+        engine = self.stored_articles(5)
+
+        with self.assertRaises(Crash):
+            run_analysis(engine, backend=StubBackend(responder=responder), max_in_flight=1, checkpoint_size=2)
+
+        stored = pd.read_sql('SELECT article_key FROM analyzed_rss', engine)
+        self.assertEqual(sorted(stored['article_key']), [1, 2, 3])
+
+        backend = StubBackend()
+        resumed = run_analysis(engine, backend=backend)
+        self.assertEqual(resumed['article_key'].tolist(), [4, 0])
+        self.assertEqual(backend.stats()['calls'], 2)
+
+    def test_analysis_writer_checkpoints(self):
+        engine = create_engine('sqlite:///:memory:')
+        flushes = []
+        checkpoint_listeners.append(lambda rows, seconds: flushes.append(rows))
+        try:
+            writer = AnalysisWriter(engine, checkpoint_size=2)
+            for i in range(5):
+                writer.add({'topic': 'x', 'hashed_title': f'hash{i}', 'article_key': i, 'cluster_id': None if i else 7})
+            self.assertEqual(flushes, [2, 2])
+
+            writer.add({'topic': 'x', 'hashed_title': 'hash0', 'article_key': 0})
+            writer.flush()
+        finally:
+            checkpoint_listeners.clear()
+
+        self.assertEqual(flushes, [2, 2, 2])
+        self.assertEqual(writer.rows_written, 5)
+        stored = pd.read_sql('SELECT article_key, cluster_id FROM analyzed_rss ORDER BY article_key', engine)
+        self.assertEqual(stored['article_key'].tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(stored['cluster_id'].iloc[0], 7)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,107 @@
+"""
+Copyright @emontj 2024
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from production.backend.analyzer import build_prompt
+from production.backend.batch_jobs import BatchJobStore, LocalBatchService, read_batch_results, run_batch_job, write_batch_file
+from production.backend.collector import add_rows_without_duplicates, key_to_hex
+from production.backend.llm_backends import StubBackend
+
+def stored_articles(engine, count):
+    add_rows_without_duplicates(pd.DataFrame({
+        'title': [f'Story about subject{i}' for i in range(count)],
+        'summary': ['Summary'] * count,
+        'outlet': ['CNN'] * count,
+        'hashed_title': [f'hash{i}' for i in range(count)],
+        'article_key': [i - 2 for i in range(count)],
+        'published_ts': [float(i) for i in range(count)],
+    }), engine, 'news_rss', ['article_key'])
+
+class TestBatchJobs(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def test_batch_file_format(self):
+        path = os.path.join(self.directory.name, 'input.jsonl')
+        row_dict = {'title': 'Budget passes', 'summary': 'The House voted.', 'article_key': -1}
+
+        self.assertEqual(write_batch_file([row_dict], path, 'gpt-4o-mini'), 1)
+
+        with open(path, encoding='utf-8') as batch_file:
+            request = json.loads(batch_file.readline())
+        self.assertEqual(request['custom_id'], key_to_hex(-1))
+        self.assertEqual((request['method'], request['url']), ('POST', '/v1/chat/completions'))
+        self.assertEqual(request['body']['model'], 'gpt-4o-mini')
+        self.assertEqual(request['body']['messages'][-1]['content'], build_prompt(row_dict))
+
+    def test_read_batch_results_skips_failures(self):
+        def line(custom_id, content, status_code=200, error=None):
+            body = {'choices': [{'message': {'content': content}}]}
+            return json.dumps({'custom_id': custom_id, 'response': {'status_code': status_code, 'body': body}, 'error': error})
+
+        lines = [
+            line(key_to_hex(1), 'Topic: Budget\nIndividuals: none\nSentiment: Neutral'),
+            line(key_to_hex(2), 'Topic: Budget'),
+            line(key_to_hex(3), 'Topic: Budget\nIndividuals: none\nSentiment: Neutral', status_code=500),
+            json.dumps({'custom_id': key_to_hex(4), 'response': None, 'error': {'message': 'expired'}}),
+            '',
+        ]
+
+        self.assertEqual(list(read_batch_results(lines)), [(1, {'topic': 'budget', 'individuals': 'none', 'sentiment': 'neutral'})])
+
+    def test_run_batch_job_offline(self):
+        stored_articles(self.engine, 5)
+        backend = StubBackend()
+        service = LocalBatchService(os.path.join(self.directory.name, 'service'), backend=backend)
+
+        stored = run_batch_job(self.engine, service, self.directory.name, limit=3, poll_interval=0)
+
+        self.assertEqual(stored, 3)
+        self.assertEqual(backend.stats()['calls'], 3)
+        analyzed = pd.read_sql('SELECT topic, hashed_title, article_key FROM analyzed_rss ORDER BY article_key', self.engine)
+        self.assertEqual(analyzed['article_key'].tolist(), [0, 1, 2])
+        self.assertEqual(analyzed['topic'].tolist(), ['subject2', 'subject3', 'subject4'])
+        self.assertEqual(analyzed['hashed_title'].tolist(), ['hash2', 'hash3', 'hash4'])
+
+        self.assertEqual(run_batch_job(self.engine, service, self.directory.name, poll_interval=0), 2)
+        self.assertEqual(run_batch_job(self.engine, service, self.directory.name, poll_interval=0), 0)
+        self.assertEqual([job['status'] for job in BatchJobStore(self.engine).jobs()], ['completed', 'completed'])
+
+    def test_unfinished_job_is_collected_by_the_next_run(self):
+        stored_articles(self.engine, 4)
+        service = LocalBatchService(os.path.join(self.directory.name, 'service'), backend=StubBackend(), latency=3600)
+
+        self.assertIsNone(run_batch_job(self.engine, service, self.directory.name, poll_interval=0, timeout=0))
+        self.assertEqual(BatchJobStore(self.engine).unfinished('local')['article_count'], 4)
+
+        service.latency = 0
+        self.assertEqual(run_batch_job(self.engine, service, self.directory.name, poll_interval=0), 4)
+        self.assertEqual(len(BatchJobStore(self.engine).jobs()), 1)
+        self.assertIsNone(BatchJobStore(self.engine).unfinished('local'))
+
+    def test_reanalyze_overwrites_stored_analyses(self):
+        stored_articles(self.engine, 2)
+        add_rows_without_duplicates(pd.DataFrame({'topic': ['old'], 'individuals': ['none'], 'sentiment': ['neutral'], 'hashed_title': ['hash0'], 'article_key': [-2]}), self.engine, 'analyzed_rss', ['article_key'])
+        service = LocalBatchService(os.path.join(self.directory.name, 'service'), backend=StubBackend())
+
+        self.assertEqual(run_batch_job(self.engine, service, self.directory.name, poll_interval=0, reanalyze=True), 2)
+
+        analyzed = pd.read_sql('SELECT topic FROM analyzed_rss ORDER BY article_key', self.engine)
+        self.assertEqual(analyzed['topic'].tolist(), ['subject0', 'subject1'])
+
+if __name__ == '__main__':
+    unittest.main()
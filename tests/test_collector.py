@@ -6,6 +6,7 @@ import unittest
 from unittest.mock import patch, MagicMock
 import pandas as pd
 import hashlib
+from sqlalchemy import create_engine
 from production.backend.collector import *
 
 class TestNewsRSSFunctions(unittest.TestCase):
@@ -77,6 +78,29 @@ class TestNewsRSSFunctions(unittest.TestCase):
             hashlib.sha256('None'.encode()).hexdigest()
         )  # Check hash of None value
 
+    def test_article_keys(self):
+        # Test compact keys are batched, normalized and round-trip through their hex form
+        keys = article_keys(['Article 1', '  article   1 '], ['CNN', 'CNN'], ['http://example.com/1', 'http://example.com/1'])
+        self.assertEqual(keys.dtype, 'int64')
+        self.assertEqual(keys[0], keys[1])  # Case and whitespace do not change the key
+        self.assertEqual(keys[0], article_key('Article 1', 'CNN', 'http://example.com/1'))
+        self.assertNotEqual(keys[0], article_key('Article 1', 'Fox News', 'http://example.com/1'))
+        self.assertEqual(len(key_to_hex(keys[0])), 16)
+        self.assertEqual(hex_to_key(key_to_hex(keys[0])), keys[0])
+
+    def test_upgrade_article_keys(self):
+        # Test tables written before article keys get them backfilled, and repeats appended by old refreshes removed once
+        engine = create_engine('sqlite:///:memory:')
+        pd.DataFrame({'title': ['Article 1'] * 2, 'link': ['http://example.com/1'] * 2, 'outlet': ['CNN'] * 2, 'hashed_title': ['h1'] * 2}).to_sql('news_rss', engine)
+        pd.DataFrame({'topic': ['budget', 'budget'], 'hashed_title': ['h1', 'h1']}).to_sql('analyzed_rss', engine)
+        self.assertEqual(upgrade_article_keys(engine), {'news_rss': 1, 'analyzed_rss': 1})
+        self.assertEqual(upgrade_article_keys(engine), {})
+
+        expected = article_key('Article 1', 'CNN', 'http://example.com/1')
+        self.assertEqual(pd.read_sql('SELECT article_key FROM news_rss', engine)['article_key'].tolist(), [expected])
+        self.assertEqual(pd.read_sql('SELECT article_key FROM analyzed_rss', engine)['article_key'].tolist(), [expected])
+        engine.dispose()
+
     def test_prepare_dataframe_for_sql(self):
         # Test preparing DataFrame for SQL insertion
         df = pd.DataFrame({
@@ -88,16 +112,57 @@ class TestNewsRSSFunctions(unittest.TestCase):
         self.assertEqual(prepared_df['title'].iloc[1], None)  # Check None value
         self.assertEqual(prepared_df['published'].iloc[0], '2024-12-01 00:00:00')  # Check datetime conversion
 
-    @patch('sqlalchemy.engine.Engine.connect')
-    def test_add_rows_without_duplicates(self, mock_connect):
+    def test_add_rows_without_duplicates(self):
         # Test adding rows without duplicates
-        mock_engine = MagicMock()
+        engine = create_engine('sqlite:///:memory:')
         df = pd.DataFrame({
             'id': ['id1', 'id2'],
             'title': ['Article 1', 'Article 2']
         })
-        add_rows_without_duplicates(df, mock_engine, 'test_table', ['id'])
-        self.assertTrue(mock_connect.called)  # Ensure connection was used
+        self.assertEqual(add_rows_without_duplicates(df, engine, 'test_table', ['id']), 2)
+        self.assertEqual(add_rows_without_duplicates(df, engine, 'test_table', ['id']), 0)  # Re-insert is a no-op
+
+        df.loc[1, 'title'] = 'Article 2 (updated)'
+        add_rows_without_duplicates(df, engine, 'test_table', ['id'], update=True)
+        stored_df = pd.read_sql('SELECT * FROM test_table', engine)
+        self.assertEqual(len(stored_df), 2)
+        self.assertEqual(stored_df['title'].iloc[1], 'Article 2 (updated)')
+        engine.dispose()
+
+    def test_compact_duplicates(self):
+        # Test removing duplicates written by append-only inserts
+        engine = create_engine('sqlite:///:memory:')
+        pd.DataFrame({'hashed_title': ['a', 'a', 'b'], 'title': ['x', 'x', 'y']}).to_sql('news_rss', engine)
+        self.assertEqual(compact_duplicates(engine, 'news_rss', ['hashed_title']), 1)
+
+        df = pd.DataFrame({'hashed_title': ['b', 'c'], 'title': ['y', 'z'], 'outlet': ['CNN', 'CNN']})
+        self.assertEqual(add_rows_without_duplicates(df, engine, 'news_rss', ['hashed_title']), 1)
+        self.assertEqual(len(pd.read_sql('SELECT * FROM news_rss', engine)), 3)
+        engine.dispose()
+
+    def test_duplicates_block_inserts(self):
+        # Test that inserts never delete rows to build their unique index
+        engine = create_engine('sqlite:///:memory:')
+        pd.DataFrame({'hashed_title': ['a', 'a', 'b'], 'title': ['x', 'x', 'y']}).to_sql('news_rss', engine)
+
+        df = pd.DataFrame({'hashed_title': ['c'], 'title': ['z'], 'outlet': ['CNN']})
+        with self.assertRaisesRegex(DuplicateKeys, 'compact_duplicates'):
+            add_rows_without_duplicates(df, engine, 'news_rss', ['hashed_title'])
+        self.assertEqual(len(pd.read_sql('SELECT * FROM news_rss', engine)), 3)
+        engine.dispose()
+
+    def test_insert_records_streams_batches(self):
+        # Test writing a generator of feed records in small batches
+        engine = create_engine('sqlite:///:memory:')
+        feeds = {'CNN': {'politics': self.sample_feed, 'outlet': 'CNN'}}
+        records = iter_news_records(feeds, TEST_NEWS_SOURCES)
+        inserted = insert_records_without_duplicates(records, engine, 'news_rss', NEWS_RSS_COLUMNS, ['hashed_title'], batch_size=1)
+        self.assertEqual(inserted, 2)
+
+        stored_df = pd.read_sql('SELECT * FROM news_rss', engine)
+        self.assertEqual(stored_df['outlet'].tolist(), ['CNN', 'CNN'])
+        self.assertEqual(stored_df['hashed_title'].iloc[0], hashlib.sha256('Test Title 1'.encode()).hexdigest())
+        engine.dispose()
 
     def test_extract_all_entries(self):
         # Test extracting all entries from feed
@@ -0,0 +1,82 @@
+"""
+Copyright @emontj 2024
+"""
+
+import os
+import unittest
+from unittest import mock
+
+import feedparser
+
+from production.backend.collector import RSS_FIELDS
+from production.backend import fast_parser
+from production.backend.fast_parser import parse_feed
+from tests.local_servers import FEED_FIXTURE_DIR
+
+def read_fixture(name):
+    with open(os.path.join(FEED_FIXTURE_DIR, name), 'rb') as f:
+        return f.read()
+
+class TestFastParser(unittest.TestCase):
+
+    def test_matches_feedparser_on_fixtures(self):
+        for name in sorted(os.listdir(FEED_FIXTURE_DIR)):
+            if name.startswith('malformed'):
+                continue
+
+            content = read_fixture(name)
+            fast = parse_feed(content)
+            expected = feedparser.parse(content)
+
+            self.assertEqual(fast['parser'], 'fast', name)
+            self.assertEqual(len(fast['entries']), len(expected['entries']), name)
+            for entry, expected_entry in zip(fast['entries'], expected['entries']):
+                for field in RSS_FIELDS:
+                    self.assertEqual(entry.get(field), expected_entry.get(field), f'{name} {field}')
+
+    def test_hostile_markup_is_sanitized(self):
+        # The second Atom entry is type="text": plain text, kept as-is like feedparser does
+        for name, count in (('hostile_politics.xml', 2), ('hostile_atom_politics.xml', 1)):
+            entries = parse_feed(read_fixture(name))['entries'][:count]
+            html = [entry['summary'] for entry in entries] + [content['value'] for entry in entries for content in entry.get('content', [])]
+            html += [entries[0]['title']]
+
+            for value in html:
+                for markup in ('<script', 'onerror', 'onclick', 'onmouseover', 'javascript:', '<iframe', '<style'):
+                    self.assertNotIn(markup, value, f'{name}: {value}')
+
+        self.assertIn('<p>Full story</p>', parse_feed(read_fixture('hostile_politics.xml'))['entries'][0]['content'][0]['value'])
+
+    def test_only_mapped_fields_are_extracted(self):
+        mapping = {'title': 'title', 'link': 'link', 'tags': None, 'authors': None}
+        entry = parse_feed(read_fixture('nyt_politics.xml'), mapping)['entries'][0]
+
+        self.assertEqual(set(entry), {'title', 'link'})
+
+    def test_malformed_feed_falls_back_to_feedparser(self):
+        parsed = parse_feed(read_fixture('malformed_politics.xml'))
+
+        self.assertEqual(parsed['parser'], 'feedparser')
+        self.assertEqual(parsed['entries'][0]['link'], 'https://broken.example.com/politics/1')
+
+    def test_rss_1_falls_back_to_feedparser(self):
+        content = b'''<?xml version="1.0"?>
+            <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" xmlns="http://purl.org/rss/1.0/">
+              <item rdf:about="https://rdf.example.com/1"><title>RDF item</title><link>https://rdf.example.com/1</link></item>
+            </rdf:RDF>'''
+        parsed = parse_feed(content)
+
+        self.assertEqual(parsed['parser'], 'feedparser')
+        self.assertEqual(parsed['entries'][0]['title'], 'RDF item')
+
+    def test_feedparser_without_the_helpers_parses_every_feed(self):
+        content = read_fixture('hostile_politics.xml')
+
+        with mock.patch.object(fast_parser, 'FAST_PARSER_AVAILABLE', False):
+            parsed = parse_feed(content)
+
+        self.assertEqual(parsed['parser'], 'feedparser')
+        self.assertEqual(parsed['entries'], feedparser.parse(content)['entries'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+Copyright @emontj 2024
+"""
+
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from production.backend.collector import update_data
+from production.backend.feed_cache import ValidatorStore, fetched_feeds
+from production.backend.fetcher import fetch_all_feeds
+from tests.local_servers import FIXTURES, FeedFixtureServer, fixture_sources
+
+class TestFeedCache(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_second_refresh_is_conditional(self):
+        with FeedFixtureServer() as server:
+            sources = fixture_sources(server)
+            first = update_data(sources, self.engine, concurrent=True, validator_store=ValidatorStore(self.engine))
+            second = update_data(sources, self.engine, concurrent=True, validator_store=ValidatorStore(self.engine))
+
+        self.assertEqual(first['CNN']['misses'], 1)
+        self.assertEqual(second['CNN']['hits'], 1)
+        self.assertEqual(second['CNN']['bytes_downloaded'], 0)
+        self.assertGreater(second['CNN']['bytes_saved'], 0)
+
+        stored_df = pd.read_sql('SELECT * FROM news_rss', self.engine)
+        self.assertEqual(len(stored_df), 16)  # Nothing parsed, so nothing re-inserted
+
+    def test_identical_body_skips_parsing(self):
+        store = ValidatorStore(self.engine)
+
+        with FeedFixtureServer(validators=False) as server:
+            sources = fixture_sources(server, {'CNN': FIXTURES['CNN']})
+            store.save(fetched_feeds(fetch_all_feeds(sources, validator_store=store)))
+            feed = fetch_all_feeds(sources, validator_store=store)['CNN']['politics']
+
+        self.assertEqual(feed['fetch']['status'], 200)
+        self.assertEqual(feed['fetch']['cache'], 'hit')
+        self.assertEqual(feed['entries'], [])
+
+    def test_failed_insert_keeps_old_validators(self):
+        with FeedFixtureServer() as server:
+            sources = fixture_sources(server, {'CNN': FIXTURES['CNN']})
+            with patch('production.backend.collector.insert_records_without_duplicates', side_effect=RuntimeError('disk full')):
+                with self.assertRaises(RuntimeError):
+                    update_data(sources, self.engine, validator_store=ValidatorStore(self.engine))
+
+            # Nothing was stored, so the retry downloads and ingests the feed again
+            report = update_data(sources, self.engine, validator_store=ValidatorStore(self.engine))
+
+        self.assertEqual(report['CNN']['misses'], 1)
+        self.assertEqual(report['CNN']['hits'], 0)
+        self.assertGreater(len(pd.read_sql('SELECT * FROM news_rss', self.engine)), 0)
+
+    def test_serial_mode_uses_store(self):
+        with FeedFixtureServer() as server:
+            sources = fixture_sources(server, {'NYT': FIXTURES['NYT']})
+            update_data(sources, self.engine, validator_store=ValidatorStore(self.engine))
+            report = update_data(sources, self.engine, validator_store=ValidatorStore(self.engine))
+
+        self.assertEqual(report['NYT']['hits'], 1)
+        self.assertEqual(report['NYT']['misses'], 0)
+        self.assertEqual(report['NYT']['parses_skipped'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+Copyright @emontj 2024
+"""
+
+import time
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from production.backend.collector import update_data
+from production.backend.fetcher import build_client, fetch_all_feeds, fetch_feed
+from tests.local_servers import FIXTURES, FeedFixtureServer, fixture_sources
+
+class TestFetcher(unittest.TestCase):
+
+    def test_fetch_feed_parses_entries(self):
+        with FeedFixtureServer() as server, build_client() as client:
+            feed = fetch_feed(client, server.url('cnn_politics.xml'))
+
+        self.assertEqual(len(feed['entries']), 4)
+        self.assertEqual(feed['fetch']['status'], 200)
+        self.assertEqual(feed['fetch']['parser'], 'fast')
+        self.assertIsNone(feed['fetch']['error'])
+
+    def test_fetch_feed_returns_error_result(self):
+        with FeedFixtureServer() as server, build_client() as client:
+            feed = fetch_feed(client, server.url('status/503'))
+
+        self.assertEqual(feed['entries'], [])
+        self.assertEqual(feed['fetch']['status'], 503)
+        self.assertIn('HTTPStatusError', feed['fetch']['error'])
+
+    def test_fetch_all_feeds_is_concurrent(self):
+        delays = {name: 0.5 for name in FIXTURES.values()}
+
+        with FeedFixtureServer(delays=delays) as server:
+            start = time.perf_counter()
+            feeds = fetch_all_feeds(fixture_sources(server), max_workers=5)
+            elapsed = time.perf_counter() - start
+
+        self.assertLess(elapsed, 1.5)  # Serially this would take 2.5 seconds
+        self.assertEqual(set(feeds), set(FIXTURES))
+        self.assertEqual(feeds['NYT']['outlet'], 'NYT')
+        self.assertEqual(len(feeds['NYT']['politics']['entries']), 3)
+
+    def test_slow_feed_times_out_without_aborting_batch(self):
+        with FeedFixtureServer(delays={'washingtonpost_politics.xml': 2}) as server:
+            feeds = fetch_all_feeds(fixture_sources(server), read_timeout=0.5)
+
+        self.assertIn('ReadTimeout', feeds['Washington Post']['politics']['fetch']['error'])
+        self.assertEqual(len(feeds['CNN']['politics']['entries']), 4)
+
+    def test_update_data_concurrent(self):
+        engine = create_engine('sqlite:///:memory:')
+
+        with FeedFixtureServer() as server:
+            sources = fixture_sources(server)
+            sources['Broken'] = {'links': {'politics': server.url('status/500')}, 'mapping': sources['CNN']['mapping']}
+            update_data(sources, sql_engine=engine, concurrent=True, max_workers=3)
+
+        stored_df = pd.read_sql('SELECT * FROM news_rss', engine)
+        self.assertEqual(len(stored_df), 16)
+        self.assertEqual(set(stored_df['outlet']), set(FIXTURES))
+        engine.dispose()
+
+if __name__ == '__main__':
+    unittest.main()
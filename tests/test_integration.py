@@ -8,10 +8,12 @@ from sqlalchemy import create_engine
 import pandas as pd
 from production.backend.collector import update_data
 from production.backend.analyzer import run_analysis
+from production.backend.llm_backends import set_backend
 
 class TestIntegration(unittest.TestCase):
 
     def setUp(self):
+        set_backend(None)
         self.engine = create_engine('sqlite:///:memory:')
         self.news_sources = {
             "TestSource": {
@@ -48,14 +50,14 @@ class TestIntegration(unittest.TestCase):
         }
 
     @patch('production.backend.collector.feedparser.parse')
-    @patch('production.backend.analyzer.OpenAI')
+    @patch('production.backend.llm_backends.OpenAI')
     def test_full_workflow(self, mock_openai, mock_feedparser):
         mock_feedparser.return_value = self.sample_feed
 
         mock_openai_client = MagicMock()
         mock_openai.return_value = mock_openai_client
-        mock_openai_client.chat.completions.create.side_effect = [
-            {
+        completions = {
+            'Test Title 1': {
                 "choices": [
                     {"message": {"content": """
                     Topic: Politics
@@ -64,7 +66,7 @@ class TestIntegration(unittest.TestCase):
                     """}}
                 ]
             },
-            {
+            'Test Title 2': {
                 "choices": [
                     {"message": {"content": """
                     Topic: Technology
@@ -73,7 +75,11 @@ class TestIntegration(unittest.TestCase):
                     """}}
                 ]
             }
-        ]
+        }
+        # Keyed on the prompt rather than call order since articles are analyzed concurrently
+        mock_openai_client.chat.completions.create.side_effect = lambda messages, **kwargs: next(
+            completion for title, completion in completions.items() if title in messages[-1]['content']
+        )
 
         update_data(self.news_sources, sql_engine=self.engine)
 
@@ -84,10 +90,11 @@ class TestIntegration(unittest.TestCase):
         analyzed_df = run_analysis(self.engine, limit=2)
 
         self.assertEqual(len(analyzed_df), 2)
-        self.assertEqual(analyzed_df.iloc[0]['topic'], 'politics')
-        self.assertEqual(analyzed_df.iloc[1]['individuals'], 'jane smith')
+        self.assertEqual(analyzed_df['topic'].tolist(), ['technology', 'politics'])  # Newest first
+        self.assertEqual(analyzed_df.iloc[0]['individuals'], 'jane smith')
 
     def tearDown(self):
+        set_backend(None)
         self.engine.dispose()
 
 if __name__ == '__main__':
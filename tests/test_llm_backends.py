@@ -0,0 +1,72 @@
+"""
+Copyright @emontj 2024
+"""
+
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+from production.backend.llm_backends import StubBackend, completion_content, get_backend, set_backend
+from tests.local_servers import MockChatCompletionsServer
+
+MESSAGES = [{'role': 'user', 'content': 'Article Title: Senate passes the budget\nArticle Summary: ...'}]
+
+class TestLLMBackends(unittest.TestCase):
+
+    def tearDown(self):
+        set_backend(None)
+
+    def test_local_server_backend_reuses_connections(self):
+        with MockChatCompletionsServer(latency=0.01) as server:
+            backend = server.backend()
+            calls = [backend.complete(MESSAGES) for _ in range(10)]
+            backend.close()
+
+        self.assertEqual(calls[0]['content'], 'Topic: budget\nIndividuals: none\nSentiment: Neutral')
+        self.assertFalse(calls[0]['reused_connection'])
+        self.assertTrue(all(call['reused_connection'] for call in calls[1:]))
+        self.assertGreaterEqual(calls[0]['latency'], 0.01)
+
+        stats = backend.stats()
+        self.assertEqual(stats['calls'], 10)
+        self.assertEqual(stats['connections_opened'], 1)
+        self.assertEqual(stats['connections_reused'], 9)
+        self.assertEqual(stats['completion_tokens'], 120)
+        self.assertGreater(stats['prompt_tokens'], 0)
+
+    def test_errors_are_counted(self):
+        with MockChatCompletionsServer(failures=[500]) as server:
+            backend = server.backend()
+            with self.assertRaises(Exception):
+                backend.complete(MESSAGES)
+            backend.complete(MESSAGES)
+            backend.close()
+
+        self.assertEqual(backend.stats()['errors'], 1)
+        self.assertEqual(backend.stats()['calls'], 1)
+
+    def test_stub_backend_is_deterministic(self):
+        backend = StubBackend(responder=lambda prompt: f'Topic: {len(prompt)}')
+
+        self.assertEqual(backend.complete(MESSAGES)['content'], backend.complete(MESSAGES)['content'])
+        self.assertIsNone(backend.complete(MESSAGES)['reused_connection'])
+        self.assertEqual(backend.stats()['calls'], 3)
+
+    def test_completion_content_shapes(self):
+        as_dict = {'choices': [{'message': {'content': 'Topic: x'}}]}
+        as_object = MagicMock()
+        as_object.choices[0].message.content = 'Topic: x'
+
+        self.assertEqual(completion_content(as_dict), 'Topic: x')
+        self.assertEqual(completion_content(as_object), 'Topic: x')
+
+    @patch.dict(os.environ, {'LLM_BACKEND': 'stub'})
+    def test_process_wide_backend(self):
+        set_backend(None)
+        backend = get_backend()
+
+        self.assertIsInstance(backend, StubBackend)
+        self.assertIs(get_backend(), backend)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+Copyright @emontj 2024
+"""
+
+import random
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from production.backend.analyzer import run_analysis
+from production.backend.collector import add_rows_without_duplicates, article_key, hash_value
+from production.backend.llm_backends import StubBackend
+from production.backend.local_classifier import AnalyzerStore, Gazetteer, LocalAnalyzer, evaluate, llm_labels
+
+TOPICS = {
+    'tariffs': ['tariffs on steel imports', 'new import duties', 'tariffs on Chinese goods'],
+    'immigration': ['border crossings', 'asylum seekers at the border', 'immigration enforcement'],
+    'NFL': ['the Super Bowl', 'NFL playoff games', 'an NFL team owner'],
+}
+PEOPLE = ['Donald Trump', 'Kamala Harris', 'Chuck Schumer', 'Nancy Pelosi']
+SENTIMENTS = {'positive': ['praises', 'celebrates'], 'negative': ['slams', 'condemns']}
+
+def labeled_articles(count, seed=0):
+    """
+    Articles labeled the way the LLM would: the topic and sentiment follow the wording, and the person is the one named.
+    """
+    rng = random.Random(seed)
+    rows = []
+
+    for i in range(count):
+        topic, person, sentiment = rng.choice(list(TOPICS)), rng.choice(PEOPLE), rng.choice(list(SENTIMENTS))
+        title = f'{person.split()[-1] if i % 2 else person} {rng.choice(SENTIMENTS[sentiment])} {rng.choice(TOPICS[topic])}'
+        rows.append({
+            'title': title,
+            'summary': f'{person} spoke on {rng.choice(TOPICS[topic])} on {rng.choice(["Monday", "Tuesday", "Friday"])}.',
+            'topic': topic.lower(),
+            'individuals': person.lower(),
+            'sentiment': sentiment,
+        })
+
+    return pd.DataFrame(rows)
+
+class TestLocalClassifier(unittest.TestCase):
+
+    def test_gazetteer(self):
+        gazetteer = Gazetteer(['donald trump', 'kamala harris', 'j.d. vance', 'none', 'kamala harris'])
+
+        self.assertEqual(gazetteer.match('Donald Trump signs order', 'Trump signed it'), ('donald trump', 0.95))
+        self.assertEqual(gazetteer.match('Senate vote', 'Kamala Harris cast the tie-breaking vote'), ('kamala harris', 0.9))
+        self.assertEqual(gazetteer.match('Vance speaks', ''), ('j.d. vance', 0.8))
+        self.assertEqual(gazetteer.match('Trump and Harris debate', ''), (None, 0.0))
+        self.assertEqual(gazetteer.match('Storm hits coast', ''), (None, 0.0))
+
+    def test_evaluate(self):
+        report = evaluate(labeled_articles(300), thresholds=(0.5, 0.9, 1.01))
+
+        self.assertEqual([row['threshold'] for row in report], [0.5, 0.9, 1.01])
+        self.assertGreater(report[1]['calls_avoided'], 0.5)
+        self.assertGreaterEqual(report[1]['agreement'], 0.95)
+        self.assertGreaterEqual(report[0]['calls_avoided'], report[1]['calls_avoided'])
+        self.assertEqual(report[2]['calls_avoided'], 0.0)
+        self.assertIsNone(report[2]['agreement'])
+
+    def test_confident_articles_skip_the_llm(self):
+        engine = create_engine('sqlite:///:memory:')
+        training = labeled_articles(300)
+        news = pd.concat([training, labeled_articles(20, seed=1)], ignore_index=True)
+        news = news.assign(
+            outlet='CNN',
+            link=[f'https://cnn.example/{i}' for i in range(len(news))],
+            hashed_title=[hash_value(title) for title in news['title']],
+        )
+        news.loc[len(news)] = {'title': 'Hurricane makes landfall', 'summary': 'Thousands lost power.', 'outlet': 'CNN', 'link': 'https://cnn.example/storm', 'hashed_title': hash_value('Hurricane makes landfall')}
+        news['article_key'] = [article_key(title, outlet, link) for title, outlet, link in zip(news['title'], news['outlet'], news['link'])]
+
+        add_rows_without_duplicates(news[['title', 'summary', 'outlet', 'link', 'hashed_title', 'article_key']], engine, 'news_rss', ['article_key'])
+        add_rows_without_duplicates(news.head(len(training))[['topic', 'individuals', 'sentiment', 'hashed_title', 'article_key']], engine, 'analyzed_rss', ['article_key'])
+
+        self.assertIsNone(LocalAnalyzer.from_database(engine, min_examples=1000))
+        local = LocalAnalyzer.from_database(engine, threshold=0.9)
+        backend = StubBackend()
+
+        analyzed_df = run_analysis(engine, backend=backend, local=local)
+
+        answered = analyzed_df[analyzed_df['analyzed_by'] == 'local']
+        self.assertEqual(len(analyzed_df), 21)
+        self.assertGreater(len(answered), 10)
+        self.assertEqual(backend.stats()['calls'], 21 - len(answered))
+        self.assertNotIn(news['article_key'].iloc[-1], set(answered['article_key']))
+
+        expected = news.set_index('article_key')
+        for row in answered.to_dict(orient='records'):
+            self.assertEqual(row['topic'], expected.loc[row['article_key'], 'topic'])
+            self.assertEqual(row['individuals'], expected.loc[row['article_key'], 'individuals'])
+
+        # Local answers are never trained on
+        self.assertEqual(len(llm_labels(engine)), 300 + 21 - len(answered))
+
+    def test_stored_analyzer_predicts_the_same(self):
+        engine = create_engine('sqlite:///:memory:')
+        local = LocalAnalyzer(threshold=0.9).fit(labeled_articles(300))
+        store = AnalyzerStore(engine)
+
+        self.assertEqual(store.load(), (None, None))
+        store.save(local)
+        loaded, trained_at = store.load(threshold=0.9)
+
+        articles = labeled_articles(50, seed=2).to_dict(orient='records')
+        self.assertEqual(trained_at, store.trained_at())
+        self.assertEqual(loaded.predict(articles), local.predict(articles))
+        self.assertEqual(loaded.answer(articles), local.answer(articles))
+
+    def test_store_retrains_only_when_stale(self):
+        engine = create_engine('sqlite:///:memory:')
+        news = labeled_articles(300).assign(outlet='CNN', link=lambda df: [f'https://cnn.example/{i}' for i in range(len(df))])
+        news['hashed_title'] = [hash_value(title) for title in news['title']]
+        news['article_key'] = [article_key(title, outlet, link) for title, outlet, link in zip(news['title'], news['outlet'], news['link'])]
+        add_rows_without_duplicates(news[['title', 'summary', 'outlet', 'link', 'hashed_title', 'article_key']], engine, 'news_rss', ['article_key'])
+        add_rows_without_duplicates(news[['topic', 'individuals', 'sentiment', 'hashed_title', 'article_key']], engine, 'analyzed_rss', ['article_key'])
+        store = AnalyzerStore(engine)
+
+        self.assertFalse(store.retrain(3600, min_examples=1000))
+        self.assertIsNone(store.trained_at())
+        self.assertTrue(store.retrain(3600))
+        trained_at = store.trained_at()
+        self.assertFalse(store.retrain(3600))
+        self.assertEqual(store.trained_at(), trained_at)
+        self.assertTrue(store.retrain(0))
+        self.assertGreater(store.trained_at(), trained_at)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""
+Copyright @emontj 2024
+"""
+
+import json
+import unittest
+from unittest import mock
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine
+
+from production.backend import main
+from tests.test_rollups import store
+
+ANALYSES = [
+    ('CNN', 'tariffs', 'nancy pelosi', 'negative'),
+    ('CNN', 'tariffs', 'nancy pelosi', 'negative'),
+    ('Fox', 'tariffs', 'nancy pelosi', 'positive'),
+    ('Fox', 'budget', 'chuck schumer', 'neutral'),
+    ('NPR', 'budget', 'chuck schumer', 'negative'),
+    ('NPR', 'immigration', 'donald trump', 'negative'),
+]
+
+class TestMain(unittest.TestCase):
+
+    def setUp(self):
+        # The app reads a temporary database instead of instance/ and starts no scheduler
+        self.engine = create_engine('sqlite:///:memory:')
+        patches = [
+            mock.patch.object(SQLAlchemy, 'engine', new_callable=mock.PropertyMock, return_value=self.engine),
+            mock.patch.object(main, 'SCHEDULER_ENABLED', False),
+            mock.patch.object(main, 'migrated', False),
+            mock.patch.object(main, 'response_cache', None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.engine.dispose)
+        self.client = main.app.test_client()
+
+    def test_counts_keep_the_ranked_order(self):
+        self.assertEqual(self.client.get('/counts').status_code, 404)
+        store(self.engine, ANALYSES)
+
+        response = self.client.get('/counts?top_n=2')
+
+        self.assertEqual(response.status_code, 200)
+        counts = json.loads(response.get_data(as_text=True))
+        self.assertEqual(list(counts), ['Individuals', 'Topics', 'Outlets', 'Sentiments'])
+        self.assertEqual(list(counts['Topics'].items()), [('tariffs', 3), ('budget', 2), ('Other', 1)])
+        self.assertEqual(list(counts['Individuals'].items()), [('nancy pelosi', 3), ('chuck schumer', 2), ('Other', 1)])
+        self.assertEqual(list(counts['Sentiments'].items()), [('negative', 4), ('neutral', 1), ('Other', 1)])
+
+if __name__ == '__main__':
+    unittest.main()
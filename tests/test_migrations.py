@@ -0,0 +1,155 @@
+"""
+Copyright @emontj 2024
+"""
+
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine, exc, inspect, text
+
+from production.backend.migrations import MIGRATIONS, migrate, schema_version
+from production.backend.schema import API_QUERIES, metadata
+
+def query_plan(engine, query, params):
+    with engine.connect() as connection:
+        return [row[-1] for row in connection.execute(text(f'EXPLAIN QUERY PLAN {query}'), params)]
+
+def full_scans(plan):
+    return [step for step in plan if step.startswith('SCAN') and 'INDEX' not in step]
+
+# Article tables of the baseline database, instance/Users.sqlite3, as DataFrame.to_sql wrote them:
+# a pandas index column, every value TEXT and no unique index
+BASELINE_DDL = [
+    '''
+    CREATE TABLE news_rss (
+        "index" BIGINT, title TEXT, link TEXT, summary TEXT, published TEXT, updated TEXT, tags TEXT,
+        media_content TEXT, content TEXT, authors TEXT, id TEXT, hashed_title TEXT
+    )
+    ''',
+    'CREATE INDEX ix_news_rss_index ON news_rss ("index")',
+    'CREATE TABLE analyzed_rss ("index" BIGINT, topic TEXT, individuals TEXT, sentiment TEXT, hashed_title TEXT)',
+    'CREATE INDEX ix_analyzed_rss_index ON analyzed_rss ("index")',
+]
+
+def legacy_tables(engine, repeated=True):
+    """
+    Baseline tables holding two articles, and with repeated, the first one and its analysis stored
+    again by an append-only refresh, as in the baseline database.
+    """
+    news = [
+        ('Budget passes', 'https://a.example/1', 'The House voted.', 'Sat, 10 Dec 2022 17:24:17 GMT', 'hash1'),
+        ('Storm nears', 'https://a.example/2', 'Winds pick up.', None, 'hash2'),
+    ]
+    analyzed = [('budget', 'none', 'neutral', 'hash1')]
+    if repeated:
+        news.insert(1, news[0])
+        analyzed.append(analyzed[0])
+
+    with engine.begin() as connection:
+        for statement in BASELINE_DDL:
+            connection.execute(text(statement))
+        connection.execute(
+            text('INSERT INTO news_rss ("index", title, link, summary, published, hashed_title) VALUES (:index, :title, :link, :summary, :published, :hashed_title)'),
+            [dict(zip(['title', 'link', 'summary', 'published', 'hashed_title'], row), index=index) for index, row in enumerate(news)],
+        )
+        connection.execute(
+            text('INSERT INTO analyzed_rss ("index", topic, individuals, sentiment, hashed_title) VALUES (:index, :topic, :individuals, :sentiment, :hashed_title)'),
+            [dict(zip(['topic', 'individuals', 'sentiment', 'hashed_title'], row), index=index) for index, row in enumerate(analyzed)],
+        )
+
+def migrate_in_worker(url):
+    engine = create_engine(url)
+    try:
+        return migrate(engine)
+    finally:
+        engine.dispose()
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_migrates_baseline_tables_in_place(self):
+        # Repeated articles are removed by migration 1, before the unique indexes are built
+        legacy_tables(self.engine)
+
+        self.assertEqual(migrate(self.engine), [version for version, _, _ in MIGRATIONS])
+        self.assertEqual(schema_version(self.engine), MIGRATIONS[-1][0])
+        self.assertEqual(migrate(self.engine), [])
+
+        db_inspector = inspect(self.engine)
+        for table in metadata.tables.values():
+            columns = {col['name']: str(col['type']) for col in db_inspector.get_columns(table.name)}
+            self.assertEqual(columns, {col.name: str(col.type) for col in table.columns})
+
+        with self.engine.connect() as connection:
+            indexes = {row[0] for row in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+        self.assertTrue({index.name for table in metadata.tables.values() for index in table.indexes} <= indexes)
+
+        news = pd.read_sql('SELECT article_key, published_ts FROM news_rss ORDER BY rowid', self.engine)
+        analyzed = pd.read_sql('SELECT article_key FROM analyzed_rss', self.engine)
+        self.assertEqual(len(news), 2)
+        self.assertEqual(news['published_ts'].iloc[0], 1670693057.0)
+        self.assertTrue(pd.isna(news['published_ts'].iloc[1]))
+        self.assertEqual(analyzed['article_key'].tolist(), [news['article_key'].iloc[0]])
+
+    def test_rebuild_aborts_on_conflicting_rows(self):
+        # Rows breaking the declared constraints are never dropped silently by the rebuild
+        legacy_tables(self.engine, repeated=False)
+        migrate(self.engine, MIGRATIONS[:1])
+        with self.engine.begin() as connection:
+            connection.execute(text('DROP INDEX ux_news_rss_article_key'))
+            connection.execute(text("INSERT INTO news_rss (title, article_key) SELECT 'Copy', article_key FROM news_rss"))
+
+        with self.assertRaises(exc.IntegrityError):
+            migrate(self.engine)
+        self.assertEqual(schema_version(self.engine), 1)
+        self.assertEqual(pd.read_sql('SELECT COUNT(*) AS n FROM news_rss', self.engine)['n'].iloc[0], 4)
+        self.assertFalse(inspect(self.engine).has_table('news_rss__old'))
+
+    def test_concurrent_workers_migrate_once(self):
+        # Workers starting together on a legacy file database, as gunicorn starts them
+        with tempfile.TemporaryDirectory() as directory:
+            url = f"sqlite:///{os.path.join(directory, 'legacy.sqlite3')}"
+            engine = create_engine(url)
+            legacy_tables(engine)
+
+            with multiprocessing.get_context('fork').Pool(4) as pool:
+                results = pool.map(migrate_in_worker, [url] * 4)
+
+            versions = [version for version, _, _ in MIGRATIONS]
+            self.assertEqual(sorted(results, key=len), [[], [], [], versions])
+            self.assertEqual(schema_version(engine), versions[-1])
+            self.assertEqual(pd.read_sql('SELECT COUNT(*) AS n FROM news_rss', engine)['n'].iloc[0], 2)
+            engine.dispose()
+
+    def test_interrupted_migration_is_finished(self):
+        legacy_tables(self.engine, repeated=False)
+        # The article_key column was added, then the process died before indexing it
+        with self.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE news_rss ADD COLUMN article_key INTEGER'))
+            connection.execute(text('UPDATE news_rss SET article_key = rowid'))
+
+        self.assertEqual(migrate(self.engine, MIGRATIONS[:1]), [1])
+        self.assertIn('ux_news_rss_article_key', {index['name'] for index in inspect(self.engine).get_indexes('news_rss')})
+        self.assertEqual(migrate(self.engine), [version for version, _, _ in MIGRATIONS[1:]])
+
+    def test_api_queries_use_indexes(self):
+        migrate(self.engine)
+        params = {'topic_name': 'budget', 'match': 'individuals : "harris"*', 'limit': 20, 'after': 0, 'posting_id': 1, 'dimension': 'topic', 'top_n': 10}
+
+        for name, query in API_QUERIES.items():
+            with self.subTest(name):
+                self.assertEqual(full_scans(query_plan(self.engine, query, params)), [])
+
+        # Unindexed lookups are caught
+        self.assertEqual(full_scans(query_plan(self.engine, 'SELECT * FROM analyzed_rss WHERE sentiment = :sentiment', {'sentiment': 'neutral'})), ['SCAN analyzed_rss'])
+
+if __name__ == '__main__':
+    unittest.main()
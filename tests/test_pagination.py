@@ -0,0 +1,93 @@
+"""
+Copyright @emontj 2024
+"""
+
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+from werkzeug.datastructures import MultiDict
+
+from production.backend.collector import add_rows_without_duplicates
+from production.backend.migrations import migrate
+from production.backend.pagination import BEFORE_FIRST, MAX_PAGE_SIZE, Page, decode_cursor, encode_cursor, next_cursor, parse_page
+from production.backend.schema import API_QUERIES
+from production.backend.search import person_match
+
+def store(engine, keys, topic='budget', individuals='kamala harris'):
+    add_rows_without_duplicates(pd.DataFrame({
+        'topic': [topic] * len(keys),
+        'individuals': [individuals] * len(keys),
+        'article_key': list(keys),
+    }), engine, 'analyzed_rss', ['article_key'])
+
+class TestPagination(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        migrate(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def walk(self, name, limit, between_pages=None, **params):
+        """
+        Article keys of every page of a list query, and the number of pages read.
+        """
+        keys = []
+        page = parse_page(MultiDict({'limit': str(limit)}))
+        pages = 0
+
+        while True:
+            with self.engine.connect() as connection:
+                rows = connection.execute(text(API_QUERIES[name]), {**params, 'after': page.after, 'limit': page.limit}).fetchall()
+            pages += 1
+            keys += [row.article_key for row in rows]
+
+            cursor = next_cursor(page, len(rows), rows[-1].row_cursor if rows else None)
+            if cursor is None:
+                return keys, pages
+            page = parse_page(MultiDict({'limit': str(limit), 'after': cursor}))
+            if between_pages is not None:
+                between_pages()
+
+    def test_parse_page(self):
+        self.assertEqual(parse_page(MultiDict()), Page(BEFORE_FIRST, None, False))
+        self.assertEqual(parse_page(MultiDict({'limit': '50', 'after': encode_cursor(7), 'stream': '1'})), Page(7, 50, True))
+        self.assertEqual(parse_page(MultiDict({'limit': '100000'})).limit, MAX_PAGE_SIZE)
+        self.assertEqual(decode_cursor(encode_cursor(2**40)), 2**40)
+
+        for args in ({'after': 'zz'}, {'after': '7'}, {'limit': 'ten'}):
+            with self.subTest(args), self.assertRaises(ValueError):
+                parse_page(MultiDict(args))
+
+    def test_next_cursor(self):
+        self.assertIsNone(next_cursor(Page(BEFORE_FIRST, None, False), 500, 500))
+        self.assertIsNone(next_cursor(Page(BEFORE_FIRST, 10, False), 9, 9))
+        self.assertEqual(next_cursor(Page(BEFORE_FIRST, 10, False), 10, 10), encode_cursor(10))
+
+    def test_pages_cover_every_row_once(self):
+        store(self.engine, range(25))
+        store(self.engine, range(100, 110), topic='tariffs', individuals='chuck schumer')
+
+        for name, params in (('topic', {'topic_name': 'budget'}), ('person', {'match': person_match('harris')})):
+            with self.subTest(name):
+                keys, pages = self.walk(name, 10, **params)
+                self.assertEqual(keys, list(range(25)))
+                self.assertEqual(pages, 3)
+
+        # A full last page is followed by an empty one
+        self.assertEqual(self.walk('topic', 5, topic_name='budget'), (list(range(25)), 6))
+
+    def test_rows_added_while_paging(self):
+        store(self.engine, range(10))
+        added = iter(range(50, 60))
+
+        # Rows stored between requests neither shift earlier pages nor get skipped
+        keys, _ = self.walk('topic', 4, between_pages=lambda: store(self.engine, [next(added)]), topic_name='budget')
+        self.assertEqual(keys[:10], list(range(10)))
+        self.assertEqual(len(keys), len(set(keys)))
+        self.assertTrue(set(keys[10:]) <= set(range(50, 60)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Copyright @emontj 2024
+"""
+
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from production.backend.collector import update_data
+from production.backend.polling import MAX_INTERVAL, MIN_INTERVAL, PollingPlanner, publish_rates
+from production.backend.watermarks import WatermarkStore
+from tests.local_servers import FeedFixtureServer, fixture_sources
+
+NOW = 1_750_000_000.0
+
+def fetched(entries=1, error=None, cache=None):
+    return {'entries': [{}] * entries, 'fetch': {'error': error, 'cache': cache}}
+
+class TestPolling(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        self.sources = {
+            'Busy': {'links': {'politics': 'https://busy.example.com/rss'}, 'mapping': {}},
+            'Quiet': {'links': {'politics': 'https://quiet.example.com/rss'}, 'mapping': {}},
+        }
+        rows = [('Busy', 'politics', NOW - i * 60) for i in range(30)]
+        rows += [('Quiet', 'politics', NOW - i * 86400) for i in range(3)]
+        rows += [('Stale', 'politics', NOW - 30 * 86400), ('Stale', 'politics', NOW - 31 * 86400)]
+        pd.DataFrame(rows, columns=['outlet', 'category', 'published_ts']).to_sql('news_rss', self.engine, index=False)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_publish_rates(self):
+        rates = publish_rates(self.engine, now=NOW)
+
+        self.assertAlmostEqual(rates[('Busy', 'politics')], 1 / 60)
+        self.assertAlmostEqual(rates[('Quiet', 'politics')], 1 / 86400)
+        self.assertNotIn(('Stale', 'politics'), rates)
+
+    def test_intervals_follow_rate_and_bounds(self):
+        planner = PollingPlanner(self.engine)
+        intervals = planner.record({
+            'Busy': {'outlet': 'Busy', 'politics': fetched()},
+            'Quiet': {'outlet': 'Quiet', 'politics': fetched()},
+        }, self.sources, now=NOW)
+
+        self.assertEqual(intervals['https://busy.example.com/rss'], MIN_INTERVAL)
+        self.assertEqual(intervals['https://quiet.example.com/rss'], MAX_INTERVAL)
+
+    def test_backoff_and_reset(self):
+        planner = PollingPlanner(self.engine, min_interval=60, max_interval=3600)
+        link = 'https://busy.example.com/rss'
+
+        def poll(feed):
+            return planner.record({'Busy': {'outlet': 'Busy', 'politics': feed}}, self.sources, now=NOW)[link]
+
+        self.assertEqual(poll(fetched()), 60)
+        self.assertEqual(poll(fetched(cache='hit')), 90)
+        self.assertEqual(poll(fetched(entries=0)), 135)
+        self.assertEqual(poll(fetched(error='ReadTimeout: timed out')), 120)
+        self.assertEqual(poll(fetched(error='ReadTimeout: timed out')), 240)
+        self.assertEqual(planner.load()[link]['failures'], 2)
+        self.assertEqual(poll(fetched()), 60)
+
+    def test_due_sources(self):
+        planner = PollingPlanner(self.engine)
+        planner.record({'Busy': {'outlet': 'Busy', 'politics': fetched()}}, self.sources, now=NOW)
+
+        self.assertEqual(set(planner.due_sources(self.sources, now=NOW + 1)), {'Quiet'})
+        self.assertEqual(set(planner.due_sources(self.sources, now=NOW + MIN_INTERVAL)), {'Busy', 'Quiet'})
+
+    def test_update_data_fetches_only_due_links(self):
+        engine = create_engine('sqlite:///:memory:')
+        planner = PollingPlanner(engine)
+
+        with FeedFixtureServer() as server:
+            sources = fixture_sources(server)
+            first = update_data(sources, engine, concurrent=True, watermark_store=WatermarkStore(engine), planner=planner)
+            requests = len(server.requests)
+            second = update_data(sources, engine, concurrent=True, watermark_store=WatermarkStore(engine), planner=planner)
+
+            self.assertEqual(len(server.requests), requests)
+
+        self.assertEqual(len(first), 5)
+        self.assertEqual(second, {})
+        stored = pd.read_sql('SELECT category, published_ts FROM news_rss', engine)
+        self.assertEqual(len(stored), 16)
+        self.assertTrue((stored['category'] == 'politics').all())
+        self.assertTrue(stored['published_ts'].notna().all())
+        self.assertEqual({state['last_result'] for state in planner.load().values()}, {'new'})
+        engine.dispose()
+
+if __name__ == '__main__':
+    unittest.main()
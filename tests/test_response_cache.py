@@ -0,0 +1,101 @@
+"""
+Copyright @emontj 2024
+"""
+
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+from werkzeug.datastructures import MultiDict
+
+from production.backend.collector import add_rows_without_duplicates
+from production.backend.migrations import migrate
+from production.backend.response_cache import ResponseCache, SharedResponseStore, dataset_generation, response_key, strong_etag
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'responses.sqlite3')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_generation_bumped_by_writes(self):
+        engine = create_engine('sqlite:///:memory:')
+        migrate(engine)
+
+        def generation():
+            with engine.connect() as connection:
+                return dataset_generation(connection)
+
+        seen = [generation()]
+        add_rows_without_duplicates(pd.DataFrame({'title': ['Budget passes'], 'outlet': ['CNN'], 'article_key': [1]}), engine, 'news_rss', ['article_key'])
+        seen.append(generation())
+        add_rows_without_duplicates(pd.DataFrame({'topic': ['budget'], 'article_key': [1]}), engine, 'analyzed_rss', ['article_key'])
+        seen.append(generation())
+        add_rows_without_duplicates(pd.DataFrame({'topic': ['tariffs'], 'article_key': [1]}), engine, 'analyzed_rss', ['article_key'], update=True)
+        seen.append(generation())
+        with engine.begin() as connection:
+            connection.execute(text('DELETE FROM analyzed_rss'))
+        seen.append(generation())
+        # Reads leave it alone
+        with engine.connect() as connection:
+            connection.execute(text('SELECT * FROM analyzed_rss')).fetchall()
+        seen.append(generation())
+
+        self.assertTrue(all(earlier < later for earlier, later in zip(seen[:-1], seen[1:-1])))
+        self.assertEqual(seen[-1], seen[-2])
+        engine.dispose()
+
+    def test_keys_and_etags(self):
+        self.assertEqual(response_key('/counts', MultiDict([('a', '1'), ('b', '2')]), 3), response_key('/counts', MultiDict([('b', '2'), ('a', '1')]), 3))
+        self.assertNotEqual(response_key('/counts', MultiDict(), 3), response_key('/counts', MultiDict(), 4))
+        self.assertNotEqual(response_key('/counts', MultiDict(), 3), response_key('/topic/budget', MultiDict(), 3))
+        self.assertEqual(strong_etag(b'{}'), strong_etag(b'{}'))
+        self.assertNotEqual(strong_etag(b'{}'), strong_etag(b'[]'))
+
+    def test_lru_limits_and_generations(self):
+        cache = ResponseCache(max_entries=2, max_bytes=10)
+
+        cache.put('a', 1, 200, b'aaaa', 'application/json')
+        cache.put('b', 1, 200, b'bbbb', 'application/json')
+        self.assertIsNotNone(cache.get('a', 1))
+        cache.put('c', 1, 200, b'cccc', 'application/json')
+        # b was least recently used
+        self.assertEqual([key for key in 'abc' if cache.get(key, 1) is not None], ['a', 'c'])
+
+        cache.put('d', 1, 200, b'd' * 8, 'application/json')
+        self.assertEqual(cache.stats()['entries'], 1)
+        cache.put('e', 1, 200, b'e' * 11, 'application/json')
+        self.assertIsNone(cache.get('e', 1))
+
+        # A newer generation empties the cache; responses computed for an older one are not kept
+        self.assertIsNone(cache.get('d', 2))
+        cache.put('a', 1, 200, b'aaaa', 'application/json')
+        self.assertEqual(cache.stats()['entries'], 0)
+
+        stats = cache.stats()
+        self.assertEqual((stats['memory'], stats['miss']), (3, 3))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_shared_between_workers(self):
+        first = ResponseCache(shared=SharedResponseStore(self.path))
+        second = ResponseCache(shared=SharedResponseStore(self.path))
+
+        stored = first.put('counts', 1, 200, b'{"Topics": {}}', 'application/json')
+        self.assertEqual(second.get('counts', 1), stored)
+        self.assertEqual(second.get('counts', 1), stored)
+        self.assertEqual({key: second.stats()[key] for key in ('memory', 'shared', 'miss')}, {'memory': 1, 'shared': 1, 'miss': 0})
+
+        # Storing a newer generation drops the older ones from the file
+        first.put('topic', 2, 404, b'{}', 'application/json')
+        self.assertIsNone(ResponseCache(shared=SharedResponseStore(self.path)).get('counts', 1))
+
+        for cache in (first, second):
+            cache.shared.engine.dispose()
+
+if __name__ == '__main__':
+    unittest.main()
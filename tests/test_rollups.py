@@ -0,0 +1,105 @@
+"""
+Copyright @emontj 2024
+"""
+
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from production.backend.collector import add_rows_without_duplicates
+from production.backend.migrations import MIGRATIONS, migrate
+from production.backend.rollups import parse_top_n, top_counts
+
+ANALYSES = [
+    ('CNN', 'budget', 'chuck schumer', 'neutral'),
+    ('CNN', 'budget', 'kamala harris', 'positive'),
+    ('Fox', 'budget', 'kamala harris', 'negative'),
+    ('Fox', 'immigration', 'kamala harris', 'negative'),
+    ('NPR', 'climate', None, 'neutral'),
+]
+
+def store(engine, analyses, first_key=0):
+    keys = range(first_key, first_key + len(analyses))
+    add_rows_without_duplicates(pd.DataFrame({
+        'title': [f'Article {key}' for key in keys],
+        'outlet': [outlet for outlet, _, _, _ in analyses],
+        'hashed_title': [f'hash{key}' for key in keys],
+        'article_key': keys,
+    }), engine, 'news_rss', ['article_key'])
+    add_rows_without_duplicates(pd.DataFrame({
+        'topic': [topic for _, topic, _, _ in analyses],
+        'individuals': [individuals for _, _, individuals, _ in analyses],
+        'sentiment': [sentiment for _, _, _, sentiment in analyses],
+        'hashed_title': [f'hash{key}' for key in keys],
+        'article_key': keys,
+    }), engine, 'analyzed_rss', ['article_key'])
+
+class TestRollups(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def counts(self, dimension, top_n=10):
+        with self.engine.connect() as connection:
+            return top_counts(connection, dimension, top_n)
+
+    def grouped(self, dimension):
+        # What /counts used to compute: a GROUP BY over every analysis
+        column = {'individuals': 'individuals', 'topic': 'topic', 'sentiment': 'sentiment', 'outlet': 'news_rss.outlet'}[dimension]
+        with self.engine.connect() as connection:
+            rows = connection.execute(text(f'''
+                SELECT {column}, COUNT(*) FROM analyzed_rss JOIN news_rss ON news_rss.article_key = analyzed_rss.article_key
+                WHERE {column} IS NOT NULL GROUP BY {column}
+            ''')).fetchall()
+        return dict(rows)
+
+    def assert_consistent(self):
+        for dimension in ('individuals', 'topic', 'sentiment', 'outlet'):
+            self.assertEqual(self.counts(dimension, top_n=100), self.grouped(dimension), dimension)
+
+    def test_top_n_and_other(self):
+        migrate(self.engine)
+        store(self.engine, ANALYSES)
+
+        self.assertEqual(self.counts('topic', top_n=1), {'budget': 3, 'Other': 2})
+        self.assertEqual(list(self.counts('topic', top_n=2)), ['budget', 'climate', 'Other'])
+        self.assertEqual(self.counts('individuals', top_n=2), {'kamala harris': 3, 'chuck schumer': 1})
+        self.assertEqual(self.counts('outlet'), {'CNN': 2, 'Fox': 2, 'NPR': 1})
+        self.assertEqual(self.counts('missing'), {})
+        self.assertEqual([parse_top_n(value) for value in (None, 'x', '3', '0', '1000')], [10, 10, 3, 1, 100])
+
+    def test_rollups_follow_analyzed_rss(self):
+        migrate(self.engine, MIGRATIONS[:-1])
+        store(self.engine, ANALYSES[:3])
+        migrate(self.engine)
+        self.assert_consistent()
+
+        store(self.engine, ANALYSES[3:], first_key=3)
+        self.assert_consistent()
+
+        add_rows_without_duplicates(pd.DataFrame({'individuals': ['j.d. vance'], 'topic': ['tariffs'], 'article_key': [0]}), self.engine, 'analyzed_rss', ['article_key'], update=True)
+        self.assert_consistent()
+        self.assertNotIn('chuck schumer', self.counts('individuals'))
+
+        with self.engine.begin() as connection:
+            connection.execute(text('DELETE FROM analyzed_rss WHERE article_key IN (3, 4)'))
+        self.assert_consistent()
+        self.assertEqual(self.counts('outlet'), {'CNN': 2, 'Fox': 1})
+
+    def test_rollup_rows_are_dropped_at_zero(self):
+        migrate(self.engine)
+        store(self.engine, ANALYSES[:1])
+
+        with self.engine.begin() as connection:
+            connection.execute(text('DELETE FROM analyzed_rss'))
+            remaining = connection.execute(text('SELECT COUNT(*) FROM analysis_counts')).scalar()
+
+        self.assertEqual(remaining, 0)
+        self.assertEqual(self.counts('topic'), {})
+
+if __name__ == '__main__':
+    unittest.main()
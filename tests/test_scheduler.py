@@ -0,0 +1,171 @@
+"""
+Copyright @emontj 2024
+"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from sqlalchemy import create_engine
+
+from production.backend.scheduler import FeedScheduler, LeaseLock
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        # A file database so that every engine sees the same leases, like gunicorn workers do
+        self.directory = tempfile.TemporaryDirectory()
+        self.url = f"sqlite:///{os.path.join(self.directory.name, 'scheduler.sqlite3')}"
+        self.engines = []
+
+    def tearDown(self):
+        for engine in self.engines:
+            engine.dispose()
+        self.directory.cleanup()
+
+    def engine(self):
+        engine = create_engine(self.url)
+        self.engines.append(engine)
+        return engine
+
+    def test_lease_has_one_holder(self):
+        first = LeaseLock(self.engine(), 'refresh', holder='worker-1', ttl=60)
+        second = LeaseLock(self.engine(), 'refresh', holder='worker-2', ttl=60)
+
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        self.assertTrue(first.acquire())
+
+        first.release()
+        self.assertTrue(second.acquire())
+        self.assertEqual(first.current()['holder'], 'worker-2')
+
+    def test_expired_lease_is_taken_over(self):
+        first = LeaseLock(self.engine(), 'refresh', holder='worker-1', ttl=0.05)
+        second = LeaseLock(self.engine(), 'refresh', holder='worker-2', ttl=60)
+
+        self.assertTrue(first.acquire())
+        time.sleep(0.1)
+        self.assertTrue(second.acquire())
+        self.assertFalse(first.acquire())
+
+    def test_one_worker_runs_each_interval(self):
+        runs = []
+
+        def slow_step():
+            runs.append(threading.current_thread().name)
+            time.sleep(0.2)
+
+        schedulers = [
+            FeedScheduler(self.engine(), [('collect', slow_step)], interval=60, holder=f'worker-{i}')
+            for i in range(4)
+        ]
+        results = []
+        threads = [threading.Thread(target=lambda s=s: results.append(s.run_pending())) for s in schedulers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(results.count(True), 1)
+        self.assertFalse(schedulers[0].run_pending())
+
+        status = schedulers[1].status()
+        self.assertGreaterEqual(status['last_duration'], 0.2)
+        self.assertAlmostEqual(status['next_run_at'], status['last_started_at'] + 60)
+        self.assertIsNone(status['last_error'])
+        self.assertIsNone(status['lease_holder'])
+        self.assertEqual(status['this_process'], 'worker-1')
+
+    def test_threads_of_one_process_never_share_a_run(self):
+        runs = []
+        started = threading.Event()
+
+        def slow_step():
+            runs.append(threading.current_thread().name)
+            started.set()
+            time.sleep(0.2)
+
+        # The background thread and a request thread of one worker: the same scheduler, and the same
+        # process identity for a second scheduler
+        shared = FeedScheduler(self.engine(), [('collect', slow_step)], interval=60)
+        same_process = FeedScheduler(self.engine(), [('collect', slow_step)], interval=60)
+        background = threading.Thread(target=shared.run_pending, kwargs={'force': True})
+        background.start()
+        self.assertTrue(started.wait(5))
+
+        self.assertFalse(shared.run_pending(force=True))
+        self.assertFalse(same_process.run_pending(force=True))
+        self.assertEqual(same_process.run_exclusive('analyze', lambda: 'overlap'), (False, None))
+        background.join()
+
+        self.assertEqual(len(runs), 1)
+        self.assertTrue(same_process.run_pending(force=True))
+
+    def test_renewed_lease_outlives_its_ttl(self):
+        scheduler = FeedScheduler(self.engine(), [], interval=60, lease_ttl=0.2, holder='worker-1')
+        other = FeedScheduler(self.engine(), [], interval=60, lease_ttl=0.2, holder='worker-2')
+        taken = []
+
+        def long_task():
+            for _ in range(4):
+                time.sleep(0.1)
+                self.assertTrue(scheduler.renew())
+                taken.append(other.run_exclusive('analyze', lambda: 'overlap')[0])
+            return 'done'
+
+        self.assertFalse(scheduler.renew())
+        self.assertEqual(scheduler.run_exclusive('analyze', long_task), (True, 'done'))
+        self.assertEqual(taken, [False] * 4)
+        self.assertFalse(scheduler.renew())
+
+    def test_exclusive_task_never_overlaps_runs(self):
+        outcomes = {}
+
+        def exclusive(scheduler, key):
+            outcomes[key] = scheduler.run_exclusive('analyze', lambda: key)
+
+        # A scheduled run keeps exclusive tasks out, the same worker's included
+        worker_2 = FeedScheduler(self.engine(), [], interval=60, holder='worker-2')
+        worker_1 = FeedScheduler(self.engine(), [
+            ('analyze', lambda: exclusive(worker_1, 'same worker')),
+            ('collect', lambda: exclusive(worker_2, 'other worker')),
+        ], interval=60, holder='worker-1')
+        self.assertTrue(worker_1.run_pending())
+        self.assertEqual(outcomes, {'same worker': (False, None), 'other worker': (False, None)})
+
+        # An exclusive task keeps scheduled runs and other exclusive tasks out until it finishes
+        def inner():
+            self.assertFalse(worker_1.run_pending(force=True))
+            exclusive(worker_1, 'nested')
+            return 'done'
+
+        self.assertEqual(worker_2.run_exclusive('analyze', inner), (True, 'done'))
+        self.assertEqual(outcomes['nested'], (False, None))
+        self.assertEqual(worker_1.run_exclusive('analyze', lambda: 'free again'), (True, 'free again'))
+
+    def test_failed_step_is_recorded(self):
+        def failing_step():
+            raise ValueError('feed down')
+
+        scheduler = FeedScheduler(self.engine(), [('collect', failing_step)], interval=60, holder='worker-1')
+
+        self.assertTrue(scheduler.run_pending())
+        self.assertIn('ValueError: feed down', scheduler.status()['last_error'])
+        self.assertEqual(scheduler.status()['holder'], 'worker-1')
+
+    def test_background_thread(self):
+        ran = threading.Event()
+        scheduler = FeedScheduler(self.engine(), [('collect', ran.set)], interval=60, tick=0.01)
+
+        scheduler.start()
+        self.assertTrue(ran.wait(5))
+        self.assertTrue(scheduler.status()['running'])
+        scheduler.stop()
+        self.assertFalse(scheduler.status()['running'])
+
+if __name__ == '__main__':
+    unittest.main()
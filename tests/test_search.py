@@ -0,0 +1,92 @@
+"""
+Copyright @emontj 2024
+"""
+
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from production.backend.collector import add_rows_without_duplicates
+from production.backend.migrations import MIGRATIONS, migrate
+from production.backend.pagination import BEFORE_FIRST
+from production.backend.schema import API_QUERIES
+from production.backend.search import person_match, search_limit, search_match
+
+ARTICLES = [
+    ('Harris visits border town', 'The vice president met local officials.', 'immigration', 'kamala harris'),
+    ('Senate passes budget', 'Schumer praised the vote; Harris was not present.', 'budget', 'chuck schumer'),
+    ('Harrison Ford honored', 'The actor received an award.', 'film', 'harrison ford'),
+]
+
+def store(engine, articles, first_key=0):
+    keys = range(first_key, first_key + len(articles))
+    add_rows_without_duplicates(pd.DataFrame({
+        'title': [title for title, _, _, _ in articles],
+        'summary': [summary for _, summary, _, _ in articles],
+        'outlet': ['CNN'] * len(articles),
+        'hashed_title': [f'hash{key}' for key in keys],
+        'article_key': keys,
+    }), engine, 'news_rss', ['article_key'])
+    add_rows_without_duplicates(pd.DataFrame({
+        'topic': [topic for _, _, topic, _ in articles],
+        'individuals': [individuals for _, _, _, individuals in articles],
+        'sentiment': ['neutral'] * len(articles),
+        'hashed_title': [f'hash{key}' for key in keys],
+        'article_key': keys,
+    }), engine, 'analyzed_rss', ['article_key'])
+
+class TestSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def query(self, name, **params):
+        # Every row, for the paginated queries
+        params = {'after': BEFORE_FIRST, 'limit': -1, **params}
+        with self.engine.connect() as connection:
+            return [dict(row) for row in connection.execute(text(API_QUERIES[name]), params).mappings()]
+
+    def test_match_expressions(self):
+        self.assertEqual(person_match('Kamala Har'), 'individuals : "kamala har"*')
+        self.assertEqual(search_match('harris" OR border*'), '"harris"* "or"* "border"*')
+        self.assertIsNone(person_match(' "*'))
+        self.assertIsNone(search_match(''))
+        self.assertEqual([search_limit(value) for value in (None, 'x', '5', '0', '1000')], [20, 20, 5, 1, 100])
+
+    def test_person_and_search(self):
+        migrate(self.engine)
+        store(self.engine, ARTICLES)
+
+        self.assertEqual([row['article_key'] for row in self.query('person', match=person_match('kamala har'))], [0])
+        self.assertEqual(sorted(row['article_key'] for row in self.query('person', match=person_match('harris'))), [0, 2])
+
+        results = self.query('search', match=search_match('harris'), limit=20)
+        # Matches in individuals and the title outrank a mention in the summary
+        self.assertEqual(sorted(row['article_key'] for row in results[:2]), [0, 2])
+        self.assertEqual(results[2]['article_key'], 1)
+        self.assertEqual([row['title'] for row in self.query('search', match=search_match('harris border'), limit=20)], ['Harris visits border town'])
+        self.assertEqual(len(self.query('search', match=search_match('harris'), limit=2)), 2)
+        self.assertEqual([row['article_key'] for row in self.query('search', match=search_match('harris budg'), limit=20)], [1])
+
+    def test_index_follows_analyzed_rss(self):
+        migrate(self.engine, MIGRATIONS[:2])
+        store(self.engine, ARTICLES[:1])
+        migrate(self.engine)
+        self.assertEqual(len(self.query('person', match=person_match('harris'))), 1)
+
+        store(self.engine, ARTICLES[1:], first_key=1)
+        # The rows the index triggers write are not counted as stored
+        self.assertEqual(add_rows_without_duplicates(pd.DataFrame({'individuals': ['j.d. vance'], 'article_key': [0]}), self.engine, 'analyzed_rss', ['article_key'], update=True), 1)
+        self.assertEqual([row['article_key'] for row in self.query('person', match=person_match('vance'))], [0])
+        self.assertEqual([row['article_key'] for row in self.query('person', match=person_match('harris'))], [2])
+
+        with self.engine.begin() as connection:
+            connection.execute(text('DELETE FROM analyzed_rss WHERE article_key = 2'))
+        self.assertEqual(self.query('person', match=person_match('harris')), [])
+
+if __name__ == '__main__':
+    unittest.main()
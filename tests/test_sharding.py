@@ -0,0 +1,56 @@
+"""
+Copyright @emontj 2024
+"""
+
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from production.backend.sharding import HashRing, collect_sharded, shard_sources
+from tests.local_servers import FeedFixtureServer, fixture_sources
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        mapping = {'title': 'title', 'link': 'link'}
+        self.sources = {
+            f'Outlet {i}': {'links': {f'category {j}': f'https://outlet{i}.example.com/{j}.rss' for j in range(10)}, 'mapping': mapping}
+            for i in range(100)
+        }
+        self.links = [link for source in self.sources.values() for link in source['links'].values()]
+
+    def test_every_link_has_one_shard(self):
+        shards = shard_sources(self.sources, 4)
+        sharded = [link for shard in shards for source in shard.values() for link in source['links'].values()]
+
+        self.assertEqual(sorted(sharded), sorted(self.links))
+        for shard in shards:
+            self.assertGreater(len(shard), 0)
+            self.assertLess(sum(len(source['links']) for source in shard.values()), len(self.links) / 2)
+
+    def test_adding_a_node_moves_few_keys(self):
+        before = HashRing(range(4))
+        after = HashRing(range(5))
+        moved = sum(before.node_for(link) != after.node_for(link) for link in self.links)
+
+        self.assertLess(moved, len(self.links) * 0.35)  # Ideally 1/5; modulo hashing would move 4/5
+        self.assertTrue(all(after.node_for(link) == 4 for link in self.links if before.node_for(link) != after.node_for(link)))
+
+    def test_collect_sharded(self):
+        with tempfile.TemporaryDirectory() as directory, FeedFixtureServer() as server:
+            url = f"sqlite:///{os.path.join(directory, 'news.sqlite3')}"
+            report = collect_sharded(fixture_sources(server), url, workers=3)
+
+            engine = create_engine(url)
+            stored = pd.read_sql('SELECT outlet, category FROM news_rss', engine)
+            engine.dispose()
+
+        self.assertEqual(len(stored), 16)
+        self.assertEqual(len(report), 5)
+        self.assertEqual(sum(summary['entries_new'] for summary in report.values()), 16)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""
+Copyright @emontj 2024
+"""
+
+import copy
+import json
+import os
+import tempfile
+import unittest
+
+from production.backend.collector import RSS_FIELDS
+from production.backend.source_configs import MAPPING_FIELDS, PRODUCTION_NEWS_SOURCES, load_news_sources, validate_news_sources
+
+class TestSourceConfigs(unittest.TestCase):
+
+    def test_registry_loads(self):
+        self.assertEqual(list(PRODUCTION_NEWS_SOURCES), ['CNN', 'Fox News', 'Washington Post', 'NYT', 'Guardian'])
+        self.assertEqual(PRODUCTION_NEWS_SOURCES['Guardian']['links']['politics'], 'https://www.theguardian.com/politics/rss')
+        self.assertEqual(MAPPING_FIELDS, RSS_FIELDS)
+
+    def test_load_from_path(self):
+        sources = {'Example': copy.deepcopy(PRODUCTION_NEWS_SOURCES['CNN'])}
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'sources.json')
+            with open(path, 'w') as f:
+                json.dump(sources, f)
+
+            self.assertEqual(load_news_sources(path), sources)
+
+    def test_invalid_sources_are_rejected(self):
+        def broken(change):
+            sources = copy.deepcopy(PRODUCTION_NEWS_SOURCES)
+            change(sources)
+            return sources
+
+        cases = {
+            'missing mapping field': lambda s: s['CNN']['mapping'].pop('id'),
+            'unknown mapping field': lambda s: s['CNN']['mapping'].update(byline='author'),
+            'non-string mapping key': lambda s: s['CNN']['mapping'].update(title=1),
+            'no links': lambda s: s['CNN'].update(links={}),
+            'not a url': lambda s: s['CNN']['links'].update(politics='rss.cnn.com'),
+            'duplicate link': lambda s: s['NYT']['links'].update(world=s['CNN']['links']['politics']),
+            'extra key': lambda s: s['CNN'].update(enabled=True),
+        }
+
+        for name, change in cases.items():
+            with self.assertRaises(ValueError, msg=name):
+                validate_news_sources(broken(change))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+Copyright @emontj 2024
+"""
+
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine, event
+
+from production.backend.analyzer import run_analysis
+from production.backend.collector import add_rows_without_duplicates, article_key, hash_value
+from production.backend.llm_backends import StubBackend
+from production.backend.story_clusters import MinHasher, StoryClusterIndex, cluster_coverage, similarity, story_text
+
+STORY = (
+    'Senate passes stopgap bill to avert government shutdown',
+    'The Senate voted 77-19 on Saturday to fund the government through mid-December, sending the measure to the president hours before the deadline.',
+)
+EDITED_STORY = (
+    'Senate passes stopgap bill to avert a government shutdown',
+    '<p>The Senate voted 77-19 late Saturday to fund the government through mid-December, sending the measure to President Biden hours before the deadline.</p>',
+)
+OTHER_STORY = (
+    'Hurricane makes landfall on the Gulf Coast',
+    'Forecasters warned of a life-threatening storm surge as the hurricane moved inland overnight, leaving thousands without power.',
+)
+
+def articles(stories):
+    """
+    Builds news_rss rows from (outlet, (title, summary)) pairs.
+    """
+    rows = [
+        {'title': title, 'summary': summary, 'outlet': outlet, 'link': f'https://{outlet.lower()}.example/{i}'}
+        for i, (outlet, (title, summary)) in enumerate(stories)
+    ]
+    df = pd.DataFrame(rows)
+    df['hashed_title'] = [hash_value(title) for title in df['title']]
+    df['article_key'] = [article_key(row['title'], row['outlet'], row['link']) for row in rows]
+    return df
+
+class TestStoryClusters(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_signature_similarity(self):
+        hasher = MinHasher()
+        story, edited, other = (hasher.signature(story_text(*text)) for text in (STORY, EDITED_STORY, OTHER_STORY))
+
+        self.assertEqual(similarity(story, hasher.signature(story_text(*STORY))), 1.0)
+        self.assertGreater(similarity(story, edited), 0.6)
+        self.assertLess(similarity(story, other), 0.2)
+
+    def test_assign_clusters_near_duplicates(self):
+        index = StoryClusterIndex(self.engine)
+        df = articles([('CNN', STORY), ('NYT', EDITED_STORY), ('Guardian', OTHER_STORY), ('Fox News', STORY)])
+
+        clusters = index.assign(df, now=1000)
+        keys = df['article_key'].tolist()
+
+        self.assertEqual(clusters[keys[0]], keys[0])
+        self.assertEqual(clusters[keys[1]], keys[0])
+        self.assertEqual(clusters[keys[3]], keys[0])
+        self.assertEqual(clusters[keys[2]], keys[2])
+        self.assertEqual(index.assign(df, now=2000), clusters)
+
+        self.assertEqual(cluster_coverage(self.engine, [keys[0], keys[2]]), {keys[0]: 3, keys[2]: 1})
+
+    def test_window_limits_matching(self):
+        index = StoryClusterIndex(self.engine, window=100)
+        first = articles([('CNN', STORY)])
+        index.assign(first, now=1000)
+
+        late = articles([('NYT', EDITED_STORY)])
+        later = articles([('Guardian', EDITED_STORY)])
+
+        self.assertEqual(index.assign(late, now=1050), {late['article_key'][0]: first['article_key'][0]})
+        self.assertEqual(index.assign(later, now=1200), {later['article_key'][0]: later['article_key'][0]})
+
+    def test_window_read_once_per_index(self):
+        index = StoryClusterIndex(self.engine, window=100)
+        window_reads = []
+        event.listen(self.engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: window_reads.append(statement) if 'clustered_at >=' in statement else None)
+
+        first = articles([('CNN', STORY)])
+        index.assign(first, now=1000)
+        # Rounds after the first match against the articles it kept, including ones it assigned
+        for outlet, now in (('NYT', 1010), ('Fox News', 1020)):
+            copy = articles([(outlet, EDITED_STORY)])
+            self.assertEqual(index.assign(copy, now=now), {copy['article_key'][0]: first['article_key'][0]})
+        self.assertEqual(len(window_reads), 1)
+
+        # A fresh index sees what this one stored; an earlier now needs older rows and reads the window again
+        self.assertEqual(len(StoryClusterIndex(self.engine, window=100).assign(articles([('AP', OTHER_STORY)]), now=1030)), 1)
+        index.assign(articles([('BBC', OTHER_STORY)]), now=900)
+        self.assertEqual(len(window_reads), 3)
+
+    def test_run_analysis_analyzes_each_story_once(self):
+        index = StoryClusterIndex(self.engine)
+        backend = StubBackend()
+        add_rows_without_duplicates(articles([('CNN', STORY), ('NYT', EDITED_STORY), ('Guardian', OTHER_STORY)]), self.engine, 'news_rss', ['article_key'])
+
+        analyzed_df = run_analysis(self.engine, backend=backend, clusters=index)
+
+        self.assertEqual(backend.stats()['calls'], 2)
+        self.assertEqual(sorted(analyzed_df['topic']), ['coast', 'shutdown', 'shutdown'])
+        self.assertEqual(analyzed_df['cluster_id'].nunique(), 2)
+
+        # A copy arriving later takes the stored analysis of its story
+        late = articles([('Fox News', STORY)]).assign(link='https://foxnews.example/late')
+        late['article_key'] = [article_key(STORY[0], 'Fox News', 'https://foxnews.example/late')]
+        add_rows_without_duplicates(late, self.engine, 'news_rss', ['article_key'])
+
+        analyzed_df = run_analysis(self.engine, backend=backend, clusters=index)
+
+        self.assertEqual(backend.stats()['calls'], 2)
+        self.assertEqual(analyzed_df['topic'].tolist(), ['shutdown'])
+        stored = pd.read_sql('SELECT cluster_id FROM analyzed_rss', self.engine)
+        self.assertEqual(len(stored), 4)
+        self.assertEqual(stored['cluster_id'].nunique(), 2)
+
+if __name__ == '__main__':
+    unittest.main()
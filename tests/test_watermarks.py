@@ -0,0 +1,62 @@
+"""
+Copyright @emontj 2024
+"""
+
+import unittest
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from production.backend.collector import update_data
+from production.backend.watermarks import WatermarkStore, filter_new_entries, parse_published
+from tests.local_servers import FeedFixtureServer, fixture_sources
+
+MAPPING = {'title': 'title', 'published': 'published', 'id': 'id', 'link': 'link'}
+
+class TestWatermarks(unittest.TestCase):
+
+    def setUp(self):
+        self.entries = [
+            {'title': 'Older', 'published': 'Mon, 09 Dec 2024 10:00:00 GMT', 'id': 'a'},
+            {'title': 'Newer', 'published': '2024-12-09T12:00:00Z', 'id': 'b'},
+        ]
+
+    def test_parse_published(self):
+        self.assertEqual(parse_published('Mon, 09 Dec 2024 12:00:00 GMT'), parse_published('2024-12-09T12:00:00Z'))
+        self.assertEqual(parse_published('Mon, 09 Dec 2024 07:00:00 -0500'), parse_published('2024-12-09T12:00:00+00:00'))
+        self.assertIsNone(parse_published('not a date'))
+        self.assertIsNone(parse_published(None))
+
+    def test_filter_new_entries(self):
+        new_entries, watermark = filter_new_entries(self.entries, None, MAPPING)
+        self.assertEqual(len(new_entries), 2)
+        self.assertEqual(watermark['published_max'], parse_published('2024-12-09T12:00:00Z'))
+
+        new_entries, watermark = filter_new_entries(self.entries, watermark, MAPPING)
+        self.assertEqual(new_entries, [])
+
+        later = self.entries + [
+            {'title': 'Latest', 'published': '2024-12-09T13:00:00Z', 'id': 'c'},
+            {'title': 'Backdated', 'published': '2024-12-09T11:00:00Z', 'id': 'd'},
+            {'title': 'Same second', 'published': '2024-12-09T12:00:00Z', 'id': 'e'},
+        ]
+        new_entries, watermark = filter_new_entries(later, watermark, MAPPING)
+        self.assertEqual([entry['title'] for entry in new_entries], ['Latest', 'Same second'])
+        self.assertEqual(watermark['recent_ids'], ['a', 'b', 'c', 'd', 'e'])
+
+    def test_steady_state_refresh_writes_nothing(self):
+        engine = create_engine('sqlite:///:memory:')
+
+        with FeedFixtureServer(validators=False) as server:
+            sources = fixture_sources(server)
+            first = update_data(sources, engine, concurrent=True, watermark_store=WatermarkStore(engine))
+            second = update_data(sources, engine, concurrent=True, watermark_store=WatermarkStore(engine))
+
+        self.assertEqual(first['CNN']['entries_new'], 4)
+        self.assertEqual(second['CNN']['entries_new'], 0)
+        self.assertEqual(second['CNN']['entries_skipped'], 4)
+        self.assertEqual(len(pd.read_sql('SELECT * FROM news_rss', engine)), 16)
+        engine.dispose()
+
+if __name__ == '__main__':
+    unittest.main()